@@ -0,0 +1,245 @@
+"""
+Almacenamiento de PDFs de cotizaciones direccionado por contenido.
+
+Cada PDF se identifica por el SHA-256 de sus bytes y se guarda comprimido con
+zlib en el backend elegido con PDF_STORAGE:
+
+- "bd" (por defecto): tabla blobs_pdf, fuera de la tabla de cotizaciones.
+- "archivos": directorio PDF_STORAGE_DIR (un volumen compartido).
+- "objetos": un object store con API tipo S3 (put_object/get_object). Sin
+  cliente configurado se usa ClienteObjetosLocal, que lo emula en disco.
+
+Cotizacion.pdf_ref guarda solo el hash.
+"""
+
+import hashlib
+import os
+import threading
+import zlib
+
+import click
+from flask.cli import with_appcontext
+
+from database import db
+from migraciones import aplicar_migraciones
+from models import BlobPDF, Cotizacion
+
+PDF_STORAGE = os.getenv("PDF_STORAGE", "bd")
+PDF_STORAGE_DIR = os.getenv("PDF_STORAGE_DIR", os.path.join("cotizador_api", "pdfs"))
+PDF_STORAGE_BUCKET = os.getenv("PDF_STORAGE_BUCKET", "cotizaciones")
+PDF_STORAGE_BUCKET_DIR = os.getenv(
+    "PDF_STORAGE_BUCKET_DIR", os.path.join("cotizador_api", "objetos")
+)
+
+
+def hash_pdf(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+
+def _escribir_atomico(ruta, contenido):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(contenido)
+    os.replace(tmp, ruta)
+
+
+class AlmacenamientoBD:
+    """Guarda los PDFs en la tabla blobs_pdf de la base de datos."""
+
+    def guardar(self, datos):
+        ref = hash_pdf(datos)
+        if not self.existe(ref):
+            db.session.add(
+                BlobPDF(hash=ref, datos=zlib.compress(datos), tamano=len(datos))
+            )
+            db.session.flush()
+        return ref
+
+    def obtener(self, ref):
+        blob = db.session.get(BlobPDF, ref)
+        if not blob:
+            raise KeyError(ref)
+        return zlib.decompress(blob.datos)
+
+    def existe(self, ref):
+        return db.session.query(BlobPDF.hash).filter_by(hash=ref).first() is not None
+
+    def eliminar(self, ref):
+        BlobPDF.query.filter_by(hash=ref).delete()
+
+
+class AlmacenamientoArchivos:
+    """Guarda los PDFs en un directorio, repartidos por prefijo del hash."""
+
+    def __init__(self, ruta_base):
+        self.ruta_base = ruta_base
+
+    def _ruta(self, ref):
+        return os.path.join(self.ruta_base, ref[:2], ref[2:4], ref + ".pdf.z")
+
+    def guardar(self, datos):
+        ref = hash_pdf(datos)
+        if not self.existe(ref):
+            _escribir_atomico(self._ruta(ref), zlib.compress(datos))
+        return ref
+
+    def obtener(self, ref):
+        try:
+            with open(self._ruta(ref), "rb") as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            raise KeyError(ref)
+
+    def existe(self, ref):
+        return os.path.exists(self._ruta(ref))
+
+    def eliminar(self, ref):
+        try:
+            os.remove(self._ruta(ref))
+        except FileNotFoundError:
+            pass
+
+
+class ClienteObjetosLocal:
+    """
+    Sustituto local de un cliente S3 (boto3) con el subconjunto de métodos
+    que usa AlmacenamientoObjetos. Cada bucket es un directorio.
+    """
+
+    def __init__(self, ruta_base):
+        self.ruta_base = ruta_base
+
+    def _ruta(self, Bucket, Key):
+        return os.path.join(self.ruta_base, Bucket, *Key.split("/"))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        _escribir_atomico(self._ruta(Bucket, Key), Body)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        try:
+            return {"Body": open(self._ruta(Bucket, Key), "rb")}
+        except FileNotFoundError:
+            raise KeyError(Key)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        try:
+            return {"ContentLength": os.path.getsize(self._ruta(Bucket, Key))}
+        except FileNotFoundError:
+            raise KeyError(Key)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        try:
+            os.remove(self._ruta(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+
+class AlmacenamientoObjetos:
+    """Guarda los PDFs en un object store con API tipo S3."""
+
+    def __init__(self, cliente, bucket):
+        self.cliente = cliente
+        self.bucket = bucket
+
+    def _clave(self, ref):
+        return f"pdfs/{ref}"
+
+    def guardar(self, datos):
+        ref = hash_pdf(datos)
+        if not self.existe(ref):
+            self.cliente.put_object(
+                Bucket=self.bucket,
+                Key=self._clave(ref),
+                Body=zlib.compress(datos),
+                ContentType="application/pdf",
+                ContentEncoding="deflate",
+            )
+        return ref
+
+    def obtener(self, ref):
+        respuesta = self.cliente.get_object(Bucket=self.bucket, Key=self._clave(ref))
+        with respuesta["Body"] as cuerpo:
+            return zlib.decompress(cuerpo.read())
+
+    def existe(self, ref):
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._clave(ref))
+            return True
+        except Exception:
+            return False
+
+    def eliminar(self, ref):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self._clave(ref))
+
+
+_almacenamiento = None
+
+
+def almacenamiento_pdf():
+    """Devuelve el backend configurado en PDF_STORAGE."""
+    global _almacenamiento
+    if _almacenamiento is None:
+        if PDF_STORAGE == "archivos":
+            _almacenamiento = AlmacenamientoArchivos(PDF_STORAGE_DIR)
+        elif PDF_STORAGE == "objetos":
+            cliente = ClienteObjetosLocal(PDF_STORAGE_BUCKET_DIR)
+            _almacenamiento = AlmacenamientoObjetos(cliente, PDF_STORAGE_BUCKET)
+        elif PDF_STORAGE == "bd":
+            _almacenamiento = AlmacenamientoBD()
+        else:
+            raise ValueError(f"PDF_STORAGE desconocido: {PDF_STORAGE}")
+    return _almacenamiento
+
+
+def guardar_pdf(c, pdf_bytes, entrada=None):
+    """
+    Guarda el PDF en el almacenamiento y deja solo la referencia en la
+    cotización, junto con la huella de la entrada que lo produjo.
+    """
+    c.pdf_ref = almacenamiento_pdf().guardar(pdf_bytes)
+    c.pdf_tamano = len(pdf_bytes)
+    c.pdf_entrada = entrada
+    c.archivo_pdf = None
+
+
+def obtener_pdf(c):
+    """Devuelve los bytes del PDF de la cotización, o None si aún no tiene."""
+    if c.pdf_ref:
+        return almacenamiento_pdf().obtener(c.pdf_ref)
+    return c.archivo_pdf or None
+
+
+def liberar_pdf(ref):
+    """Elimina el blob si ya ninguna cotización lo referencia."""
+    if ref and not Cotizacion.query.filter_by(pdf_ref=ref).first():
+        almacenamiento_pdf().eliminar(ref)
+
+
+@click.command("migrar-pdfs")
+@click.option("--lote", default=100, help="Cotizaciones por transacción")
+@with_appcontext
+def migrar_pdfs_command(lote):
+    """Mueve los PDFs guardados en cotizaciones.archivo_pdf al almacenamiento."""
+    aplicar_migraciones()
+    migradas = 0
+    while True:
+        filas = (
+            Cotizacion.query.options(db.undefer(Cotizacion.archivo_pdf))
+            .filter(
+                Cotizacion.pdf_ref.is_(None),
+                db.func.length(Cotizacion.archivo_pdf) > 0,
+            )
+            .limit(lote)
+            .all()
+        )
+        if not filas:
+            break
+        for c in filas:
+            guardar_pdf(c, c.archivo_pdf)
+        db.session.commit()
+        migradas += len(filas)
+        click.echo(f"{migradas} PDFs migrados...")
+    click.echo(f"Migración completada: {migradas} PDFs movidos a '{PDF_STORAGE}'.")
@@ -1,8 +1,9 @@
-from flask import Flask
+from flask import Flask, jsonify
 from cotizacion_controller import cotizacion_bp
 from flask_cors import CORS
 from database import db
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -20,16 +21,71 @@ print("SECRET_KEY:", repr(app.config["SECRET_KEY"]))
 
 # Configuración de CORS
 CORS_ALLOWED_ORIGINS = ["*"]
-CORS(app, origins=CORS_ALLOWED_ORIGINS)
+CORS(
+    app,
+    origins=CORS_ALLOWED_ORIGINS,
+    expose_headers=["X-Siguiente-Cursor", "Link", "ETag"],
+)
 
 app.register_blueprint(cotizacion_bp)
 db.init_app(app)
 
-# Crear tablas automáticamente al iniciar el servidor
-with app.app_context():
-    from models import *
+from almacenamiento import migrar_pdfs_command
+from migraciones import migrar_command, migraciones_pendientes
+
+app.cli.add_command(migrar_command)
+app.cli.add_command(migrar_pdfs_command)
+
+_workers_iniciados = False
+_workers_lock = threading.Lock()
+
+
+def iniciar_workers(app):
+    """
+    Arranca (una vez por proceso) la revisión de las cotizaciones asíncronas,
+    las cargas pendientes y la bandeja de salida. Lanza RuntimeError si quedan
+    migraciones pendientes: los workers no deben correr sobre un esquema viejo.
+    """
+    global _workers_iniciados
+    with _workers_lock:
+        if _workers_iniciados:
+            return
+        _arrancar_workers(app)
+        _workers_iniciados = True
+
+
+def _arrancar_workers(app):
+    with app.app_context():
+        pendientes = migraciones_pendientes()
+    if pendientes:
+        raise RuntimeError(
+            f"Hay {len(pendientes)} migraciones pendientes; "
+            "ejecute `flask --app app migrar`."
+        )
+    # Revisión periódica de las cotizaciones asíncronas: reanuda las
+    # pendientes tras un reinicio y las abandonadas por un worker caído
+    import trabajos
+    from importacion import reanudar_importaciones
+    import bandeja_salida
+
+    trabajos.iniciar(app)
+    reanudar_importaciones(app)
+    bandeja_salida.iniciar(app)
+
+
+@app.before_request
+def _asegurar_workers():
+    # Cualquier servidor (python app.py, flask run, gunicorn…) arranca los
+    # workers a más tardar con su primer request; los comandos `flask --app
+    # app ...` no atienden requests y no los arrancan. Sin workers no se
+    # atiende: la API encolaría trabajos que nadie procesa
+    if not _workers_iniciados:
+        try:
+            iniciar_workers(app)
+        except RuntimeError as e:
+            print(e)
+            return jsonify({"error": str(e)}), 503
 
-    db.create_all()
 
 import cloudinary
 import cloudinary.uploader
@@ -41,5 +97,6 @@ cloudinary.config(
 )
 
 if __name__ == "__main__":
+    iniciar_workers(app)
     port = int(os.getenv("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,213 @@
+"""
+Bandeja de salida de correos de cotizaciones.
+
+Cada correo por enviar es una fila de correos_salida. Un hilo en segundo
+plano toma las filas vencidas, las envía con el PDF ya guardado (no se vuelve
+a renderizar) y, si el envío falla, las reprograma con backoff exponencial.
+Tras OUTBOX_MAX_INTENTOS fallos el correo queda "descartado" (dead letter)
+con su último error. Como el estado vive en la base de datos, varios workers
+pueden compartir la bandeja: las filas se reclaman con un UPDATE atómico y el
+límite por empresa cuenta los envíos en curso de todos ellos.
+"""
+
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from almacenamiento import obtener_pdf
+from database import db
+from models import CorreoSalida
+
+OUTBOX_HILOS = int(os.getenv("OUTBOX_HILOS", 4))
+# Envíos simultáneos por empresa (evita agotar la cuota de Gmail de una cuenta)
+OUTBOX_MAX_POR_EMPRESA = int(os.getenv("OUTBOX_MAX_POR_EMPRESA", 2))
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", 6))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 30))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 3600))
+# Segundos entre revisiones de la bandeja si nadie la despierta antes
+OUTBOX_INTERVALO = float(os.getenv("OUTBOX_INTERVALO", 5))
+# Un envío "enviando" más viejo que esto se considera abandonado (worker caído)
+OUTBOX_BLOQUEO = float(os.getenv("OUTBOX_BLOQUEO", 300))
+OUTBOX_LOTE = 100
+
+ASUNTO = "Cotización"
+CUERPO = "Adjunto PDF de cotización"
+
+_hilos = None
+_despertador = threading.Event()
+_lock = threading.Lock()
+
+
+def espera_reintento(intentos):
+    """Segundos hasta el siguiente intento tras `intentos` fallos (con jitter)."""
+    espera = min(OUTBOX_BACKOFF_BASE * 2 ** (intentos - 1), OUTBOX_BACKOFF_MAX)
+    return espera * random.uniform(0.9, 1.1)
+
+
+def nuevo_correo(c, intentos=0, error=None):
+    """
+    Crea (sin hacer commit) el correo de la cotización `c`. Con `intentos` > 0
+    registra fallos previos y programa el primer reintento con backoff.
+    """
+    proximo = datetime.utcnow()
+    if intentos:
+        proximo += timedelta(seconds=espera_reintento(intentos))
+    correo = CorreoSalida(
+        cotizacion=c,
+        empresa_id=c.empresa_id,
+        destinatario=c.correo,
+        asunto=ASUNTO,
+        cuerpo=CUERPO,
+        intentos=intentos,
+        proximo_intento=proximo,
+        ultimo_error=error,
+    )
+    db.session.add(correo)
+    return correo
+
+
+def correo_activo(cotizacion_id):
+    """El correo pendiente o en envío de la cotización, si lo hay."""
+    return CorreoSalida.query.filter(
+        CorreoSalida.cotizacion_id == cotizacion_id,
+        CorreoSalida.estado.in_(("pendiente", "enviando")),
+    ).first()
+
+
+def despertar():
+    """Pide al hilo de la bandeja que revise ya (tras encolar un correo)."""
+    _despertador.set()
+
+
+def _registrar_resultado(correo, error):
+    c = correo.cotizacion
+    correo.intentos += 1
+    if error is None:
+        correo.estado = "enviado"
+        correo.ultimo_error = None
+        c.estado_envio = "Enviado"
+    elif correo.intentos >= OUTBOX_MAX_INTENTOS:
+        correo.estado = "descartado"
+        correo.ultimo_error = error
+        c.estado_envio = "Fallido"
+    else:
+        correo.estado = "pendiente"
+        correo.ultimo_error = error
+        correo.proximo_intento = datetime.utcnow() + timedelta(
+            seconds=espera_reintento(correo.intentos)
+        )
+    correo.actualizado = datetime.utcnow()
+    db.session.commit()
+
+
+def enviar_correo(correo, pdf_bytes=None):
+    """
+    Envía un correo ya reclamado (en "enviando") y registra el resultado.
+    Devuelve el error, o None si Gmail lo aceptó. `pdf_bytes` evita volver a
+    leer el PDF si quien llama ya lo tiene.
+    """
+    from cotizacion_controller import enviar_email_gmail_oauth2
+
+    c = correo.cotizacion
+    empresa = c.empresa
+    error = None
+    try:
+        if pdf_bytes is None:
+            pdf_bytes = obtener_pdf(c)
+        if not pdf_bytes:
+            error = "La cotización no tiene PDF"
+        elif not empresa.gmail_access_token:
+            error = "La empresa no ha autorizado el envío con Gmail"
+        elif not enviar_email_gmail_oauth2(
+            empresa.gmail_access_token,
+            empresa.email,
+            correo.destinatario,
+            correo.asunto,
+            correo.cuerpo,
+            pdf_bytes,
+            refresh_token=empresa.gmail_refresh_token,
+            empresa_id=empresa.id,
+        ):
+            error = "Gmail no aceptó el correo"
+    except Exception as e:
+        db.session.rollback()
+        error = str(e)
+    _registrar_resultado(correo, error)
+    return error
+
+
+def _enviar(app, correo_id):
+    with app.app_context():
+        enviar_correo(db.session.get(CorreoSalida, correo_id))
+    # Se liberó un cupo de la empresa
+    despertar()
+
+
+def despachar(app):
+    """Reclama los correos vencidos respetando el límite por empresa y los envía."""
+    ahora = datetime.utcnow()
+    CorreoSalida.query.filter(
+        CorreoSalida.estado == "enviando",
+        CorreoSalida.actualizado < ahora - timedelta(seconds=OUTBOX_BLOQUEO),
+    ).update({"estado": "pendiente"}, synchronize_session=False)
+    db.session.commit()
+    en_curso = dict(
+        db.session.query(CorreoSalida.empresa_id, db.func.count())
+        .filter(CorreoSalida.estado == "enviando")
+        .group_by(CorreoSalida.empresa_id)
+        .all()
+    )
+    vencidos = (
+        db.session.query(CorreoSalida.id, CorreoSalida.empresa_id)
+        .filter(
+            CorreoSalida.estado == "pendiente", CorreoSalida.proximo_intento <= ahora
+        )
+        .order_by(CorreoSalida.proximo_intento, CorreoSalida.id)
+        .limit(OUTBOX_LOTE)
+        .all()
+    )
+    enviados = 0
+    for correo_id, empresa_id in vencidos:
+        if en_curso.get(empresa_id, 0) >= OUTBOX_MAX_POR_EMPRESA:
+            continue
+        # Reclamo atómico: otro worker puede estar revisando la misma fila
+        reclamado = CorreoSalida.query.filter_by(
+            id=correo_id, estado="pendiente"
+        ).update(
+            {"estado": "enviando", "actualizado": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if reclamado:
+            en_curso[empresa_id] = en_curso.get(empresa_id, 0) + 1
+            _hilos.submit(_enviar, app, correo_id)
+            enviados += 1
+    return enviados
+
+
+def _ciclo(app):
+    while True:
+        _despertador.wait(OUTBOX_INTERVALO)
+        _despertador.clear()
+        try:
+            with app.app_context():
+                despachar(app)
+        except Exception as e:
+            print("Error revisando la bandeja de salida:", e)
+
+
+def iniciar(app):
+    """Arranca (una vez por proceso) el hilo que vacía la bandeja de salida."""
+    global _hilos
+    with _lock:
+        if _hilos is not None:
+            return
+        _hilos = ThreadPoolExecutor(
+            max_workers=OUTBOX_HILOS, thread_name_prefix="bandeja"
+        )
+        threading.Thread(
+            target=_ciclo, args=(app,), name="bandeja-salida", daemon=True
+        ).start()
+    despertar()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de punta a punta, sin red ni credenciales reales.
+
+Levanta la API en un servidor HTTP local (werkzeug, con hilos) contra un
+SQLite temporal o la base de DATABASE_URL (p. ej. un PostgreSQL local) y
+reemplaza los servicios externos por dobles locales con latencia
+configurable:
+
+- enviar_email_gmail_oauth2: espera --latencia-gmail y acepta el correo.
+- cloudinary.uploader.upload: espera --latencia-cloudinary y devuelve una
+  URL del servidor de logos local.
+- la descarga de logos: un servidor HTTP local que responde después de
+  --latencia-logo (logo_cache lo consulta como a cualquier URL).
+
+Cada usuario virtual (un hilo) tiene su empresa con productos y repite
+operaciones elegidas según --mezcla: login, CRUD de productos (crear, ver,
+editar, listar, eliminar), crear cotización, carga masiva CSV y registro de
+empresa con logo. Al final reporta por endpoint la cantidad de requests, los
+errores, requests/s y las latencias p50/p95/p99; --salida guarda el informe
+en JSON.
+
+Uso: python benchmarks/bench_carga.py [--usuarios 8] [--duracion 30]
+     [--mezcla login=1,productos=4,cotizacion=4,carga=0.5,registro=0.2]
+     [--latencia-gmail 0.2] [--latencia-cloudinary 0.3] [--latencia-logo 0.1]
+"""
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_membrete import crear_logo_png  # noqa: E402
+
+ADMIN_EMAIL = "admin-carga@example.com"
+ADMIN_PASSWORD = "carga"
+PASSWORD = "carga"
+
+
+def servir_logos(directorio, latencia):
+    """Servidor de logos local; responde cada GET después de `latencia` s."""
+
+    class Logos(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directorio, **kwargs)
+
+        def do_GET(self):
+            time.sleep(latencia)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Logos)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def instalar_dobles(latencia_gmail, latencia_cloudinary, url_logos):
+    """Reemplaza Gmail y Cloudinary por funciones locales con latencia."""
+    import cloudinary.uploader
+
+    import cotizacion_controller
+
+    def enviar_falso(*args, **kwargs):
+        time.sleep(latencia_gmail)
+        return True
+
+    def subir_falso(archivo, **opciones):
+        time.sleep(latencia_cloudinary)
+        archivo.read()
+        # Una URL distinta por empresa: cada logo nuevo se descarga una vez
+        return {"secure_url": f"{url_logos}/logo.png?v={uuid.uuid4().hex}"}
+
+    # trabajos.py y bandeja_salida.py la importan de cotizacion_controller
+    cotizacion_controller.enviar_email_gmail_oauth2 = enviar_falso
+    cloudinary.uploader.upload = subir_falso
+
+
+def sembrar(usuarios, productos, url_logos, corrida):
+    """Crea una empresa con productos por usuario; devuelve [(email, [ids])]."""
+    from database import db
+    from models import Empresa, Producto
+
+    empresas = []
+    for i in range(usuarios):
+        empresa = Empresa(
+            nombre=f"Carga {corrida} {i}",
+            email=f"carga-{corrida}-{i}@example.com",
+            nit=f"900{i:06d}",
+            direccion="Calle 1 # 2-3",
+            telefono="+57 300 000 0000",
+            contacto="Prueba de carga",
+            logo_url=f"{url_logos}/logo.png?empresa={corrida}-{i}",
+            gmail_access_token="falso",
+            gmail_refresh_token="falso",
+        )
+        empresa.set_password(PASSWORD)
+        db.session.add(empresa)
+        db.session.flush()
+        filas = [
+            Producto(
+                empresa_id=empresa.id,
+                nombre=f"Producto {j}",
+                descripcion=f"Descripción del producto {j}",
+                precio=1000 + j * 37,
+                unidad="unidad",
+                codigo=f"C{i:03d}-{j:05d}",
+            )
+            for j in range(productos)
+        ]
+        db.session.add_all(filas)
+        db.session.flush()
+        empresas.append((empresa.email, [p.id for p in filas]))
+    db.session.commit()
+    return empresas
+
+
+class Registro:
+    """Latencias y errores por endpoint de un usuario virtual."""
+
+    def __init__(self):
+        self.latencias = {}
+        self.errores = {}
+
+    def anotar(self, endpoint, segundos, ok):
+        self.latencias.setdefault(endpoint, []).append(segundos)
+        if not ok:
+            self.errores[endpoint] = self.errores.get(endpoint, 0) + 1
+
+    def sumar(self, otro):
+        for endpoint, valores in otro.latencias.items():
+            self.latencias.setdefault(endpoint, []).extend(valores)
+        for endpoint, n in otro.errores.items():
+            self.errores[endpoint] = self.errores.get(endpoint, 0) + n
+
+
+class Usuario:
+    """Usuario virtual: una empresa, una sesión HTTP y su propio registro."""
+
+    def __init__(self, base, email, productos, filas_carga, semilla):
+        import requests
+
+        self.base = base
+        self.email = email
+        self.productos = productos
+        self.filas_carga = filas_carga
+        self.sesion = requests.Session()
+        self.registro = Registro()
+        self.azar = random.Random(semilla)
+        self.ultimo_error = None
+
+    def pedir(self, endpoint, metodo, ruta, esperados=(200,), **kwargs):
+        inicio = time.perf_counter()
+        try:
+            r = self.sesion.request(metodo, self.base + ruta, timeout=120, **kwargs)
+            ok = r.status_code in esperados
+        except Exception as e:
+            r, ok = None, False
+            self.ultimo_error = f"{endpoint}: {e}"
+        self.registro.anotar(endpoint, time.perf_counter() - inicio, ok)
+        if r is not None and not ok:
+            self.ultimo_error = f"{endpoint}: {r.status_code} {r.text[:200]}"
+        return r if ok else None
+
+    def login(self):
+        r = self.pedir(
+            "POST /login",
+            "POST",
+            "/login",
+            json={"email": self.email, "password": PASSWORD},
+        )
+        if r is not None:
+            self.sesion.headers["Authorization"] = "Bearer " + r.json()["token"]
+
+    def productos_crud(self):
+        codigo = uuid.uuid4().hex[:12]
+        r = self.pedir(
+            "POST /producto",
+            "POST",
+            "/producto",
+            (201,),
+            json={"nombre": f"Nuevo {codigo}", "precio": 2500, "codigo": codigo},
+        )
+        if r is None:
+            return
+        ruta = f"/producto/{r.json()['id']}"
+        self.pedir("GET /producto/<id>", "GET", ruta)
+        self.pedir("PUT /producto/<id>", "PUT", ruta, json={"precio": 2600})
+        self.pedir("GET /producto", "GET", "/producto?limite=50")
+        self.pedir("DELETE /producto/<id>", "DELETE", ruta)
+
+    def cotizacion(self):
+        lineas = [
+            {
+                "id": self.azar.choice(self.productos),
+                "cantidad": self.azar.randint(1, 10),
+                "descuento": self.azar.choice([0, 0, 500]),
+                "iva": 19,
+            }
+            for _ in range(self.azar.randint(1, 20))
+        ]
+        self.pedir(
+            "POST /cotizacion",
+            "POST",
+            "/cotizacion",
+            json={
+                "cliente": "Cliente de carga",
+                "correo": "cliente@example.com",
+                "productos": lineas,
+                "descuento": 1000,
+                "iva": 19,
+                "codigo_cotizacion": f"CARGA-{uuid.uuid4().hex[:20]}",
+            },
+        )
+
+    def carga(self):
+        lote = uuid.uuid4().hex[:8]
+        csv = "nombre,descripcion,precio,unidad,codigo\n" + "".join(
+            f"Masivo {lote} {i},Cargado en la prueba,{1000 + i},kg,M{lote}{i:05d}\n"
+            for i in range(self.filas_carga)
+        )
+        self.pedir(
+            "POST /producto/carga-masiva",
+            "POST",
+            "/producto/carga-masiva",
+            files={"archivo": ("productos.csv", csv.encode("utf-8"), "text/csv")},
+        )
+
+    def registro_empresa(self, admin, logo):
+        r = admin.pedir(
+            "POST /admin/codigos-invitacion", "POST", "/admin/codigos-invitacion"
+        )
+        if r is None:
+            return
+        sufijo = uuid.uuid4().hex[:10]
+        self.pedir(
+            "POST /register",
+            "POST",
+            "/register",
+            (201,),
+            data={
+                "nombre": f"Registrada {sufijo}",
+                "email": f"registro-{sufijo}@example.com",
+                "password": PASSWORD,
+                "nit": sufijo,
+                "direccion": "Calle 4",
+                "telefono": "300",
+                "contacto": "Alguien",
+                "codigo_invitacion": r.json()["codigo"],
+            },
+            files={"logo": ("logo.png", logo, "image/png")},
+        )
+
+
+def _mezcla(texto):
+    pesos = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        pesos[nombre.strip()] = float(peso)
+    return pesos
+
+
+def _percentil(ordenados, p):
+    # Rango más cercano: el menor valor que cubre el p% de las muestras
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def informe(registro, segundos):
+    filas = []
+    for endpoint, valores in sorted(registro.latencias.items()):
+        ordenados = sorted(valores)
+        filas.append(
+            {
+                "endpoint": endpoint,
+                "requests": len(valores),
+                "errores": registro.errores.get(endpoint, 0),
+                "rps": round(len(valores) / segundos, 2),
+                "p50_ms": round(_percentil(ordenados, 50) * 1000, 1),
+                "p95_ms": round(_percentil(ordenados, 95) * 1000, 1),
+                "p99_ms": round(_percentil(ordenados, 99) * 1000, 1),
+                "max_ms": round(ordenados[-1] * 1000, 1),
+            }
+        )
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--usuarios", type=int, default=8)
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos")
+    parser.add_argument(
+        "--mezcla", default="login=1,productos=4,cotizacion=4,carga=0.5,registro=0.2"
+    )
+    parser.add_argument("--productos", type=int, default=200, help="Por empresa")
+    parser.add_argument("--filas-carga", type=int, default=200)
+    parser.add_argument("--latencia-gmail", type=float, default=0.2)
+    parser.add_argument("--latencia-cloudinary", type=float, default=0.3)
+    parser.add_argument("--latencia-logo", type=float, default=0.1)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="Archivo JSON del informe")
+    args = parser.parse_args()
+
+    pesos = _mezcla(args.mezcla)
+    operaciones = ["login", "productos", "cotizacion", "carga", "registro"]
+    desconocidas = set(pesos) - set(operaciones)
+    if desconocidas:
+        parser.error(f"Operaciones desconocidas en --mezcla: {sorted(desconocidas)}")
+
+    directorio = tempfile.mkdtemp()
+    logo_png = os.path.join(directorio, "logo.png")
+    crear_logo_png(logo_png)
+    url_logos = servir_logos(directorio, args.latencia_logo)
+    os.environ.setdefault(
+        "DATABASE_URL", "sqlite:///" + os.path.join(directorio, "carga.db")
+    )
+    os.environ["ADMIN_EMAIL"] = ADMIN_EMAIL
+    os.environ["ADMIN_PASSWORD"] = ADMIN_PASSWORD
+    os.environ.setdefault("LOGO_CACHE_DIR", os.path.join(directorio, "logos"))
+    os.chdir(directorio)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app, iniciar_workers
+    from migraciones import aplicar_migraciones
+    from werkzeug.serving import make_server
+
+    instalar_dobles(args.latencia_gmail, args.latencia_cloudinary, url_logos)
+    corrida = uuid.uuid4().hex[:6]
+    with app.app_context():
+        aplicar_migraciones()
+        empresas = sembrar(args.usuarios, args.productos, url_logos, corrida)
+    # Como al levantar el servidor: bandeja de salida y trabajos pendientes
+    iniciar_workers(app)
+
+    # Sin el log de cada request de werkzeug
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    servidor = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_port}"
+    with open(logo_png, "rb") as f:
+        logo = f.read()
+
+    base_datos = os.environ["DATABASE_URL"].split(":", 1)[0]
+    print(
+        f"API en {base} ({base_datos}), {args.usuarios} usuarios,"
+        f" {args.duracion:.0f} s, mezcla {pesos}"
+    )
+    usuarios = [
+        Usuario(base, email, ids, args.filas_carga, args.semilla + i)
+        for i, (email, ids) in enumerate(empresas)
+    ]
+    admin = Usuario(base, ADMIN_EMAIL, [], 0, 0)
+    r = admin.sesion.post(
+        base + "/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
+    )
+    admin.sesion.headers["Authorization"] = "Bearer " + r.json()["token"]
+    admin_lock = threading.Lock()
+    fin = time.perf_counter() + args.duracion
+
+    def correr(usuario):
+        usuario.login()
+        nombres = [o for o in operaciones if pesos.get(o)]
+        while time.perf_counter() < fin:
+            operacion = usuario.azar.choices(
+                nombres, weights=[pesos[o] for o in nombres]
+            )[0]
+            if operacion == "registro":
+                # La sesión del admin es compartida: un registro a la vez
+                with admin_lock:
+                    usuario.registro_empresa(admin, logo)
+            elif operacion == "productos":
+                usuario.productos_crud()
+            else:
+                getattr(usuario, operacion)()
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=correr, args=(u,)) for u in usuarios]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+    servidor.shutdown()
+
+    total = Registro()
+    for usuario in usuarios + [admin]:
+        total.sumar(usuario.registro)
+    filas = informe(total, segundos)
+    print()
+    print(
+        f"{'Endpoint':32} {'Req':>6} {'Err':>5} {'Req/s':>8}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Máx ms':>8}"
+    )
+    for f in filas:
+        print(
+            f"{f['endpoint']:32} {f['requests']:6} {f['errores']:5} {f['rps']:8.2f}"
+            f" {f['p50_ms']:8.1f} {f['p95_ms']:8.1f} {f['p99_ms']:8.1f}"
+            f" {f['max_ms']:8.1f}"
+        )
+    requests_totales = sum(f["requests"] for f in filas)
+    print(
+        f"{'Total':32} {requests_totales:6} {sum(f['errores'] for f in filas):5}"
+        f" {requests_totales / segundos:8.2f}"
+    )
+    errores = [u.ultimo_error for u in usuarios + [admin] if u.ultimo_error]
+    if errores:
+        print("\nÚltimos errores:")
+        for error in errores[:5]:
+            print(" ", error)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "parametros": vars(args),
+                    "base_datos": base_datos,
+                    "segundos": round(segundos, 2),
+                    "endpoints": filas,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"\nInforme en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark de envío de correos contra el Gmail falso (sin red).
+
+Compara el envío anterior (leer client_secret.json, armar Credentials y
+build() en cada correo, sin guardar el token renovado) con
+enviar_email_gmail_oauth2 y su pool de clientes. La empresa empieza con un
+access token vencido, como ocurre una hora después de autorizar Gmail.
+
+Uso: python benchmarks/bench_gmail.py [--envios 200] [--latencia 0.005]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gmail_falso import GmailFalso  # noqa: E402
+
+PDF = b"%PDF-1.3\n" + b"0" * 3000
+
+
+def envio_anterior(url, access_token, refresh_token):
+    """El cuerpo de enviar_email_gmail_oauth2 antes del pool de clientes."""
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+    with open(os.environ["GMAIL_CLIENT_SECRET"]) as f:
+        secrets = json.load(f)["web"]
+    creds = Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        token_uri=secrets["token_uri"],
+        client_id=secrets["client_id"],
+        client_secret=secrets["client_secret"],
+    )
+    service = build(
+        "gmail", "v1", credentials=creds, client_options={"api_endpoint": url}
+    )
+    service.users().messages().send(userId="me", body={"raw": "eA"}).execute()
+
+
+def medir(nombre, servidor, envios, enviar):
+    servidor.reiniciar_contadores()
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(envios):
+            enviar()
+    segundos = time.perf_counter() - inicio
+    print(
+        f"{nombre:10} {envios / segundos:10.1f} envíos/s {servidor.enviados:8d} "
+        f"{servidor.renovaciones:12d} {servidor.conexiones:11d}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--envios", type=int, default=200)
+    parser.add_argument("--latencia", type=float, default=0.005)
+    args = parser.parse_args()
+
+    servidor = GmailFalso(latencia=args.latencia).iniciar()
+    directorio = tempfile.mkdtemp()
+    ruta_secret = os.path.join(directorio, "client_secret.json")
+    with open(ruta_secret, "w") as f:
+        json.dump(servidor.client_secret(), f)
+    os.environ["GMAIL_CLIENT_SECRET"] = ruta_secret
+    os.environ["GMAIL_API_URL"] = servidor.url
+    os.environ.setdefault(
+        "DATABASE_URL", "sqlite:///" + os.path.join(directorio, "bench.db")
+    )
+    os.chdir(directorio)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app
+    from cotizacion_controller import enviar_email_gmail_oauth2
+    from database import db
+    from migraciones import aplicar_migraciones
+    from models import Empresa
+
+    with app.app_context():
+        aplicar_migraciones()
+        empresa = Empresa(
+            nombre="Bench Gmail",
+            email="bench@example.com",
+            password_hash="x",
+            gmail_access_token="vencido",
+            gmail_refresh_token="refresh",
+        )
+        db.session.add(empresa)
+        db.session.commit()
+        empresa_id = empresa.id
+
+        def anterior():
+            # El token en la base nunca se actualiza: siempre el vencido
+            envio_anterior(servidor.url, "vencido", "refresh")
+
+        def con_pool():
+            # Como los callers: los tokens se leen de la empresa en cada envío
+            e = db.session.get(Empresa, empresa_id)
+            enviado = enviar_email_gmail_oauth2(
+                e.gmail_access_token,
+                e.email,
+                "cliente@example.com",
+                "Cotización",
+                "Adjunto PDF de cotización",
+                PDF,
+                refresh_token=e.gmail_refresh_token,
+                empresa_id=empresa_id,
+            )
+            db.session.expire_all()
+            assert enviado
+
+        print(
+            f"{'Modo':10} {'Rendimiento':>19} {'Enviados':>8} "
+            f"{'Renovaciones':>12} {'Conexiones':>11}"
+        )
+        medir("anterior", servidor, args.envios, anterior)
+        medir("pool", servidor, args.envios, con_pool)
+    servidor.detener()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria y tiempo de la carga masiva de productos.
+
+Genera un catálogo de N filas en .xlsx y .csv y lo importa con
+importacion.abrir_archivo/importar (lectura por lotes) y, para comparar, con
+la lectura anterior (pd.read_excel/pd.read_csv del archivo completo). Cada
+medición corre en un proceso aparte contra un SQLite temporal y reporta el
+tiempo y el pico de memoria residente (RSS) que agregó la importación.
+
+Uso: python benchmarks/bench_importacion.py [--filas 200000] [--lote 2000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+
+def generar(directorio, filas):
+    from openpyxl import Workbook
+
+    encabezado = ["nombre", "descripcion", "precio", "unidad", "codigo"]
+
+    def fila(i):
+        return [
+            f"Producto {i}",
+            f"Descripción del producto {i}",
+            i % 997 + 0.5,
+            "kg",
+            f"C{i:07d}",
+        ]
+
+    xlsx = os.path.join(directorio, "catalogo.xlsx")
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(encabezado)
+    for i in range(filas):
+        hoja.append(fila(i))
+    libro.save(xlsx)
+
+    csv = os.path.join(directorio, "catalogo.csv")
+    with open(csv, "w", encoding="utf-8") as f:
+        f.write(",".join(encabezado) + "\n")
+        for i in range(filas):
+            f.write(",".join(str(v) for v in fila(i)) + "\n")
+    return xlsx, csv
+
+
+def _rss_mb():
+    # ru_maxrss está en KiB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def medir(ruta, modo, lote):
+    """Corre en el proceso hijo: importa `ruta` y devuelve tiempo y memoria."""
+    os.environ["IMPORTACION_LOTE"] = str(lote)
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+    os.chdir(tempfile.mkdtemp())
+
+    import pandas as pd
+
+    from app import app
+    from database import db
+    from importacion import abrir_archivo, importar
+    from migraciones import aplicar_migraciones
+    from models import Empresa
+
+    extension = ruta.rsplit(".", 1)[1]
+    with app.app_context():
+        aplicar_migraciones()
+        empresa = Empresa(nombre="Bench", email="bench@example.com")
+        empresa.set_password("x")
+        db.session.add(empresa)
+        db.session.commit()
+        base = _rss_mb()
+        inicio = time.perf_counter()
+        with open(ruta, "rb") as archivo:
+            if modo == "lotes":
+                _, lotes = abrir_archivo(archivo, extension)
+            elif extension == "csv":
+                lotes = [pd.read_csv(archivo, dtype=object)]
+            else:
+                lotes = [pd.read_excel(archivo, engine="openpyxl", dtype=object)]
+            resumen = importar(empresa.id, lotes)
+        segundos = time.perf_counter() - inicio
+    return {
+        "segundos": round(segundos, 2),
+        "rss_mb": round(_rss_mb() - base, 1),
+        "creados": resumen["productos_creados"],
+        "lotes": len(resumen["lotes"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--filas", type=int, default=200_000)
+    parser.add_argument("--lote", type=int, default=2000)
+    parser.add_argument("--medir", nargs=2, metavar=("ARCHIVO", "MODO"))
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(*args.medir, args.lote)))
+        return
+
+    directorio = tempfile.mkdtemp()
+    print(f"Generando {args.filas} filas en {directorio}")
+    archivos = generar(directorio, args.filas)
+    print()
+    print(
+        f"{'Archivo':14} {'Lectura':10} {'Tiempo (s)':>11} {'RSS (MB)':>9} {'Lotes':>6}"
+    )
+    for ruta in archivos:
+        for modo in ("completo", "lotes"):
+            salida = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--lote",
+                    str(args.lote),
+                    "--medir",
+                    ruta,
+                    modo,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            r = json.loads(salida.strip().splitlines()[-1])
+            print(
+                f"{os.path.basename(ruta):14} {modo:10} {r['segundos']:11.2f}"
+                f" {r['rss_mb']:9.1f} {r['lotes']:6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los índices agregados por la migración 3.
+
+Siembra la base de DATABASE_URL (por defecto un SQLite temporal) con
+1M cotizaciones y 100k productos sin los índices, muestra el plan y el tiempo
+de la consulta de cada endpoint, crea los índices como la migración y repite
+la medición.
+
+Uso: python benchmarks/bench_indices.py [--cotizaciones 1000000]
+         [--productos 100000] [--empresas 100] [--repeticiones 20]
+
+Con PostgreSQL: DATABASE_URL=postgresql://... python benchmarks/bench_indices.py
+(usar una base descartable: se borran y recrean las tablas).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+LOTE = 10000
+
+
+def sembrar(db, modelos, args):
+    Empresa, Producto, Cotizacion, LogActividad, Soporte = modelos
+    rnd = random.Random(42)
+    inicio = datetime(2024, 1, 1)
+
+    def insertar(modelo, total, fila):
+        for desde in range(0, total, LOTE):
+            db.session.execute(
+                db.insert(modelo.__table__),
+                [fila(i) for i in range(desde, min(desde + LOTE, total))],
+            )
+            db.session.commit()
+        print(f"  {modelo.__tablename__}: {total} filas")
+
+    insertar(
+        Empresa,
+        args.empresas,
+        lambda i: {
+            "id": i + 1,
+            "nombre": f"Empresa {i}",
+            "email": f"empresa{i}@example.com",
+            "password_hash": "x",
+        },
+    )
+    insertar(
+        Producto,
+        args.productos,
+        lambda i: {
+            "empresa_id": i % args.empresas + 1,
+            "nombre": f"Producto {i}",
+            "precio": rnd.randint(1000, 500000),
+            "unidad": "unidad",
+            "codigo": f"PROD{i:07d}",
+        },
+    )
+    insertar(
+        Cotizacion,
+        args.cotizaciones,
+        lambda i: {
+            "empresa_id": i % args.empresas + 1,
+            "cliente": f"Cliente {i}",
+            "correo": "cliente@example.com",
+            "fecha": (inicio + timedelta(minutes=rnd.randint(0, 500000))).strftime(
+                "%Y-%m-%d"
+            ),
+            "codigo_cotizacion": f"COT-{i}",
+            "productos": [{"id": 1, "nombre": "P", "precio": 1000, "cantidad": 1}],
+            "total": 1000,
+            "estado_envio": rnd.choice(["Enviado", "Fallido"]),
+            "pdf_ref": None,
+        },
+    )
+    insertar(
+        LogActividad,
+        args.cotizaciones // 10,
+        lambda i: {
+            "fecha": inicio + timedelta(seconds=rnd.randint(0, 10**8)),
+            "tipo": "login",
+            "descripcion": "login",
+            "empresa_id": i % args.empresas + 1,
+        },
+    )
+    insertar(
+        Soporte,
+        args.cotizaciones // 100,
+        lambda i: {
+            "empresa_id": i % args.empresas + 1,
+            "asunto": "Ayuda",
+            "mensaje": "Mensaje",
+            "fecha": inicio + timedelta(seconds=rnd.randint(0, 10**8)),
+            "estado": "pendiente",
+        },
+    )
+
+
+def consultas(db, modelos, empresa_id):
+    """Las consultas que ejecuta cada endpoint, con la misma forma que en el controller."""
+    Empresa, Producto, Cotizacion, LogActividad, Soporte = modelos
+    fecha = db.func.coalesce(Cotizacion.fecha, db.literal_column("''"))
+    return {
+        "GET /producto": Producto.query.filter_by(empresa_id=empresa_id)
+        .order_by(Producto.id)
+        .limit(51),
+        "carga-masiva (codigo)": Producto.query.filter_by(
+            empresa_id=empresa_id, codigo="PROD0000500"
+        ).limit(1),
+        "carga-masiva (nombre)": Producto.query.filter_by(
+            empresa_id=empresa_id, nombre="Producto 500"
+        ).limit(1),
+        "GET /cotizacion": Cotizacion.query.filter_by(empresa_id=empresa_id)
+        .order_by(Cotizacion.id)
+        .limit(51),
+        "GET /cotizacion?orden=fecha": Cotizacion.query.filter_by(empresa_id=empresa_id)
+        .order_by(fecha, Cotizacion.id)
+        .limit(51),
+        "GET /admin/logs": LogActividad.query.order_by(LogActividad.fecha.desc()).limit(
+            100
+        ),
+        "GET /admin/soporte": Soporte.query.order_by(
+            Soporte.fecha.desc(), Soporte.id.desc()
+        ).limit(51),
+    }
+
+
+def medir(db, modelos, empresa_id, repeticiones):
+    postgres = db.engine.dialect.name == "postgresql"
+    resultados = {}
+    for nombre, query in consultas(db, modelos, empresa_id).items():
+        sql = str(
+            query.statement.compile(
+                dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+        prefijo = "EXPLAIN " if postgres else "EXPLAIN QUERY PLAN "
+        plan = db.session.execute(db.text(prefijo + sql)).fetchall()
+        plan = [str(fila[0] if postgres else fila[-1]) for fila in plan]
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            db.session.execute(db.text(sql)).fetchall()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        resultados[nombre] = (statistics.median(tiempos), plan)
+    db.session.commit()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cotizaciones", type=int, default=1_000_000)
+    parser.add_argument("--productos", type=int, default=100_000)
+    parser.add_argument("--empresas", type=int, default=100)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        ruta = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URL"] = "sqlite:///" + ruta
+    os.chdir(tempfile.mkdtemp())
+
+    from app import app
+    from database import db
+    from migraciones import _crear_indices, _indices_consultas, aplicar_migraciones
+    from models import Cotizacion, Empresa, LogActividad, Producto, Soporte
+
+    modelos = (Empresa, Producto, Cotizacion, LogActividad, Soporte)
+    with app.app_context():
+        db.drop_all()
+        db.session.execute(db.text("DROP TABLE IF EXISTS schema_version"))
+        db.session.commit()
+        # Esquema actual sin los índices de la migración 3
+        aplicar_migraciones()
+        indices = _indices_consultas()
+        for indice in indices:
+            db.session.execute(db.text(f"DROP INDEX IF EXISTS {indice.name}"))
+        db.session.commit()
+
+        print(f"Sembrando {db.engine.url.render_as_string(hide_password=True)}")
+        sembrar(db, modelos, args)
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+
+        empresa_id = args.empresas // 2
+        antes = medir(db, modelos, empresa_id, args.repeticiones)
+        _crear_indices(indices)
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+        # Conexiones nuevas, para que SQLite vea el esquema con los índices
+        db.session.remove()
+        db.engine.dispose()
+        despues = medir(db, modelos, empresa_id, args.repeticiones)
+
+    print()
+    print(f"{'Endpoint':32} {'Antes (ms)':>12} {'Después (ms)':>14} {'Mejora':>9}")
+    for nombre in antes:
+        t_antes, t_despues = antes[nombre][0], despues[nombre][0]
+        mejora = t_antes / t_despues if t_despues else float("inf")
+        print(f"{nombre:32} {t_antes:12.2f} {t_despues:14.2f} {mejora:8.1f}x")
+    for nombre in antes:
+        print(f"\n== {nombre}")
+        print("  Antes:   " + "\n           ".join(antes[nombre][1]))
+        print("  Después: " + "\n           ".join(despues[nombre][1]))
+
+
+if __name__ == "__main__":
+    main()
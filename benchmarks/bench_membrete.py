@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark del membrete precompilado de generar_pdf.
+
+Compara el tiempo por cotización reconstruyendo el membrete en cada llamada
+(comportamiento anterior) contra reutilizar la plantilla de la empresa.
+
+Uso: python benchmarks/bench_membrete.py [--iteraciones 200] [--lineas 3]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pdf_generator  # noqa: E402
+
+
+def crear_logo_png(ruta, ancho=400, alto=160):
+    """Escribe un PNG RGB de prueba, del tamaño típico de un logo."""
+
+    def chunk(tipo, datos):
+        return (
+            struct.pack(">I", len(datos))
+            + tipo
+            + datos
+            + struct.pack(">I", zlib.crc32(tipo + datos) & 0xFFFFFFFF)
+        )
+
+    filas = b"".join(
+        b"\x00"
+        + b"".join(bytes((x % 256, y % 256, (x + y) % 256)) for x in range(ancho))
+        for y in range(alto)
+    )
+    ihdr = struct.pack(">IIBBBBB", ancho, alto, 8, 2, 0, 0, 0)
+    with open(ruta, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", ihdr))
+        f.write(chunk(b"IDAT", zlib.compress(filas)))
+        f.write(chunk(b"IEND", b""))
+
+
+def datos_cotizacion(logo, lineas):
+    return {
+        "codigo_cotizacion": "COT-BENCH",
+        "cliente": "Cliente Benchmark SAS",
+        "correo": "cliente@example.com",
+        "fecha": "2025-07-07",
+        "productos": [
+            {"nombre": f"Producto {i}", "cantidad": 2, "precio": 1000 + i}
+            for i in range(lineas)
+        ],
+        "subtotal": 0,
+        "total": 0,
+        "empresa": {
+            "nombre": "Empresa Benchmark SA",
+            "nit": "900123456-7",
+            "direccion": "Calle 123 #45-67",
+            "telefono": "+57 300 123 4567",
+            "email": "empresa@example.com",
+            "contacto": "Juan Pérez",
+            "logo_url": logo,
+        },
+    }
+
+
+def medir(data, iteraciones, con_plantilla):
+    pdf_generator._membretes.clear()
+    pdf_generator.generar_pdf(data)  # calentamiento
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        if not con_plantilla:
+            pdf_generator._membretes.clear()
+        pdf_generator.generar_pdf(data)
+    return (time.perf_counter() - inicio) / iteraciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iteraciones", type=int, default=200)
+    parser.add_argument("--lineas", type=int, default=3)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    crear_logo_png("logo.png")
+    data = datos_cotizacion(os.path.abspath("logo.png"), args.lineas)
+
+    antes = medir(data, args.iteraciones, con_plantilla=False)
+    despues = medir(data, args.iteraciones, con_plantilla=True)
+    print(f"Líneas por cotización: {args.lineas}, iteraciones: {args.iteraciones}")
+    print(f"Sin plantilla: {antes * 1000:8.2f} ms/cotización")
+    print(f"Con plantilla: {despues * 1000:8.2f} ms/cotización")
+    print(f"Aceleración:   {antes / despues:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks de generar_pdf, sin red ni base de datos.
+
+Recorre cotizaciones de 1, 10, 100, 1.000 y 10.000 líneas, sin logo y con un
+logo servido por un servidor HTTP local (pasa por logo_cache como en
+producción), con notas y condiciones cortas o largas. Cada escenario corre en
+un proceso aparte y reporta tiempo por PDF (mediana y mínimo), pico de
+memoria residente, tamaño del PDF y rendimiento por núcleo (PDFs y líneas por
+segundo de CPU, ya que cada proceso usa un solo núcleo).
+
+Los resultados se guardan en JSON con el commit y el entorno, y --comparar
+muestra la variación contra una corrida anterior.
+
+Uso: python benchmarks/bench_pdf.py [--lineas 1 10 100 1000 10000]
+     [--segundos 2] [--salida resultados.json] [--comparar anterior.json]
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+from bench_membrete import crear_logo_png, datos_cotizacion  # noqa: E402
+
+NOTAS_LARGAS = (
+    "El precio no incluye transporte fuera del perímetro urbano. La garantía "
+    "cubre defectos de fabricación durante doce meses. "
+) * 30
+
+
+def _rss_mb():
+    # ru_maxrss está en KiB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _cpu():
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return uso.ru_utime + uso.ru_stime
+
+
+def escenario(lineas, logo_url, notas_largas):
+    data = datos_cotizacion(logo_url, lineas)
+    for i, p in enumerate(data["productos"]):
+        p["descuento"] = float(i % 3 * 100)
+        p["iva"] = 19.0
+    if notas_largas:
+        data["notas_legales"] = NOTAS_LARGAS
+        data["condiciones"] = NOTAS_LARGAS
+        data["observaciones"] = NOTAS_LARGAS[:500]
+    else:
+        data["notas_legales"] = "Oferta válida por 30 días."
+        data["condiciones"] = "Pago contra entrega."
+    return data
+
+
+def medir(lineas, logo_url, notas_largas, segundos):
+    """Corre en el proceso hijo: renderiza el escenario durante ~`segundos`."""
+    os.environ.setdefault("LOGO_CACHE_DIR", tempfile.mkdtemp())
+    import pdf_generator
+
+    data = escenario(lineas, logo_url or None, notas_largas)
+    # Calentamiento: descarga el logo y arma el membrete
+    pdf_generator.generar_pdf(data)
+    base = _rss_mb()
+    tiempos = []
+    cpu = _cpu()
+    inicio = time.perf_counter()
+    while not tiempos or (
+        time.perf_counter() - inicio < segundos and len(tiempos) < 1000
+    ):
+        t = time.perf_counter()
+        pdf_bytes, _ = pdf_generator.generar_pdf(data)
+        tiempos.append(time.perf_counter() - t)
+    cpu = _cpu() - cpu
+    return {
+        "renders": len(tiempos),
+        "mediana_ms": round(statistics.median(tiempos) * 1000, 2),
+        "minimo_ms": round(min(tiempos) * 1000, 2),
+        "rss_pico_mb": round(_rss_mb(), 1),
+        "rss_render_mb": round(_rss_mb() - base, 1),
+        "pdf_kb": round(len(pdf_bytes) / 1024, 1),
+        "pdfs_por_seg_cpu": round(len(tiempos) / cpu, 2) if cpu else None,
+        "lineas_por_seg_cpu": round(len(tiempos) * lineas / cpu) if cpu else None,
+    }
+
+
+class _Silencioso(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def servir_logo(directorio):
+    """Sirve `directorio` por HTTP en un puerto libre; devuelve la URL base."""
+
+    def handler(*args, **kwargs):
+        return _Silencioso(*args, directory=directorio, **kwargs)
+
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def _entorno():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import fpdf
+
+    return {
+        "commit": commit,
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "fpdf": fpdf.FPDF_VERSION,
+        "plataforma": platform.platform(),
+        "nucleos": os.cpu_count(),
+    }
+
+
+def _clave(r):
+    return (r["lineas"], r["logo"], r["notas_largas"])
+
+
+def comparar(anterior, actual):
+    previos = {_clave(r): r for r in anterior["resultados"]}
+    print()
+    print(f"Comparación con {anterior['entorno'].get('commit')} (mediana por PDF)")
+    for r in actual["resultados"]:
+        p = previos.get(_clave(r))
+        if not p:
+            continue
+        cambio = (r["mediana_ms"] / p["mediana_ms"] - 1) * 100
+        print(
+            f"{r['lineas']:6} {'sí' if r['logo'] else 'no':>4}"
+            f" {'largas' if r['notas_largas'] else 'cortas':>7}"
+            f" {p['mediana_ms']:10.2f} → {r['mediana_ms']:10.2f} ms ({cambio:+.1f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--lineas", type=int, nargs="+", default=[1, 10, 100, 1000, 10000]
+    )
+    parser.add_argument(
+        "--segundos", type=float, default=2, help="Tiempo de medición por escenario"
+    )
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--medir", nargs=4, metavar=("LINEAS", "LOGO", "NOTAS", "SEG"))
+    args = parser.parse_args()
+
+    if args.medir:
+        lineas, logo_url, notas, segundos = args.medir
+        print(
+            json.dumps(medir(int(lineas), logo_url, notas == "largas", float(segundos)))
+        )
+        return
+
+    directorio = tempfile.mkdtemp()
+    crear_logo_png(os.path.join(directorio, "logo.png"))
+    logo_url = servir_logo(directorio) + "/logo.png"
+    entorno = _entorno()
+    print(
+        f"Commit {entorno['commit']}, Python {entorno['python']},"
+        f" fpdf {entorno['fpdf']}, {entorno['nucleos']} núcleos"
+    )
+    print(
+        f"{'Líneas':>6} {'Logo':>4} {'Notas':>7} {'Mediana ms':>11} {'Mín ms':>9}"
+        f" {'RSS MB':>7} {'PDF KB':>8} {'PDF/s CPU':>10} {'Líneas/s CPU':>13}"
+    )
+    resultados = []
+    for lineas in args.lineas:
+        for con_logo in (False, True):
+            for notas in ("cortas", "largas"):
+                salida = subprocess.run(
+                    [
+                        sys.executable,
+                        __file__,
+                        "--medir",
+                        str(lineas),
+                        logo_url if con_logo else "",
+                        notas,
+                        str(args.segundos),
+                    ],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                r = json.loads(salida.strip().splitlines()[-1])
+                r.update(lineas=lineas, logo=con_logo, notas_largas=notas == "largas")
+                resultados.append(r)
+                print(
+                    f"{lineas:6} {'sí' if con_logo else 'no':>4} {notas:>7}"
+                    f" {r['mediana_ms']:11.2f} {r['minimo_ms']:9.2f}"
+                    f" {r['rss_pico_mb']:7.1f} {r['pdf_kb']:8.1f}"
+                    f" {r['pdfs_por_seg_cpu']:10.2f} {r['lineas_por_seg_cpu']:13}"
+                )
+
+    informe = {"entorno": entorno, "resultados": resultados}
+    salida = args.salida or os.path.join(
+        tempfile.gettempdir(), f"bench_pdf_{entorno['commit'] or 'local'}.json"
+    )
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), informe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria y tiempo del PDF de cotizaciones con muchas líneas.
+
+Compara el render completo en memoria de FPDF (el de las cotizaciones
+normales) con escribir_pdf_grande, que escribe cada página apenas se llena.
+Cada medición corre en un proceso aparte y reporta el tiempo, el pico de
+memoria residente (RSS) que agregó el render y el tamaño del PDF. Termina con
+error si el modo por páginas supera --max-rss en alguna medición.
+
+Uso: python benchmarks/bench_pdf_grande.py [--lineas 1000 5000 10000 20000]
+     [--max-rss 32]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_membrete import crear_logo_png, datos_cotizacion  # noqa: E402
+
+MODOS = ("completo", "por_paginas")
+
+
+def _rss_mb():
+    # ru_maxrss está en KiB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def medir(lineas, modo, logo):
+    """Corre en el proceso hijo: renderiza `lineas` líneas y devuelve las cifras."""
+    import pdf_generator
+
+    # Elegir el modo sin depender del umbral configurado
+    pdf_generator.PDF_LINEAS_GRANDE = 0 if modo == "por_paginas" else sys.maxsize
+    pdf_generator.generar_pdf(datos_cotizacion(logo, 1))  # calentamiento
+    data = datos_cotizacion(logo, lineas)
+    data["notas_legales"] = "Condiciones generales de la oferta. " * 40
+    base = _rss_mb()
+    inicio = time.perf_counter()
+    pdf_bytes, _ = pdf_generator.generar_pdf(data)
+    segundos = time.perf_counter() - inicio
+    return {
+        "segundos": round(segundos, 2),
+        "rss_mb": round(_rss_mb() - base, 1),
+        "kb": len(pdf_bytes) // 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--lineas", type=int, nargs="+", default=[1000, 5000, 10000, 20000]
+    )
+    parser.add_argument("--max-rss", type=float, default=32, help="MB")
+    parser.add_argument("--medir", nargs=3, metavar=("LINEAS", "MODO", "LOGO"))
+    args = parser.parse_args()
+
+    if args.medir:
+        lineas, modo, logo = args.medir
+        print(json.dumps(medir(int(lineas), modo, logo)))
+        return
+
+    logo = os.path.join(tempfile.mkdtemp(), "logo.png")
+    crear_logo_png(logo)
+    print(
+        f"{'Líneas':>7} {'Modo':12} {'Tiempo (s)':>11} {'RSS (MB)':>9} {'PDF (KB)':>9}"
+    )
+    excedidos = []
+    for lineas in args.lineas:
+        for modo in MODOS:
+            salida = subprocess.run(
+                [sys.executable, __file__, "--medir", str(lineas), modo, logo],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            r = json.loads(salida.strip().splitlines()[-1])
+            print(
+                f"{lineas:7} {modo:12} {r['segundos']:11.2f}"
+                f" {r['rss_mb']:9.1f} {r['kb']:9}"
+            )
+            if modo == "por_paginas" and r["rss_mb"] > args.max_rss:
+                excedidos.append(lineas)
+    if excedidos:
+        print(f"El modo por páginas superó {args.max_rss} MB con {excedidos} líneas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
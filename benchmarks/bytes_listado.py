@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Comprueba cuántos bytes trae de la base de datos un GET /cotizacion.
+
+Siembra una empresa con cotizaciones que aún tienen el PDF en la columna
+archivo_pdf (el peor caso) y cuenta, con el evento "load" del ORM, los bytes
+de cada columna hidratada. Termina con código 1 si el endpoint falla o si el
+listado trae los PDFs (más de MAX_BYTES_POR_FILA por fila).
+
+Las cotizaciones sembradas no deben superar PAGINA_MAX (500 por defecto),
+porque el listado se pide en una sola página.
+
+Uso: python benchmarks/bytes_listado.py [--cotizaciones 200] [--kb-pdf 100]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+# Límite de bytes por fila aceptable para un listado sin PDFs
+MAX_BYTES_POR_FILA = 4096
+
+
+def _tamano(valor):
+    if valor is None:
+        return 0
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return len(valor)
+    if isinstance(valor, str):
+        return len(valor.encode("utf-8"))
+    if isinstance(valor, (list, dict)):
+        return len(json.dumps(valor))
+    return 8
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cotizaciones", type=int, default=200)
+    parser.add_argument("--kb-pdf", type=int, default=100)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(directorio, "bench.db")
+    os.chdir(directorio)
+
+    import jwt
+    import sqlalchemy as sa
+    from sqlalchemy import event
+
+    from app import app
+    from database import db
+    from migraciones import aplicar_migraciones
+    from models import Cotizacion, Empresa
+
+    leidos = {"bytes": 0}
+
+    @event.listens_for(Cotizacion, "load")
+    def _contar(target, context):
+        # Solo las columnas: las relaciones con carga ansiosa (items) se
+        # cuentan en su propia tabla, y las diferidas no están en __dict__
+        columnas = sa.inspect(target).mapper.column_attrs
+        leidos["bytes"] += sum(
+            _tamano(target.__dict__[c.key])
+            for c in columnas
+            if c.key in target.__dict__
+        )
+
+    with app.app_context():
+        aplicar_migraciones()
+        empresa = Empresa(nombre="Bench", email="bench@example.com")
+        empresa.set_password("bench")
+        db.session.add(empresa)
+        db.session.commit()
+        token = jwt.encode(
+            {"empresa_id": empresa.id}, app.config["SECRET_KEY"], algorithm="HS256"
+        )
+        empresa.token_activo = token
+        empresa_id = empresa.id
+        pdf = os.urandom(args.kb_pdf * 1024)
+        db.session.add_all(
+            Cotizacion(
+                empresa_id=empresa_id,
+                cliente=f"Cliente {i}",
+                correo="cliente@example.com",
+                codigo_cotizacion=f"COT-{i}",
+                productos=[{"id": 1, "nombre": "P", "precio": 10, "cantidad": 1}],
+                total=10,
+                estado_envio="Enviado",
+                archivo_pdf=pdf,
+                pdf_tamano=len(pdf),
+            )
+            for i in range(args.cotizaciones)
+        )
+        db.session.commit()
+
+        # Antes: la consulta cargando la columna del PDF
+        db.session.expunge_all()
+        leidos["bytes"] = 0
+        Cotizacion.query.options(db.undefer(Cotizacion.archivo_pdf)).filter_by(
+            empresa_id=empresa_id
+        ).all()
+        antes = leidos["bytes"]
+
+    # Después: el endpoint real, pidiendo todas las filas sembradas
+    leidos["bytes"] = 0
+    respuesta = app.test_client().get(
+        f"/cotizacion?limite={args.cotizaciones}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    if respuesta.status_code != 200:
+        print(f"ERROR: GET /cotizacion respondió {respuesta.status_code}")
+        print(respuesta.get_data(as_text=True)[:500])
+        sys.exit(1)
+    despues = leidos["bytes"]
+    filas = len(respuesta.get_json())
+    if filas != args.cotizaciones:
+        print(f"ERROR: el listado devolvió {filas} de {args.cotizaciones} filas")
+        sys.exit(1)
+
+    por_fila = despues / filas
+    print(f"Cotizaciones: {args.cotizaciones}, PDF: {args.kb_pdf} KB")
+    print(f"Cargando archivo_pdf: {antes / 1024:10.1f} KB")
+    print(f"GET /cotizacion:      {despues / 1024:10.1f} KB ({por_fila:.0f} B/fila)")
+    if por_fila > MAX_BYTES_POR_FILA:
+        print(f"ERROR: el listado lee más de {MAX_BYTES_POR_FILA} B por fila")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
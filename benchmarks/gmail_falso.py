@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP que imita los endpoints de Gmail que usa la aplicación, para
+medir envíos sin red ni cuentas reales.
+
+- POST /gmail/v1/users/me/messages/send: acepta el mensaje si el Bearer es un
+  access token vigente; si no, responde 401 como Google.
+- POST /token: renueva el access token (token_uri de client_secret.json).
+
+Uso como módulo:
+
+    servidor = GmailFalso(latencia=0.01).iniciar()
+    os.environ["GMAIL_API_URL"] = servidor.url
+    ...
+    servidor.detener()
+
+Uso suelto: python benchmarks/gmail_falso.py [--puerto 8089] [--latencia 0.01]
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: permite ver si se reusa la conexión
+    disable_nagle_algorithm = True  # encabezados y cuerpo salen sin esperar ACK
+
+    def setup(self):
+        super().setup()
+        with self.server.gmail.lock:
+            self.server.gmail.conexiones += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, estado, cuerpo):
+        datos = json.dumps(cuerpo).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_POST(self):
+        gmail = self.server.gmail
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if gmail.latencia:
+            time.sleep(gmail.latencia)
+        if self.path.startswith("/token"):
+            token = f"falso-{next(gmail.secuencia)}"
+            with gmail.lock:
+                gmail.renovaciones += 1
+                gmail.tokens_validos.add(token)
+            return self._responder(
+                200,
+                {"access_token": token, "expires_in": 3600, "token_type": "Bearer"},
+            )
+        if self.path.startswith("/gmail/v1/users/me/messages/send"):
+            token = self.headers.get("Authorization", "").replace("Bearer ", "")
+            if token not in gmail.tokens_validos:
+                return self._responder(
+                    401, {"error": {"code": 401, "message": "Invalid Credentials"}}
+                )
+            with gmail.lock:
+                gmail.enviados += 1
+                numero = gmail.enviados
+            return self._responder(
+                200,
+                {"id": f"m{numero}", "threadId": f"t{numero}", "labelIds": ["SENT"]},
+            )
+        self._responder(404, {"error": {"code": 404, "message": "Not Found"}})
+
+
+class GmailFalso:
+    def __init__(self, puerto=0, latencia=0.0, tokens_validos=("valido",)):
+        self.latencia = latencia
+        self.tokens_validos = set(tokens_validos)
+        self.secuencia = itertools.count(1)
+        self.lock = threading.Lock()
+        self.enviados = 0
+        self.renovaciones = 0
+        self.conexiones = 0
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Handler)
+        self._servidor.daemon_threads = True
+        self._servidor.gmail = self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}/"
+
+    def client_secret(self):
+        """Contenido de un client_secret.json cuyo token_uri apunta a este servidor."""
+        return {
+            "web": {
+                "client_id": "falso.apps.googleusercontent.com",
+                "client_secret": "falso",
+                "token_uri": self.url + "token",
+                "auth_uri": self.url + "auth",
+            }
+        }
+
+    def reiniciar_contadores(self):
+        with self.lock:
+            self.enviados = self.renovaciones = self.conexiones = 0
+
+    def iniciar(self):
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gmail falso para pruebas locales")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=0.0)
+    args = parser.parse_args()
+    servidor = GmailFalso(args.puerto, args.latencia).iniciar()
+    print(f"Gmail falso en {servidor.url} (token válido: 'valido')")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.detener()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Comprueba cómo PUT /cotizacion/<id> trata las cotizaciones anteriores a la huella.
+
+Siembra dos cotizaciones antiguas, con el PDF todavía en la columna archivo_pdf
+y sin pdf_ref ni pdf_entrada:
+
+- una recibe un cambio que no se dibuja (estado_envio): su PDF debe quedar
+  intacto y la respuesta debe decir "pdf_regenerado": false;
+- otra, además, sin subtotal, descuento ni IVA guardados, recibe un cambio
+  que sí se dibuja (cliente): el PDF debe regenerarse con los totales
+  liquidados.
+
+Termina con código 1 si alguna de las dos falla.
+
+Uso: python benchmarks/pdf_antiguo.py
+"""
+
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+
+def main():
+    directorio = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(directorio, "pdf.db")
+    os.chdir(directorio)
+
+    import jwt
+
+    from app import app
+    from database import db
+    from migraciones import aplicar_migraciones
+    from models import Cotizacion, Empresa
+
+    pdf_antiguo = b"%PDF-1.3 antiguo"
+    with app.app_context():
+        aplicar_migraciones()
+        empresa = Empresa(nombre="Antigua", email="antigua@example.com")
+        empresa.set_password("antigua")
+        db.session.add(empresa)
+        db.session.commit()
+        token = jwt.encode(
+            {"empresa_id": empresa.id}, app.config["SECRET_KEY"], algorithm="HS256"
+        )
+        empresa.token_activo = token
+        productos = [{"id": 1, "nombre": "P", "precio": 1000, "cantidad": 2}]
+        vigente = Cotizacion(
+            empresa_id=empresa.id,
+            cliente="Cliente",
+            correo="cliente@example.com",
+            codigo_cotizacion="COT-1",
+            productos=productos,
+            subtotal=2000,
+            descuento=0,
+            iva=0,
+            total=2000,
+            estado_envio="Pendiente",
+            archivo_pdf=pdf_antiguo,
+        )
+        sin_totales = Cotizacion(
+            empresa_id=empresa.id,
+            cliente="Cliente",
+            correo="cliente@example.com",
+            codigo_cotizacion="COT-2",
+            productos=productos,
+            total=2000,
+            estado_envio="Pendiente",
+            archivo_pdf=pdf_antiguo,
+        )
+        db.session.add_all([vigente, sin_totales])
+        db.session.commit()
+        ids = vigente.id, sin_totales.id
+
+    cliente = app.test_client()
+    cabeceras = {"Authorization": f"Bearer {token}"}
+    errores = []
+
+    respuesta = cliente.put(
+        f"/cotizacion/{ids[0]}", json={"estado_envio": "Enviado"}, headers=cabeceras
+    )
+    if respuesta.status_code != 200 or respuesta.get_json()["pdf_regenerado"]:
+        errores.append(f"estado_envio: {respuesta.status_code} {respuesta.data!r}")
+    with app.app_context():
+        c = db.session.get(Cotizacion, ids[0])
+        if c.archivo_pdf != pdf_antiguo or c.pdf_ref:
+            errores.append("estado_envio: se reemplazó el PDF antiguo")
+
+    respuesta = cliente.put(
+        f"/cotizacion/{ids[1]}", json={"cliente": "Otro"}, headers=cabeceras
+    )
+    if respuesta.status_code != 200 or not respuesta.get_json()["pdf_regenerado"]:
+        errores.append(f"cliente: {respuesta.status_code} {respuesta.data!r}")
+    with app.app_context():
+        c = db.session.get(Cotizacion, ids[1])
+        if c.subtotal != 2000 or c.iva != 0 or not c.pdf_ref:
+            errores.append(f"cliente: subtotal={c.subtotal} iva={c.iva}")
+
+    for error in errores:
+        print("ERROR:", error)
+    if errores:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
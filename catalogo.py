@@ -0,0 +1,116 @@
+"""
+Resolución de los productos que referencia una cotización.
+
+Solo se consultan los ids pedidos (un único SELECT ... IN). Opcionalmente se
+guarda en memoria una copia de los productos ya resueltos de cada empresa,
+válida mientras no cambie Empresa.catalogo_version; la versión se incrementa
+en la base de datos en cada flush que toca productos, así que todos los
+workers ven el cambio aunque la caché sea local a cada proceso.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import db
+from models import Empresa, Producto
+
+# Empresas con catálogo en memoria (LRU); 0 desactiva la caché
+CATALOGO_CACHE_MAX_EMPRESAS = int(os.getenv("CATALOGO_CACHE_MAX_EMPRESAS", 256))
+# Productos guardados por empresa antes de vaciar su entrada
+CATALOGO_CACHE_MAX_PRODUCTOS = int(os.getenv("CATALOGO_CACHE_MAX_PRODUCTOS", 5000))
+
+_cache = OrderedDict()  # empresa_id -> (catalogo_version, {producto_id: datos})
+_lock = threading.Lock()
+
+
+def _datos(p):
+    return {
+        "id": p.id,
+        "nombre": p.nombre,
+        "descripcion": p.descripcion,
+        "precio": p.precio,
+        "unidad": p.unidad,
+        "codigo": p.codigo,
+    }
+
+
+def _ids_validos(ids):
+    # Un id que no es numérico ("1", None) nunca coincide con un producto
+    return {i for i in ids if isinstance(i, (int, float)) and not isinstance(i, bool)}
+
+
+def _consultar(empresa_id, ids):
+    if not ids:
+        return {}
+    filas = Producto.query.filter(
+        Producto.empresa_id == empresa_id, Producto.id.in_(ids)
+    ).all()
+    return {p.id: _datos(p) for p in filas}
+
+
+def productos_por_id(empresa, ids):
+    """
+    Devuelve {id: datos} de los productos de `empresa` cuyos ids están en
+    `ids`; los que no existen o son de otra empresa simplemente no aparecen.
+    """
+    ids = _ids_validos(ids)
+    if CATALOGO_CACHE_MAX_EMPRESAS <= 0:
+        return _consultar(empresa.id, ids)
+
+    version = empresa.catalogo_version
+    with _lock:
+        entrada = _cache.get(empresa.id)
+        if entrada and entrada[0] == version:
+            _cache.move_to_end(empresa.id)
+            conocidos = entrada[1]
+        else:
+            conocidos = {}
+        encontrados = {i: conocidos[i] for i in ids if i in conocidos}
+
+    faltantes = ids - encontrados.keys()
+    nuevos = _consultar(empresa.id, faltantes)
+    encontrados.update(nuevos)
+    if nuevos:
+        with _lock:
+            entrada = _cache.get(empresa.id)
+            if not entrada or entrada[0] != version:
+                entrada = (version, {})
+            if len(entrada[1]) + len(nuevos) > CATALOGO_CACHE_MAX_PRODUCTOS:
+                entrada = (version, {})
+            entrada[1].update(nuevos)
+            _cache[empresa.id] = entrada
+            _cache.move_to_end(empresa.id)
+            while len(_cache) > CATALOGO_CACHE_MAX_EMPRESAS:
+                _cache.popitem(last=False)
+    return encontrados
+
+
+def invalidar_catalogo(empresa_ids, conexion=None):
+    """
+    Incrementa catalogo_version de las empresas. Las escrituras por ORM lo
+    hacen solas; llamarla tras UPDATE/INSERT masivos que no pasan por el ORM.
+    """
+    if not empresa_ids:
+        return
+    empresas = Empresa.__table__
+    stmt = (
+        empresas.update()
+        .where(empresas.c.id.in_(list(empresa_ids)))
+        .values(catalogo_version=empresas.c.catalogo_version + 1)
+    )
+    (conexion or db.session).execute(stmt)
+
+
+@event.listens_for(Session, "after_flush")
+def _productos_modificados(session, flush_context):
+    empresa_ids = {
+        obj.empresa_id
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, Producto) and obj.empresa_id
+    }
+    # Se ejecuta en la misma transacción que el cambio de los productos
+    invalidar_catalogo(empresa_ids, session.connection())
@@ -0,0 +1,138 @@
+"""
+Clientes de la API de Gmail reutilizables por empresa.
+
+client_secret.json se lee una sola vez y el documento de discovery sale de la
+copia estática que trae google-api-python-client, así que armar un cliente no
+toca disco ni red. Cada empresa tiene un pequeño pool de clientes ya armados;
+cada cliente conserva su conexión HTTP y sus credenciales, y cuando Google
+renueva el access token el nuevo se guarda en Empresa.gmail_access_token para
+que los siguientes envíos (en este u otro worker) no vuelvan a renovarlo.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from database import db
+from models import Empresa
+
+GMAIL_CLIENT_SECRET = os.getenv("GMAIL_CLIENT_SECRET", "client_secret.json")
+# Clientes inactivos que se conservan por empresa; 0 arma uno por envío
+GMAIL_POOL_POR_EMPRESA = int(os.getenv("GMAIL_POOL_POR_EMPRESA", 2))
+GMAIL_POOL_MAX_EMPRESAS = int(os.getenv("GMAIL_POOL_MAX_EMPRESAS", 256))
+GMAIL_TIMEOUT = float(os.getenv("GMAIL_TIMEOUT", 30))
+# Raíz alternativa del API, p. ej. el Gmail falso de benchmarks/gmail_falso.py
+GMAIL_API_URL = os.getenv("GMAIL_API_URL")
+
+_config = None
+_discovery = None
+_pools = OrderedDict()  # (empresa_id, refresh_token) -> [ClienteGmail inactivos]
+_lock = threading.Lock()
+
+
+def config_cliente():
+    """Contenido de client_secret.json, leído una sola vez por proceso."""
+    global _config
+    if _config is None:
+        with open(GMAIL_CLIENT_SECRET) as f:
+            _config = json.load(f)
+    return _config
+
+
+def _documento_discovery():
+    global _discovery
+    if _discovery is None:
+        _discovery = json.loads(get_static_doc("gmail", "v1"))
+    return _discovery
+
+
+class ClienteGmail:
+    """Servicio de Gmail con credenciales y conexión HTTP propias."""
+
+    def __init__(self, access_token, refresh_token):
+        secrets = config_cliente()["web"]
+        self.credenciales = Credentials(
+            token=access_token,
+            refresh_token=refresh_token,
+            token_uri=secrets["token_uri"],
+            client_id=secrets["client_id"],
+            client_secret=secrets["client_secret"],
+        )
+        http = AuthorizedHttp(
+            self.credenciales, http=httplib2.Http(timeout=GMAIL_TIMEOUT)
+        )
+        opciones = {"api_endpoint": GMAIL_API_URL} if GMAIL_API_URL else None
+        servicio = build_from_document(
+            _documento_discovery(), http=http, client_options=opciones
+        )
+        # Cada users()/messages() arma sus métodos desde el discovery: una vez
+        self.mensajes = servicio.users().messages()
+
+    def enviar(self, raw):
+        return self.mensajes.send(userId="me", body={"raw": raw}).execute()
+
+
+def _guardar_token(empresa_id, token):
+    # Conexión propia: no interfiere con la transacción del request
+    empresas = Empresa.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            empresas.update()
+            .where(empresas.c.id == empresa_id)
+            .values(gmail_access_token=token)
+        )
+
+
+@contextmanager
+def cliente_gmail(access_token, refresh_token, empresa_id=None):
+    """
+    Presta un ClienteGmail de la empresa y lo devuelve al pool al terminar.
+    Si durante el uso se renovó el access token y se conoce `empresa_id`,
+    el token nuevo se guarda en la base de datos.
+    """
+    clave = (empresa_id, refresh_token or access_token)
+    cliente = None
+    with _lock:
+        libres = _pools.get(clave)
+        if libres:
+            cliente = libres.pop()
+    if cliente is None:
+        cliente = ClienteGmail(access_token, refresh_token)
+    token_inicial = cliente.credenciales.token
+    try:
+        yield cliente
+    finally:
+        token = cliente.credenciales.token
+        if empresa_id is not None and token and token != token_inicial:
+            try:
+                _guardar_token(empresa_id, token)
+            except Exception as e:
+                # Si el correo ya salió, un error aquí lo haría pasar por
+                # fallido y la bandeja de salida lo enviaría de nuevo
+                print("Error guardando el access token renovado:", e)
+        if GMAIL_POOL_POR_EMPRESA > 0:
+            with _lock:
+                libres = _pools.setdefault(clave, [])
+                _pools.move_to_end(clave)
+                if len(libres) < GMAIL_POOL_POR_EMPRESA:
+                    libres.append(cliente)
+                while len(_pools) > GMAIL_POOL_MAX_EMPRESAS:
+                    _pools.popitem(last=False)
+
+
+def vaciar_pool(empresa_id=None):
+    """Descarta los clientes de una empresa (o todos), p. ej. tras reautorizar."""
+    with _lock:
+        if empresa_id is None:
+            _pools.clear()
+        else:
+            for clave in [c for c in _pools if c[0] == empresa_id]:
+                del _pools[clave]
@@ -1,28 +1,78 @@
-from flask import Blueprint, request, jsonify, current_app, redirect, url_for
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    jsonify,
+    current_app,
+    redirect,
+    send_file,
+    stream_with_context,
+    url_for,
+)
 from models import (
     Cotizacion,
     Empresa,
+    ItemCotizacion,
     Producto,
     CodigoInvitacion,
     Soporte,
     LogActividad,
+    TrabajoCotizacion,
+    TrabajoImportacion,
 )
 from database import db
-from pdf_generator import generar_pdf
+from almacenamiento import guardar_pdf, hash_pdf, liberar_pdf, obtener_pdf
+from bandeja_salida import correo_activo, despertar, nuevo_correo
+from catalogo import productos_por_id
+from clientes_gmail import cliente_gmail, config_cliente, vaciar_pool
+from exportacion import (
+    FORMATOS,
+    PLANTILLA_MAX_AGE,
+    csv_catalogo,
+    plantilla_excel,
+    xlsx_catalogo,
+)
+from importacion import (
+    COLUMNAS_OBLIGATORIAS,
+    COLUMNAS_OPCIONALES,
+    EXTENSIONES,
+    MODOS,
+    abrir_archivo,
+    encolar_importacion,
+    importar,
+)
+from paginacion import CursorInvalido, paginar, respuesta_paginada
+from sesiones import (
+    EmpresaSesion,
+    SesionInvalida,
+    decodificar_token,
+    empresa_de_token,
+    invalidar_sesion,
+    token_de_request,
+)
+from pdf_generator import (
+    CAMPOS_ENCABEZADO,
+    CAMPOS_NOTAS,
+    CAMPOS_TOTALES,
+    huella_pdf,
+    renderizar,
+)
+from precios import liquidar
+from trabajos import COTIZACION_LOTE_MAX, datos_pdf, encolar, renderizar_lote
 from email_sender import enviar_email
+import io
+import json
 import os
 from datetime import datetime
 import jwt  # PyJWT
 from functools import wraps
+from contextlib import closing
 import secrets
 from datetime import timedelta
 from flask import Blueprint
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
 import base64
-import json as _json
 import cloudinary
 import cloudinary.uploader
 
@@ -34,6 +84,14 @@ cloudinary.config(
 
 cotizacion_bp = Blueprint("cotizacion", __name__)
 
+# Campos de PUT /cotizacion/<id> que se dibujan en el PDF
+CAMPOS_PDF = {"productos", *CAMPOS_ENCABEZADO, *CAMPOS_NOTAS, *CAMPOS_TOTALES}
+
+
+@cotizacion_bp.errorhandler(CursorInvalido)
+def cursor_invalido(e):
+    return jsonify({"error": "Cursor de paginación inválido"}), 400
+
 
 @cotizacion_bp.route("/codigo/seguridad", methods=["POST"])
 def generar_codigo_invitacion():
@@ -59,51 +117,45 @@ def generar_codigo_invitacion():
 
 
 # --- Decorador de autenticación JWT con control de token en base de datos ---
+# La validación se cachea por token (ver sesiones.py); el endpoint recibe una
+# EmpresaSesion que solo consulta la base si usa algo más que empresa.id
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if "Authorization" in request.headers:
-            auth_header = request.headers["Authorization"]
-            if auth_header.startswith("Bearer "):
-                token = auth_header.split(" ")[1]
+        token = token_de_request()
         if not token:
             return jsonify({"error": "Token requerido"}), 401
         try:
-            data = jwt.decode(
-                token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
-            )
-            empresa = Empresa.query.get(data["empresa_id"])
-            if not empresa:
-                return jsonify({"error": "Empresa no encontrada"}), 401
-            # Validar que el token coincida con el token_activo de la empresa
-            if not empresa.token_activo or empresa.token_activo != token:
-                return jsonify({"error": "Token inválido o sesión cerrada"}), 401
+            empresa_id = empresa_de_token(token)
+        except SesionInvalida as e:
+            return jsonify({"error": str(e)}), 401
         except Exception as e:
             return jsonify({"error": "Token inválido", "detail": str(e)}), 401
-        return f(empresa, *args, **kwargs)
+        return f(EmpresaSesion(empresa_id), *args, **kwargs)
 
     return decorated
 
 
+def _validar_admin(mensaje_prohibido):
+    """Devuelve None si el request trae un token de administrador, o la respuesta de error."""
+    token = token_de_request()
+    if not token:
+        return jsonify({"error": "Token requerido"}), 401
+    try:
+        data = decodificar_token(token)
+    except Exception as e:
+        return jsonify({"error": "Token inválido", "detail": str(e)}), 401
+    if not data.get("admin"):
+        return jsonify({"error": mensaje_prohibido}), 403
+    return None
+
+
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if "Authorization" in request.headers:
-            auth_header = request.headers["Authorization"]
-            if auth_header.startswith("Bearer "):
-                token = auth_header.split(" ")[1]
-        if not token:
-            return jsonify({"error": "Token requerido"}), 401
-        try:
-            data = jwt.decode(
-                token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
-            )
-            if not data.get("admin"):
-                return jsonify({"error": "Solo el administrador puede acceder"}), 403
-        except Exception as e:
-            return jsonify({"error": "Token inválido", "detail": str(e)}), 401
+        error = _validar_admin("Solo el administrador puede acceder")
+        if error:
+            return error
         return f(*args, **kwargs)
 
     return decorated
@@ -194,8 +246,10 @@ def login():
     token = jwt.encode(
         {"empresa_id": empresa.id}, current_app.config["SECRET_KEY"], algorithm="HS256"
     )
+    token_anterior = empresa.token_activo
     empresa.token_activo = token
     db.session.commit()
+    invalidar_sesion(token_anterior)
     return jsonify(
         {
             "token": token,
@@ -237,8 +291,10 @@ def crear_producto(empresa):
 @cotizacion_bp.route("/producto", methods=["GET"])
 @token_required
 def listar_productos(empresa):
-    productos = Producto.query.filter_by(empresa_id=empresa.id).all()
-    return jsonify(
+    productos, siguiente = paginar(
+        Producto.query.filter_by(empresa_id=empresa.id), Producto.id
+    )
+    return respuesta_paginada(
         [
             {
                 "id": p.id,
@@ -249,7 +305,8 @@ def listar_productos(empresa):
                 "codigo": p.codigo,
             }
             for p in productos
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -303,76 +360,31 @@ def crear_cotizacion(empresa):
     data = request.json or {}
     if not all(data.get(k) for k in ("cliente", "correo", "productos")):
         return jsonify({"error": "Datos incompletos"}), 400
-    import json
 
-    productos_input = data["productos"]
-    if isinstance(productos_input, str):
-        try:
-            productos_input = json.loads(productos_input)
-        except Exception:
-            return jsonify({"error": "El campo 'productos' no es un JSON válido"}), 400
-    if not isinstance(productos_input, list) or not productos_input:
-        return jsonify({"error": "Debe enviar al menos un producto válido"}), 400
+    productos_input, error = _leer_productos(data["productos"])
+    if error:
+        return jsonify({"error": error}), 400
 
     # Validar que todos los productos existan en la base de datos y pertenezcan a la empresa
-    productos_db = {
-        p.id: p for p in Producto.query.filter_by(empresa_id=empresa.id).all()
-    }
-    productos_final = []
-    for p in productos_input:
-        prod_id = p.get("id")
-        cantidad = p.get("cantidad", 1)
-        if not prod_id or prod_id not in productos_db:
-            return (
-                jsonify(
-                    {
-                        "error": f"Producto con id {prod_id} no existe o no pertenece a la empresa"
-                    }
-                ),
-                400,
-            )
-        prod_db = productos_db[prod_id]
-        # Usar datos reales del producto de la base de datos
-        productos_final.append(
-            {
-                "id": prod_db.id,
-                "nombre": prod_db.nombre,
-                "descripcion": prod_db.descripcion,
-                "precio": prod_db.precio,
-                "unidad": prod_db.unidad,
-                "codigo": prod_db.codigo,
-                "cantidad": cantidad,
-            }
-        )
+    productos_final, error = _resolver_productos(empresa, productos_input)
+    if error:
+        return jsonify({"error": error}), 400
 
-    subtotal = sum(p["cantidad"] * p["precio"] for p in productos_final)
-    descuento = float(data.get("descuento", 0))
-    iva = float(data.get("iva", 0))
-    total = subtotal - descuento
-    if iva > 0:
-        total += total * (iva / 100)
-    codigo_cotizacion = data.get("codigo_cotizacion")
-    if not codigo_cotizacion:
-        codigo_cotizacion = f"COT-{int(datetime.utcnow().timestamp())}"
-    data["subtotal"] = subtotal
-    data["descuento"] = descuento
-    data["iva"] = iva
-    data["total"] = total
-    data["codigo_cotizacion"] = codigo_cotizacion
-    # --- Agregar datos de empresa al PDF ---
-    data["empresa"] = {
-        "nombre": empresa.nombre,
-        "nit": empresa.nit,
-        "direccion": empresa.direccion,
-        "telefono": empresa.telefono,
-        "contacto": empresa.contacto,
-        "logo_url": empresa.logo_url,
-        "email": empresa.email,
-    }
-    data["productos"] = productos_final
-    filename = f"cotizacion_{codigo_cotizacion}.pdf"
     try:
-        pdf_bytes, _ = generar_pdf(data, filename)
+        _preparar_cotizacion(
+            empresa,
+            data,
+            productos_final,
+            data.get("codigo_cotizacion")
+            or f"COT-{int(datetime.utcnow().timestamp())}",
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Datos inválidos: {e}"}), 400
+    total = data["total"]
+    if _modo_asincrono():
+        return _encolar_cotizacion(empresa, data)
+    try:
+        pdf_bytes, huella = renderizar(data)
     except Exception as e:
         return jsonify({"error": "Error generando PDF", "detail": str(e)}), 500
     try:
@@ -394,11 +406,109 @@ def crear_cotizacion(empresa):
             "Adjunto PDF de cotización",
             pdf_bytes,
             refresh_token=empresa.gmail_refresh_token,
+            empresa_id=empresa.id,
         )
     except Exception as e:
         enviado = False
     estado = "Enviado" if enviado else "Fallido"
-    cotizacion = Cotizacion(
+    cotizacion = _nueva_cotizacion(empresa, data, estado)
+    try:
+        guardar_pdf(cotizacion, pdf_bytes, huella)
+        db.session.add(cotizacion)
+        if not enviado:
+            # Se reintenta desde la bandeja de salida con el PDF ya guardado
+            nuevo_correo(cotizacion, intentos=1, error="Gmail no aceptó el correo")
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Error guardando cotización", "detail": str(e)}), 500
+    return (
+        jsonify({"mensaje": "Cotización procesada", "total": total, "estado": estado}),
+        200,
+    )
+
+
+def _leer_productos(productos_input):
+    """
+    Devuelve (lista, None) con los productos pedidos (acepta la lista como
+    texto JSON) o (None, mensaje_de_error).
+    """
+    if isinstance(productos_input, str):
+        try:
+            productos_input = json.loads(productos_input)
+        except Exception:
+            return None, "El campo 'productos' no es un JSON válido"
+    if not isinstance(productos_input, list) or not productos_input:
+        return None, "Debe enviar al menos un producto válido"
+    if not all(isinstance(p, dict) for p in productos_input):
+        return None, "Cada producto debe ser un objeto con su 'id'"
+    return productos_input, None
+
+
+def _resolver_productos(empresa, productos_input, productos_db=None):
+    """
+    Valida que los productos existan y pertenezcan a la empresa y devuelve
+    (líneas, None) con una copia de sus datos, o (None, mensaje_de_error).
+    `productos_db` permite pasar los productos ya consultados (lotes).
+    """
+    if productos_db is None:
+        # Un solo SELECT ... IN con los ids pedidos (o la caché del catálogo)
+        productos_db = productos_por_id(empresa, [p.get("id") for p in productos_input])
+    productos_final = []
+    for p in productos_input:
+        prod_id = p.get("id")
+        cantidad = p.get("cantidad", 1)
+        # Un id que no es numérico (p. ej. una lista) nunca está en el catálogo
+        numerico = isinstance(prod_id, (int, float)) and not isinstance(prod_id, bool)
+        if not numerico or prod_id not in productos_db:
+            return (
+                None,
+                f"Producto con id {prod_id} no existe o no pertenece a la empresa",
+            )
+        linea = {**productos_db[prod_id], "cantidad": cantidad}
+        for campo in ("descuento", "iva"):
+            valor = p.get(campo) or 0
+            try:
+                linea[campo] = float(valor)
+            except (TypeError, ValueError):
+                return None, f"Valor numérico inválido: {valor!r}"
+        # Usar datos reales del producto de la base de datos
+        productos_final.append(linea)
+    return productos_final, None
+
+
+def _preparar_cotizacion(empresa, data, productos_final, codigo_cotizacion):
+    """Completa `data` con totales, código, líneas y membrete para el PDF."""
+    precios = liquidar(productos_final, data.get("descuento", 0), data.get("iva", 0))
+    for campo in ("subtotal", "descuento", "iva", "total"):
+        data[campo] = precios[campo]
+    # El PDF usa los totales por línea ya calculados en vez de liquidar de nuevo
+    data["totales_lineas"] = precios["lineas"]
+    data["iva_lineas"] = precios["iva_lineas"]
+    data["codigo_cotizacion"] = codigo_cotizacion
+    # --- Agregar datos de empresa al PDF ---
+    data["empresa"] = {
+        "nombre": empresa.nombre,
+        "nit": empresa.nit,
+        "direccion": empresa.direccion,
+        "telefono": empresa.telefono,
+        "contacto": empresa.contacto,
+        "logo_url": empresa.logo_url,
+        "email": empresa.email,
+    }
+    data["productos"] = productos_final
+    return data
+
+
+def _modo_asincrono(variable="COTIZACION_ASINCRONA"):
+    # Se activa globalmente con la variable de entorno (p. ej. COTIZACION_ASINCRONA=1)
+    # o por request con ?asincrono=1
+    valor = request.args.get("asincrono", os.getenv(variable, "0"))
+    return valor.lower() in ("1", "true", "si")
+
+
+def _nueva_cotizacion(empresa, data, estado):
+    return Cotizacion(
         empresa_id=empresa.id,
         cliente=data["cliente"],
         correo=data["correo"],
@@ -412,25 +522,209 @@ def crear_cotizacion(empresa):
         estado_cotizacion=data.get("estado_cotizacion"),
         notas_legales=data.get("notas_legales"),
         firma=data.get("firma"),
-        codigo_cotizacion=codigo_cotizacion,
+        codigo_cotizacion=data["codigo_cotizacion"],
         observaciones=data.get("observaciones"),
-        productos=productos_final,
-        subtotal=subtotal,
-        descuento=descuento,
-        iva=iva,
-        total=total,
+        productos=data["productos"],
+        subtotal=data["subtotal"],
+        descuento=data["descuento"],
+        iva=data["iva"],
+        total=data["total"],
         condiciones=data.get("condiciones", ""),
         estado_envio=estado,
-        archivo_pdf=pdf_bytes,
     )
+
+
+def _encolar_cotizacion(empresa, data):
+    """Guarda la cotización como pendiente y delega PDF y correo a los workers."""
+    if not empresa.gmail_access_token:
+        return (
+            jsonify(
+                {
+                    "error": "La empresa debe autorizar el envío de correos con Gmail (OAuth2) antes de poder enviar cotizaciones."
+                }
+            ),
+            400,
+        )
+    # El PDF se guarda cuando el worker termina de renderizar
+    cotizacion = _nueva_cotizacion(empresa, data, "Pendiente")
+    trabajo = TrabajoCotizacion(cotizacion=cotizacion, empresa_id=empresa.id)
     try:
         db.session.add(cotizacion)
+        db.session.add(trabajo)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "Error guardando cotización", "detail": str(e)}), 500
+    encolar(current_app._get_current_object(), trabajo.id)
     return (
-        jsonify({"mensaje": "Cotización procesada", "total": total, "estado": estado}),
+        jsonify(
+            {
+                "mensaje": "Cotización en proceso",
+                "trabajo_id": trabajo.id,
+                "cotizacion_id": cotizacion.id,
+                "total": data["total"],
+                "estado": "Pendiente",
+            }
+        ),
+        202,
+    )
+
+
+# Consultar el progreso de una cotización asíncrona
+@cotizacion_bp.route("/cotizacion/trabajo/<int:trabajo_id>", methods=["GET"])
+@token_required
+def estado_trabajo_cotizacion(empresa, trabajo_id):
+    t = TrabajoCotizacion.query.filter_by(id=trabajo_id, empresa_id=empresa.id).first()
+    if not t:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(
+        {
+            "id": t.id,
+            "cotizacion_id": t.cotizacion_id,
+            "estado": t.estado,
+            "estado_envio": t.cotizacion.estado_envio,
+            "error": t.error,
+            "creado": t.creado.isoformat() if t.creado else None,
+            "actualizado": t.actualizado.isoformat() if t.actualizado else None,
+        }
+    )
+
+
+# Crear varias cotizaciones en un solo request (p. ej. una lista de precios a muchos clientes)
+@cotizacion_bp.route("/cotizacion/lote", methods=["POST"])
+@token_required
+def crear_cotizaciones_lote(empresa):
+    """
+    Recibe {"cotizaciones": [...]} con los mismos campos de POST /cotizacion;
+    los demás campos del cuerpo son comunes a todas las entradas (p. ej. una
+    misma lista de "productos"). Los productos se consultan una vez para todo
+    el lote, los PDF se renderizan en paralelo en el pool de procesos, las
+    cotizaciones se guardan en una sola transacción y los correos quedan en la
+    bandeja de salida. "resultados" trae el estado de cada entrada en orden.
+    """
+    body = request.json or {}
+    entradas = body.get("cotizaciones")
+    if not isinstance(entradas, list) or not entradas:
+        return jsonify({"error": "Debe enviar una lista 'cotizaciones' no vacía"}), 400
+    if len(entradas) > COTIZACION_LOTE_MAX:
+        return (
+            jsonify({"error": f"Máximo {COTIZACION_LOTE_MAX} cotizaciones por lote"}),
+            400,
+        )
+    if not empresa.gmail_access_token:
+        return (
+            jsonify(
+                {
+                    "error": "La empresa debe autorizar el envío de correos con Gmail (OAuth2) antes de poder enviar cotizaciones."
+                }
+            ),
+            400,
+        )
+
+    comunes = {k: v for k, v in body.items() if k != "cotizaciones"}
+    # Prefijo de los códigos por defecto; el sufijo evita choques entre lotes
+    marca = f"{int(datetime.utcnow().timestamp())}{secrets.token_hex(2)}"
+    resultados = [None] * len(entradas)
+    pedidos = []  # (índice, data, productos pedidos)
+    for i, entrada in enumerate(entradas):
+        data = {**comunes, **entrada} if isinstance(entrada, dict) else {}
+        if not all(data.get(k) for k in ("cliente", "correo", "productos")):
+            resultados[i] = {
+                "indice": i,
+                "estado": "error",
+                "error": "Datos incompletos",
+            }
+            continue
+        productos_input, error = _leer_productos(data["productos"])
+        if error:
+            resultados[i] = {"indice": i, "estado": "error", "error": error}
+            continue
+        data["codigo_cotizacion"] = (
+            data.get("codigo_cotizacion") or f"COT-{marca}-{i + 1}"
+        )
+        pedidos.append((i, data, productos_input))
+
+    # Un solo SELECT ... IN para los productos y otro para los códigos de todo el lote
+    productos_db = productos_por_id(
+        empresa, [p.get("id") for _, _, productos in pedidos for p in productos]
+    )
+    codigos = [data["codigo_cotizacion"] for _, data, _ in pedidos]
+    usados = {
+        codigo
+        for (codigo,) in db.session.query(Cotizacion.codigo_cotizacion).filter(
+            Cotizacion.codigo_cotizacion.in_(codigos)
+        )
+    }
+    listos = []
+    for i, data, productos_input in pedidos:
+        codigo = data["codigo_cotizacion"]
+        if codigo in usados:
+            resultados[i] = {
+                "indice": i,
+                "estado": "error",
+                "error": f"El código de cotización '{codigo}' ya existe",
+            }
+            continue
+        usados.add(codigo)
+        # Un error en una entrada solo rechaza esa entrada, no el lote
+        try:
+            productos_final, error = _resolver_productos(
+                empresa, productos_input, productos_db
+            )
+            if not error:
+                _preparar_cotizacion(empresa, data, productos_final, codigo)
+        except (AttributeError, TypeError, ValueError) as e:
+            error = f"Datos inválidos: {e}"
+        if error:
+            resultados[i] = {"indice": i, "estado": "error", "error": error}
+            continue
+        listos.append((i, data))
+
+    pdfs = renderizar_lote([data for _, data in listos])
+    creadas = []
+    try:
+        for (i, data), pdf in zip(listos, pdfs):
+            if isinstance(pdf, Exception):
+                resultados[i] = {
+                    "indice": i,
+                    "estado": "error",
+                    "error": f"Error generando PDF: {pdf}",
+                }
+                continue
+            cotizacion = _nueva_cotizacion(empresa, data, "Pendiente")
+            guardar_pdf(cotizacion, *pdf)
+            creadas.append((i, cotizacion))
+        # Un INSERT de varias filas por tabla al hacer flush
+        db.session.add_all(c for _, c in creadas)
+        for _, c in creadas:
+            nuevo_correo(c)
+        db.session.flush()
+        for i, c in creadas:
+            resultados[i] = {
+                "indice": i,
+                "estado": "creada",
+                "cotizacion_id": c.id,
+                "codigo_cotizacion": c.codigo_cotizacion,
+                "total": c.total,
+                "estado_envio": "Pendiente",
+            }
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return (
+            jsonify({"error": "Error guardando cotizaciones", "detail": str(e)}),
+            500,
+        )
+    despertar()
+    return (
+        jsonify(
+            {
+                "mensaje": "Lote procesado",
+                "creadas": len(creadas),
+                "con_errores": len(entradas) - len(creadas),
+                "resultados": resultados,
+            }
+        ),
         200,
     )
 
@@ -439,8 +733,21 @@ def crear_cotizacion(empresa):
 @cotizacion_bp.route("/cotizacion", methods=["GET"])
 @token_required
 def listar_cotizaciones(empresa):
-    cotizaciones = Cotizacion.query.filter_by(empresa_id=empresa.id).all()
-    return jsonify(
+    # Las líneas llegan en la misma consulta (JOIN con cotizacion_items)
+    query = Cotizacion.query.options(db.joinedload(Cotizacion.items)).filter_by(
+        empresa_id=empresa.id
+    )
+    for filtro in ("estado_envio", "estado_cotizacion"):
+        if request.args.get(filtro):
+            query = query.filter_by(**{filtro: request.args[filtro]})
+    orden = Cotizacion.fecha if request.args.get("orden") == "fecha" else None
+    cotizaciones, siguiente = paginar(
+        query,
+        Cotizacion.id,
+        orden=orden,
+        descendente=request.args.get("direccion") == "desc",
+    )
+    return respuesta_paginada(
         [
             {
                 "id": c.id,
@@ -466,10 +773,12 @@ def listar_cotizaciones(empresa):
                 "total": c.total,
                 "condiciones": c.condiciones,
                 "estado_envio": c.estado_envio,
-                "archivo_pdf": True if c.archivo_pdf else False,
+                "archivo_pdf": bool(c.pdf_tamano),
+                "pdf_tamano": c.pdf_tamano,
             }
             for c in cotizaciones
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -477,7 +786,11 @@ def listar_cotizaciones(empresa):
 @cotizacion_bp.route("/cotizacion/<int:cotizacion_id>", methods=["GET"])
 @token_required
 def obtener_cotizacion(empresa, cotizacion_id):
-    c = Cotizacion.query.filter_by(id=cotizacion_id, empresa_id=empresa.id).first()
+    c = (
+        Cotizacion.query.options(db.joinedload(Cotizacion.items))
+        .filter_by(id=cotizacion_id, empresa_id=empresa.id)
+        .first()
+    )
     if not c:
         return jsonify({"error": "Cotización no encontrada"}), 404
     return jsonify(
@@ -508,6 +821,74 @@ def obtener_cotizacion(empresa, cotizacion_id):
     )
 
 
+# Descargar el PDF de una cotización (soporta If-None-Match y Range)
+@cotizacion_bp.route("/cotizacion/<int:cotizacion_id>/pdf", methods=["GET"])
+@token_required
+def descargar_pdf_cotizacion(empresa, cotizacion_id):
+    c = Cotizacion.query.filter_by(id=cotizacion_id, empresa_id=empresa.id).first()
+    if not c:
+        return jsonify({"error": "Cotización no encontrada"}), 404
+    # El hash del contenido sirve de ETag fuerte; si el cliente ya lo tiene
+    # se responde 304 sin leer el PDF del almacenamiento
+    etag = c.pdf_ref
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    pdf_bytes = obtener_pdf(c)
+    if not pdf_bytes:
+        return jsonify({"error": "La cotización aún no tiene PDF"}), 404
+    if not etag:
+        etag = hash_pdf(pdf_bytes)
+    # send_file entrega el contenido en bloques y resuelve Range y 304
+    return send_file(
+        io.BytesIO(pdf_bytes),
+        mimetype="application/pdf",
+        download_name=f"cotizacion_{c.codigo_cotizacion}.pdf",
+        conditional=True,
+        etag=etag,
+        max_age=0,
+    )
+
+
+# Reenviar el PDF guardado de una cotización a través de la bandeja de salida
+@cotizacion_bp.route("/cotizacion/<int:cotizacion_id>/reenviar", methods=["POST"])
+@token_required
+def reenviar_cotizacion(empresa, cotizacion_id):
+    c = Cotizacion.query.filter_by(id=cotizacion_id, empresa_id=empresa.id).first()
+    if not c:
+        return jsonify({"error": "Cotización no encontrada"}), 404
+    if not c.pdf_ref and not c.archivo_pdf:
+        return jsonify({"error": "La cotización aún no tiene PDF"}), 409
+    if not empresa.gmail_access_token:
+        return (
+            jsonify(
+                {
+                    "error": "La empresa debe autorizar el envío de correos con Gmail (OAuth2) antes de poder enviar cotizaciones."
+                }
+            ),
+            400,
+        )
+    # Si ya hay un envío en cola no se duplica
+    correo = correo_activo(c.id)
+    if not correo:
+        correo = nuevo_correo(c)
+        c.estado_envio = "Pendiente"
+        db.session.commit()
+    despertar()
+    return (
+        jsonify(
+            {
+                "mensaje": "Reenvío en cola",
+                "correo_id": correo.id,
+                "estado": correo.estado,
+                "intentos": correo.intentos,
+            }
+        ),
+        202,
+    )
+
+
 # Eliminar cotización (solo si pertenece a la empresa)
 @cotizacion_bp.route("/cotizacion/<int:cotizacion_id>", methods=["DELETE"])
 @token_required
@@ -515,7 +896,11 @@ def eliminar_cotizacion(empresa, cotizacion_id):
     c = Cotizacion.query.filter_by(id=cotizacion_id, empresa_id=empresa.id).first()
     if not c:
         return jsonify({"error": "Cotización no encontrada"}), 404
+    pdf_ref = c.pdf_ref
     db.session.delete(c)
+    db.session.flush()
+    # Los PDFs se comparten por contenido; solo se borra si nadie más lo usa
+    liberar_pdf(pdf_ref)
     db.session.commit()
     return jsonify({"mensaje": "Cotización eliminada"}), 200
 
@@ -530,59 +915,32 @@ def actualizar_cotizacion(empresa, cotizacion_id):
     data = request.json or {}
     # Si se actualizan productos, validar que existan y pertenezcan a la empresa
     if "productos" in data:
-        import json
-
-        productos_input = data["productos"]
-        if isinstance(productos_input, str):
-            try:
-                productos_input = json.loads(productos_input)
-            except Exception:
-                return (
-                    jsonify({"error": "El campo 'productos' no es un JSON válido"}),
-                    400,
-                )
-        if not isinstance(productos_input, list) or not productos_input:
-            return jsonify({"error": "Debe enviar al menos un producto válido"}), 400
-        productos_db = {
-            p.id: p for p in Producto.query.filter_by(empresa_id=empresa.id).all()
-        }
-        productos_final = []
-        for p in productos_input:
-            prod_id = p.get("id")
-            cantidad = p.get("cantidad", 1)
-            if not prod_id or prod_id not in productos_db:
-                return (
-                    jsonify(
-                        {
-                            "error": f"Producto con id {prod_id} no existe o no pertenece a la empresa"
-                        }
-                    ),
-                    400,
-                )
-            prod_db = productos_db[prod_id]
-            productos_final.append(
-                {
-                    "id": prod_db.id,
-                    "nombre": prod_db.nombre,
-                    "descripcion": prod_db.descripcion,
-                    "precio": prod_db.precio,
-                    "unidad": prod_db.unidad,
-                    "codigo": prod_db.codigo,
-                    "cantidad": cantidad,
-                }
+        productos_input, error = _leer_productos(data["productos"])
+        if error:
+            return jsonify({"error": error}), 400
+        productos_final, error = _resolver_productos(empresa, productos_input)
+        if error:
+            return jsonify({"error": error}), 400
+    elif "descuento" in data or "iva" in data:
+        productos_final = c.productos
+    precios = None
+    if "productos" in data or "descuento" in data or "iva" in data:
+        # Recalcular subtotal y total con las líneas nuevas o las guardadas
+        try:
+            precios = liquidar(
+                productos_final,
+                data.get("descuento", c.descuento or 0),
+                data.get("iva", c.iva or 0),
             )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Datos inválidos: {e}"}), 400
+        for campo in ("subtotal", "descuento", "iva", "total"):
+            setattr(c, campo, precios[campo])
+    if "productos" in data:
+        # Reemplaza las líneas con un DELETE y un INSERT de varias filas
+        ItemCotizacion.query.filter_by(cotizacion_id=c.id).delete()
+        db.session.expire(c, ["items"])
         c.productos = productos_final
-        # Recalcular subtotal, total, etc. si se actualizan productos
-        subtotal = sum(p["cantidad"] * p["precio"] for p in productos_final)
-        c.subtotal = subtotal
-        descuento = float(data.get("descuento", c.descuento or 0))
-        iva = float(data.get("iva", c.iva or 0))
-        total = subtotal - descuento
-        if iva > 0:
-            total += total * (iva / 100)
-        c.descuento = descuento
-        c.iva = iva
-        c.total = total
     # Actualizar otros campos
     for field in [
         "cliente",
@@ -603,8 +961,61 @@ def actualizar_cotizacion(empresa, cotizacion_id):
     ]:
         if field in data:
             setattr(c, field, data[field])
+    try:
+        regenerado = _regenerar_pdf(c, precios, not CAMPOS_PDF.isdisjoint(data))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Error generando PDF", "detail": str(e)}), 500
     db.session.commit()
-    return jsonify({"mensaje": "Cotización actualizada"}), 200
+    return (
+        jsonify({"mensaje": "Cotización actualizada", "pdf_regenerado": regenerado}),
+        200,
+    )
+
+
+def _regenerar_pdf(c, precios=None, dibujados=True):
+    """
+    Vuelve a generar el PDF solo si cambió algo de lo que se dibuja en él
+    (la huella de la entrada); devuelve si hubo que guardar uno nuevo.
+    `precios` es la liquidación ya hecha en este request, si la hubo, y
+    `dibujados` indica si el request trae campos que salen en el PDF.
+    """
+    if c.pdf_entrada is None and not dibujados and _tiene_pdf(c):
+        # PDF anterior a la huella: sin campos dibujados en el request se da
+        # por vigente, para no reemplazar el que ya recibió el cliente
+        return False
+    if precios is None and None in (c.subtotal, c.descuento, c.iva, c.total):
+        # Filas antiguas sin totales guardados: se liquidan antes de dibujar
+        precios = liquidar(c.productos, c.descuento or 0, c.iva or 0)
+        for campo in ("subtotal", "descuento", "iva", "total"):
+            setattr(c, campo, precios[campo])
+    data = datos_pdf(c)
+    huella = huella_pdf(data)
+    if huella == c.pdf_entrada:
+        return False
+    if precios:
+        data["totales_lineas"] = precios["lineas"]
+        data["iva_lineas"] = precios["iva_lineas"]
+    pdf_bytes, _ = renderizar(data, huella)
+    anterior = c.pdf_ref
+    guardar_pdf(c, pdf_bytes, huella)
+    if anterior != c.pdf_ref:
+        db.session.flush()
+        liberar_pdf(anterior)
+    return True
+
+
+def _tiene_pdf(c):
+    """Si la cotización ya tiene un PDF, en el almacén o en la columna antigua."""
+    if c.pdf_ref:
+        return True
+    # archivo_pdf es diferida: se consulta sin traer el blob a memoria
+    return (
+        db.session.query(Cotizacion.id)
+        .filter(Cotizacion.id == c.id, Cotizacion.archivo_pdf.isnot(None))
+        .first()
+        is not None
+    )
 
 
 # --- Endpoint de logout (cierre de sesión) ---
@@ -612,16 +1023,19 @@ def actualizar_cotizacion(empresa, cotizacion_id):
 @token_required
 def logout(empresa):
     # Elimina el token activo de la empresa
+    token_anterior = empresa.token_activo
     empresa.token_activo = None
     db.session.commit()
+    invalidar_sesion(token_anterior)
     return jsonify({"mensaje": "Sesión cerrada."}), 200
 
+
 # --- ADMIN: Listar empresas (solo datos generales) ---
 @cotizacion_bp.route("/admin/empresas", methods=["GET"])
 @admin_required
 def admin_listar_empresas():
-    empresas = Empresa.query.all()
-    return jsonify(
+    empresas, siguiente = paginar(Empresa.query, Empresa.id)
+    return respuesta_paginada(
         [
             {
                 "id": e.id,
@@ -633,7 +1047,8 @@ def admin_listar_empresas():
                 "gmail_autorizado": bool(e.gmail_access_token),
             }
             for e in empresas
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -659,8 +1074,20 @@ def admin_estadisticas():
 @cotizacion_bp.route("/admin/codigos-invitacion", methods=["GET"])
 @admin_required
 def admin_listar_codigos():
-    codigos = CodigoInvitacion.query.order_by(CodigoInvitacion.creado.desc()).all()
-    return jsonify(
+    query = CodigoInvitacion.query
+    if request.args.get("usado") is not None:
+        usado = 1 if request.args["usado"] in ("1", "true") else 0
+        query = query.filter_by(usado=usado)
+    if request.args.get("vencido") is not None:
+        ahora = datetime.utcnow()
+        if request.args["vencido"] in ("1", "true"):
+            query = query.filter(CodigoInvitacion.vence < ahora)
+        else:
+            query = query.filter(CodigoInvitacion.vence >= ahora)
+    codigos, siguiente = paginar(
+        query, CodigoInvitacion.id, orden=CodigoInvitacion.creado, descendente=True
+    )
+    return respuesta_paginada(
         [
             {
                 "id": c.id,
@@ -670,7 +1097,8 @@ def admin_listar_codigos():
                 "usado": c.usado,
             }
             for c in codigos
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -739,8 +1167,13 @@ def enviar_soporte(empresa):
 @cotizacion_bp.route("/admin/soporte", methods=["GET"])
 @admin_required
 def admin_listar_soporte():
-    solicitudes = Soporte.query.order_by(Soporte.fecha.desc()).all()
-    return jsonify(
+    query = Soporte.query
+    if request.args.get("estado"):
+        query = query.filter_by(estado=request.args["estado"])
+    solicitudes, siguiente = paginar(
+        query, Soporte.id, orden=Soporte.fecha, descendente=True
+    )
+    return respuesta_paginada(
         [
             {
                 "id": s.id,
@@ -755,7 +1188,8 @@ def admin_listar_soporte():
                 ),
             }
             for s in solicitudes
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -777,32 +1211,11 @@ def admin_responder_soporte(soporte_id):
 
 @cotizacion_bp.route("/empresas", methods=["GET"])
 def listar_empresas():
-    from models import Empresa
-    import os
-    from flask import request, jsonify, current_app
-    import jwt
-
-    # Verificar token de admin
-    token = None
-    if "Authorization" in request.headers:
-        auth_header = request.headers["Authorization"]
-        if auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-    if not token:
-        return jsonify({"error": "Token requerido"}), 401
-    try:
-        data = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
-        if not data.get("admin"):
-            return (
-                jsonify(
-                    {"error": "Solo el administrador puede ver todas las empresas"}
-                ),
-                403,
-            )
-    except Exception as e:
-        return jsonify({"error": "Token inválido", "detail": str(e)}), 401
-    empresas = Empresa.query.all()
-    return jsonify(
+    error = _validar_admin("Solo el administrador puede ver todas las empresas")
+    if error:
+        return error
+    empresas, siguiente = paginar(Empresa.query, Empresa.id)
+    return respuesta_paginada(
         [
             {
                 "id": e.id,
@@ -815,7 +1228,8 @@ def listar_empresas():
                 "logo_url": e.logo_url,
             }
             for e in empresas
-        ]
+        ],
+        siguiente,
     )
 
 
@@ -828,8 +1242,8 @@ def oauth2_authorize():
     )
     if token and token.startswith("Bearer "):
         token = token.split(" ")[1]
-    flow = Flow.from_client_secrets_file(
-        "client_secret.json",
+    flow = Flow.from_client_config(
+        config_cliente(),
         scopes=["https://www.googleapis.com/auth/gmail.send"],
         redirect_uri=url_for("cotizacion.oauth2_callback", _external=True),
     )
@@ -844,8 +1258,8 @@ def oauth2_authorize():
 
 @cotizacion_bp.route("/oauth2/callback")
 def oauth2_callback():
-    flow = Flow.from_client_secrets_file(
-        "client_secret.json",
+    flow = Flow.from_client_config(
+        config_cliente(),
         scopes=["https://www.googleapis.com/auth/gmail.send"],
         redirect_uri=url_for("cotizacion.oauth2_callback", _external=True),
     )
@@ -884,6 +1298,8 @@ def oauth2_callback():
             f"No se recibió refresh_token para empresa {empresa.id}. Token actual: {empresa.gmail_refresh_token[:20] if empresa.gmail_refresh_token else 'None'}..."
         )
     db.session.commit()
+    # Los clientes en el pool tienen las credenciales anteriores
+    vaciar_pool(empresa.id)
     # Redirigir automáticamente al frontend después de autorizar
     frontend_url = request.args.get("frontend_url", "http://localhost:3001")
     return redirect(f"{frontend_url}/dashboard/configuracion?oauth=ok")
@@ -897,14 +1313,11 @@ def enviar_email_gmail_oauth2(
     cuerpo,
     archivo_pdf=None,
     refresh_token=None,
+    empresa_id=None,
 ):
     from email.mime.multipart import MIMEMultipart
     from email.mime.application import MIMEApplication
 
-    # Leer client_id, client_secret, token_uri del client_secret.json
-    with open("client_secret.json") as f:
-        secrets = _json.load(f)["web"]
-
     print(
         f"Enviando correo - Access token: {access_token[:20] if access_token else 'None'}..."
     )
@@ -912,15 +1325,6 @@ def enviar_email_gmail_oauth2(
         f"Enviando correo - Refresh token: {refresh_token[:20] if refresh_token else 'None'}..."
     )
 
-    creds = Credentials(
-        token=access_token,
-        refresh_token=refresh_token,
-        token_uri=secrets["token_uri"],
-        client_id=secrets["client_id"],
-        client_secret=secrets["client_secret"],
-    )
-    service = build("gmail", "v1", credentials=creds)
-
     # Crear mensaje multipart para poder adjuntar archivos
     message = MIMEMultipart()
     message["to"] = destinatario
@@ -940,9 +1344,10 @@ def enviar_email_gmail_oauth2(
         print("PDF adjuntado al correo")
 
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    message_body = {"raw": raw}
     try:
-        service.users().messages().send(userId="me", body=message_body).execute()
+        # Cliente reutilizado de la empresa; guarda el token si Google lo renueva
+        with cliente_gmail(access_token, refresh_token, empresa_id) as cliente:
+            cliente.enviar(raw)
         print("Correo enviado exitosamente")
         return True
     except Exception as e:
@@ -1001,21 +1406,26 @@ def debug_oauth_tokens(empresa):
 @token_required
 def cargar_productos_masiva(empresa):
     """
-    Endpoint para cargar productos de manera masiva desde un archivo Excel.
+    Endpoint para cargar productos de manera masiva desde un archivo Excel o CSV.
 
-    Formato esperado del Excel:
+    Formato esperado del archivo:
     - nombre (obligatorio): Nombre del producto
     - descripcion (opcional): Descripción del producto
     - precio (obligatorio): Precio del producto (número)
     - unidad (opcional): Unidad de medida (ej: unidad, kg, metro)
     - codigo (opcional): Código del producto
 
-    El archivo debe ser un .xlsx o .xls
-    """
-    import pandas as pd
-    from werkzeug.utils import secure_filename
-    import io
+    El archivo debe ser un .xlsx, .xls o .csv (UTF-8, separado por comas). Se
+    procesa por lotes que se guardan uno a uno; "lotes" resume cada lote.
 
+    Con modo=upsert (form o query string) las filas cuyo código ya existe
+    actualizan precio, descripción y unidad en vez de rechazarse, y la carga
+    completa se guarda en una sola transacción.
+
+    Con ?asincrono=1 (o IMPORTACION_ASINCRONA=1) el archivo se guarda y se
+    responde 202 con un trabajo_id; el avance se consulta en
+    GET /producto/carga-masiva/<trabajo_id>.
+    """
     if "archivo" not in request.files:
         return jsonify({"error": "No se envió ningún archivo"}), 400
 
@@ -1025,24 +1435,30 @@ def cargar_productos_masiva(empresa):
         return jsonify({"error": "No se seleccionó ningún archivo"}), 400
 
     # Validar extensión del archivo
-    extensiones_validas = ["xlsx", "xls"]
     extension = (
         archivo.filename.rsplit(".", 1)[1].lower() if "." in archivo.filename else ""
     )
 
-    if extension not in extensiones_validas:
-        return jsonify({"error": "Solo se permiten archivos Excel (.xlsx o .xls)"}), 400
+    if extension not in EXTENSIONES:
+        return (
+            jsonify({"error": "Solo se permiten archivos Excel (.xlsx o .xls) o CSV"}),
+            400,
+        )
+
+    modo = request.form.get("modo") or request.args.get("modo") or "insertar"
+    if modo not in MODOS:
+        return jsonify({"error": f"Modo inválido; use {' o '.join(MODOS)}"}), 400
 
     try:
-        # Leer el archivo Excel
-        df = pd.read_excel(
-            archivo.stream, engine="openpyxl" if extension == "xlsx" else "xlrd"
-        )
+        columnas, lotes = abrir_archivo(archivo.stream, extension)
+    except Exception as e:
+        return jsonify({"error": f"Error procesando archivo: {str(e)}"}), 400
 
+    # El libro de openpyxl se cierra también si no se llegan a leer los lotes
+    with closing(lotes):
         # Validar columnas obligatorias
-        columnas_obligatorias = ["nombre", "precio"]
         columnas_faltantes = [
-            col for col in columnas_obligatorias if col not in df.columns
+            col for col in COLUMNAS_OBLIGATORIAS if col not in columnas
         ]
 
         if columnas_faltantes:
@@ -1050,193 +1466,137 @@ def cargar_productos_masiva(empresa):
                 jsonify(
                     {
                         "error": f"Faltan columnas obligatorias: {', '.join(columnas_faltantes)}",
-                        "columnas_requeridas": ["nombre", "precio"],
-                        "columnas_opcionales": ["descripcion", "unidad", "codigo"],
+                        "columnas_requeridas": COLUMNAS_OBLIGATORIAS,
+                        "columnas_opcionales": COLUMNAS_OPCIONALES,
                     }
                 ),
                 400,
             )
 
-        # Procesar los datos
-        productos_creados = []
-        productos_errores = []
+        if modo == "upsert" and "codigo" not in columnas:
+            return jsonify({"error": "El modo upsert requiere la columna codigo"}), 400
 
-        for index, row in df.iterrows():
-            try:
-                # Validar campos obligatorios
-                nombre = str(row["nombre"]).strip()
-                precio = row["precio"]
-
-                if not nombre or nombre.lower() == "nan":
-                    productos_errores.append(
-                        {
-                            "fila": index
-                            + 2,  # +2 porque índice empieza en 0 y hay header
-                            "error": "El nombre es obligatorio",
-                        }
-                    )
-                    continue
-
-                # Validar precio
-                try:
-                    precio = float(precio)
-                    if precio < 0:
-                        productos_errores.append(
-                            {
-                                "fila": index + 2,
-                                "error": "El precio debe ser mayor o igual a 0",
-                            }
-                        )
-                        continue
-                except (ValueError, TypeError):
-                    productos_errores.append(
-                        {
-                            "fila": index + 2,
-                            "error": "El precio debe ser un número válido",
-                        }
-                    )
-                    continue
-
-                # Campos opcionales
-                descripcion = str(row.get("descripcion", "")).strip()
-                if descripcion.lower() == "nan":
-                    descripcion = ""
-
-                unidad = str(row.get("unidad", "unidad")).strip()
-                if unidad.lower() == "nan":
-                    unidad = "unidad"
-
-                codigo = str(row.get("codigo", "")).strip()
-                if codigo.lower() == "nan":
-                    codigo = ""
-
-                # Verificar si ya existe un producto con el mismo nombre o código
-                producto_existente = None
-                if codigo:
-                    producto_existente = Producto.query.filter_by(
-                        codigo=codigo, empresa_id=empresa.id
-                    ).first()
-
-                if not producto_existente:
-                    producto_existente = Producto.query.filter_by(
-                        nombre=nombre, empresa_id=empresa.id
-                    ).first()
-
-                if producto_existente:
-                    productos_errores.append(
-                        {
-                            "fila": index + 2,
-                            "error": f"Ya existe un producto con el nombre '{nombre}'"
-                            + (f" o código '{codigo}'" if codigo else ""),
-                        }
-                    )
-                    continue
-
-                # Crear el producto
-                producto = Producto(
-                    nombre=nombre,
-                    descripcion=descripcion,
-                    precio=precio,
-                    unidad=unidad,
-                    codigo=codigo,
-                    empresa_id=empresa.id,
-                )
-
-                db.session.add(producto)
-                productos_creados.append(
+        if _modo_asincrono("IMPORTACION_ASINCRONA"):
+            return _encolar_importacion(empresa, archivo, extension, modo)
+
+        try:
+            return jsonify(importar(empresa.id, lotes, modo)), 200
+        except Exception as e:
+            # En modo insertar los lotes anteriores al error ya quedaron guardados
+            resumen = getattr(e, "resumen", {})
+            return (
+                jsonify(
                     {
-                        "fila": index + 2,
-                        "nombre": nombre,
-                        "precio": precio,
-                        "unidad": unidad,
-                        "codigo": codigo or None,
+                        "error": f"Error procesando archivo: {str(e)}",
+                        "productos_creados": resumen.get("productos_creados", 0),
+                        "filas_procesadas": resumen.get("filas_procesadas", 0),
                     }
-                )
-
-            except Exception as e:
-                productos_errores.append(
-                    {"fila": index + 2, "error": f"Error procesando fila: {str(e)}"}
-                )
-
-        # Guardar los productos válidos
-        if productos_creados:
-            db.session.commit()
+                ),
+                500,
+            )
 
-        return (
-            jsonify(
-                {
-                    "mensaje": f"Procesamiento completado",
-                    "productos_creados": len(productos_creados),
-                    "productos_con_errores": len(productos_errores),
-                    "detalles_creados": productos_creados,
-                    "errores": productos_errores,
-                }
-            ),
-            200,
-        )
 
+def _encolar_importacion(empresa, archivo, extension, modo):
+    """Guarda el archivo como TrabajoImportacion y delega la carga a los workers."""
+    archivo.stream.seek(0)
+    trabajo = TrabajoImportacion(
+        empresa_id=empresa.id,
+        modo=modo,
+        nombre_archivo=archivo.filename[:255],
+        extension=extension,
+        archivo=archivo.stream.read(),
+    )
+    try:
+        db.session.add(trabajo)
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
-        return jsonify({"error": f"Error procesando archivo: {str(e)}"}), 500
+        return jsonify({"error": "Error guardando archivo", "detail": str(e)}), 500
+    encolar_importacion(current_app._get_current_object(), trabajo.id)
+    return (
+        jsonify(
+            {
+                "mensaje": "Carga masiva en proceso",
+                "trabajo_id": trabajo.id,
+                "estado": "pendiente",
+            }
+        ),
+        202,
+    )
 
 
-@cotizacion_bp.route("/producto/plantilla-excel", methods=["GET"])
+# Consultar el progreso de una carga masiva en segundo plano
+@cotizacion_bp.route("/producto/carga-masiva/<int:trabajo_id>", methods=["GET"])
 @token_required
-def descargar_plantilla_excel(empresa):
-    """
-    Genera y descarga una plantilla de Excel con el formato correcto para carga masiva.
-    """
-    import pandas as pd
-    from flask import Response
-    import io
-
-    # Crear DataFrame con ejemplo
-    datos_ejemplo = {
-        "nombre": ["Producto Ejemplo 1", "Producto Ejemplo 2", "Producto Ejemplo 3"],
-        "descripcion": [
-            "Descripción del producto 1",
-            "Descripción del producto 2",
-            "Descripción del producto 3",
-        ],
-        "precio": [100000, 250000, 75000],
-        "unidad": ["unidad", "kg", "metro"],
-        "codigo": ["PROD001", "PROD002", "PROD003"],
+def estado_carga_masiva(empresa, trabajo_id):
+    t = TrabajoImportacion.query.filter_by(id=trabajo_id, empresa_id=empresa.id).first()
+    if not t:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    respuesta = {
+        "id": t.id,
+        "estado": t.estado,
+        "modo": t.modo,
+        "archivo": t.nombre_archivo,
+        "filas_procesadas": t.filas_procesadas,
+        "productos_creados": t.productos_creados,
+        "productos_actualizados": t.productos_actualizados,
+        "productos_con_errores": t.productos_con_errores,
+        "errores": t.errores,
+        "error": t.error,
+        "creado": t.creado.isoformat() if t.creado else None,
+        "actualizado": t.actualizado.isoformat() if t.actualizado else None,
     }
+    if t.estado == "completado":
+        # La misma respuesta que da la carga síncrona
+        respuesta["resultado"] = t.resumen
+    return jsonify(respuesta)
 
-    df = pd.DataFrame(datos_ejemplo)
 
-    # Crear archivo Excel en memoria
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="Productos", index=False)
-
-        # Acceder al workbook y worksheet para personalizar
-        workbook = writer.book
-        worksheet = writer.sheets["Productos"]
+@cotizacion_bp.route("/producto/exportar", methods=["GET"])
+@token_required
+def exportar_productos(empresa):
+    """
+    Descarga el catálogo de la empresa en el formato de la carga masiva
+    (?formato=xlsx, por defecto, o csv). Las filas se envían a medida que se
+    leen de la base de datos.
+    """
+    formato = request.args.get("formato", "xlsx").lower()
+    if formato not in FORMATOS:
+        return jsonify({"error": f"Formato inválido; use {' o '.join(FORMATOS)}"}), 400
 
-        # Ajustar ancho de columnas
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
+    if formato == "csv":
+        contenido = csv_catalogo(empresa.id)
+        mimetype = "text/csv"
+    else:
+        contenido = xlsx_catalogo(empresa.id)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return Response(
+        stream_with_context(contenido),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=productos.{formato}"},
+    )
 
-    output.seek(0)
 
-    return Response(
-        output.getvalue(),
+@cotizacion_bp.route("/producto/plantilla-excel", methods=["GET"])
+@token_required
+def descargar_plantilla_excel(empresa):
+    """
+    Descarga la plantilla de Excel con el formato correcto para carga masiva.
+    Es igual para todos: se genera una vez y se sirve desde memoria con ETag.
+    """
+    datos, etag = plantilla_excel()
+    # send_file responde 304 si el cliente ya tiene esta versión (If-None-Match)
+    return send_file(
+        io.BytesIO(datos),
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": "attachment; filename=plantilla_productos.xlsx"
-        },
+        as_attachment=True,
+        download_name="plantilla_productos.xlsx",
+        conditional=True,
+        etag=etag,
+        max_age=PLANTILLA_MAX_AGE,
     )
-    
+
+
 @cotizacion_bp.route("/", methods=["GET"])
 def index():
     return jsonify({"mensaje": "Bienvenido a la API de Quote Hub"}), 200
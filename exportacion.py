@@ -0,0 +1,248 @@
+"""
+Exportación del catálogo de productos de una empresa.
+
+Los productos se leen con yield_per (cursor del lado del servidor en
+PostgreSQL) y se envían a medida que llegan, así que ni la memoria ni el
+tiempo hasta el primer byte dependen del tamaño del catálogo. El CSV es texto
+plano; el XLSX se escribe a mano (sin openpyxl) como un zip en flujo: las
+partes fijas van primero y la hoja se comprime fila por fila, con un data
+descriptor por entrada en vez de volver atrás a escribir los tamaños. Las
+columnas son las de la carga masiva: el archivo exportado se
+puede volver a importar tal cual (también con modo=upsert para corregir
+precios).
+
+La plantilla de la carga masiva se genera una sola vez por variante y se
+sirve desde memoria; sus bytes no dependen de la hora en que se generó, así
+que el ETag es el mismo en todos los workers.
+"""
+
+import csv
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from database import db
+from models import Producto
+
+# Filas que se piden a la base de datos por viaje
+EXPORTACION_LOTE = int(os.getenv("EXPORTACION_LOTE", 1000))
+# Segundos que el navegador puede usar la plantilla sin revalidarla
+PLANTILLA_MAX_AGE = int(os.getenv("PLANTILLA_MAX_AGE", 3600))
+FORMATOS = ["xlsx", "csv"]
+COLUMNAS = ["nombre", "descripcion", "precio", "unidad", "codigo"]
+ANCHOS = {"A": 40, "B": 50, "C": 14, "D": 12, "E": 18}
+_BLOQUE = 64 * 1024
+
+# Filas de ejemplo de la plantilla por variante (idioma o empresa)
+EJEMPLOS = {
+    "es": [
+        [
+            "Producto Ejemplo 1",
+            "Descripción del producto 1",
+            100000,
+            "unidad",
+            "PROD001",
+        ],
+        ["Producto Ejemplo 2", "Descripción del producto 2", 250000, "kg", "PROD002"],
+        ["Producto Ejemplo 3", "Descripción del producto 3", 75000, "metro", "PROD003"],
+    ]
+}
+_FECHA_FIJA = datetime(2024, 1, 1)
+_plantillas = {}  # variante -> (bytes, etag)
+_lock = threading.Lock()
+
+
+def filas_catalogo(empresa_id):
+    """Tuplas (nombre, descripcion, precio, unidad, codigo) en orden de id."""
+    consulta = (
+        db.select(*(getattr(Producto, c) for c in COLUMNAS))
+        .where(Producto.empresa_id == empresa_id)
+        .order_by(Producto.id)
+        .execution_options(yield_per=EXPORTACION_LOTE)
+    )
+    yield from db.session.execute(consulta)
+
+
+def csv_catalogo(empresa_id):
+    """Genera el CSV (UTF-8 con BOM, para Excel) en bloques de bytes."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write("\ufeff")
+    escritor.writerow(COLUMNAS)
+    for fila in filas_catalogo(empresa_id):
+        escritor.writerow(fila)
+        if buffer.tell() >= _BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG = "http://schemas.openxmlformats.org/package/2006"
+# Partes fijas de un libro con una sola hoja y sin estilos propios
+_PARTES_XLSX = {
+    "[Content_Types].xml": f'<Types xmlns="{_PKG}/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "</Types>",
+    "_rels/.rels": f'<Relationships xmlns="{_PKG}/relationships">'
+    f'<Relationship Id="rId1" Type="{_REL}/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>',
+    "xl/workbook.xml": f'<workbook xmlns="{_NS}" xmlns:r="{_REL}"><sheets>'
+    '<sheet name="Productos" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    "xl/_rels/workbook.xml.rels": f'<Relationships xmlns="{_PKG}/relationships">'
+    f'<Relationship Id="rId1" Type="{_REL}/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{_REL}/styles" Target="styles.xml"/>'
+    "</Relationships>",
+    "xl/styles.xml": f'<styleSheet xmlns="{_NS}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/>'
+    "</border></borders>"
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+    'borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" '
+    'xfId="0"/></cellXfs><cellStyles count="1"><cellStyle name="Normal" '
+    'xfId="0" builtinId="0"/></cellStyles></styleSheet>',
+}
+# Caracteres de control que XML no admite (openpyxl los rechaza)
+_NO_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Salida:
+    """Destino sin seek para zipfile: guarda lo escrito hasta que se retira."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b"".join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def _celda(letra, fila, valor):
+    if valor is None or valor == "":
+        return ""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c r="{letra}{fila}"><v>{valor!r}</v></c>'
+    texto = escape(_NO_XML.sub("", str(valor)))
+    return (
+        f'<c r="{letra}{fila}" t="inlineStr">'
+        f'<is><t xml:space="preserve">{texto}</t></is></c>'
+    )
+
+
+def _fila(numero, valores):
+    celdas = "".join(
+        _celda(letra, numero, valor) for letra, valor in zip(ANCHOS, valores)
+    )
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+def xlsx_catalogo(empresa_id):
+    """Genera el .xlsx del catálogo en bloques de bytes, fila por fila."""
+    salida = _Salida()
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _PARTES_XLSX.items():
+            libro.writestr(nombre, _XML + contenido)
+        columnas = "".join(
+            f'<col min="{i}" max="{i}" width="{ancho}" customWidth="1"/>'
+            for i, ancho in enumerate(ANCHOS.values(), 1)
+        )
+        with libro.open("xl/worksheets/sheet1.xml", "w") as hoja:
+            hoja.write(
+                f'{_XML}<worksheet xmlns="{_NS}"><cols>{columnas}</cols>'
+                f"<sheetData>{_fila(1, COLUMNAS)}".encode("utf-8")
+            )
+            yield salida.retirar()
+            pendiente = []
+            for numero, fila in enumerate(filas_catalogo(empresa_id), 2):
+                pendiente.append(_fila(numero, fila))
+                if len(pendiente) >= EXPORTACION_LOTE:
+                    hoja.write("".join(pendiente).encode("utf-8"))
+                    pendiente.clear()
+                    yield salida.retirar()
+            hoja.write(
+                ("".join(pendiente) + "</sheetData></worksheet>").encode("utf-8")
+            )
+    yield salida.retirar()
+
+
+def _sin_fechas(datos):
+    # openpyxl guarda la hora actual en cada entrada del zip y en la fecha de
+    # modificación del documento: se fijan para que la misma plantilla
+    # produzca siempre los mismos bytes
+    fecha = _FECHA_FIJA.strftime("%Y-%m-%dT%H:%M:%SZ").encode()
+    salida = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(datos)) as origen, zipfile.ZipFile(
+        salida, "w", zipfile.ZIP_DEFLATED
+    ) as destino:
+        for entrada in origen.infolist():
+            info = zipfile.ZipInfo(entrada.filename, _FECHA_FIJA.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            contenido = origen.read(entrada)
+            if entrada.filename == "docProps/core.xml":
+                contenido = re.sub(
+                    rb"(<dcterms:modified[^>]*>)[^<]*", rb"\g<1>" + fecha, contenido
+                )
+            destino.writestr(info, contenido)
+    return salida.getvalue()
+
+
+def _generar_plantilla(ejemplos):
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    libro = Workbook()
+    hoja = libro.active
+    hoja.title = "Productos"
+    hoja.append(COLUMNAS)
+    for fila in ejemplos:
+        hoja.append(fila)
+    # Encabezado como lo escribía pandas: negrita, centrado y con borde
+    borde = Side(style="thin")
+    for celda in hoja[1]:
+        celda.font = Font(bold=True)
+        celda.alignment = Alignment(horizontal="center", vertical="top")
+        celda.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+    for columna in hoja.columns:
+        largo = max(len(str(celda.value)) for celda in columna)
+        hoja.column_dimensions[columna[0].column_letter].width = min(largo + 2, 50)
+    libro.properties.created = _FECHA_FIJA
+    salida = io.BytesIO()
+    libro.save(salida)
+    return _sin_fechas(salida.getvalue())
+
+
+def plantilla_excel(variante="es"):
+    """(bytes, etag) de la plantilla .xlsx; se genera en el primer uso."""
+    with _lock:
+        if variante not in _plantillas:
+            datos = _generar_plantilla(EJEMPLOS[variante])
+            _plantillas[variante] = (datos, hashlib.sha256(datos).hexdigest())
+        return _plantillas[variante]
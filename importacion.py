@@ -0,0 +1,584 @@
+"""
+Lectura, validación e inserción de productos para la carga masiva.
+
+El archivo se lee por lotes de IMPORTACION_LOTE filas (openpyxl en modo solo
+lectura para .xlsx, pandas por bloques para .csv) y cada lote se valida, se
+inserta con un único INSERT de varias filas y se confirma antes de leer el
+siguiente. Los nombres y códigos que ya tiene la empresa se cargan una sola
+vez en conjuntos. Así la memoria depende del tamaño del lote y de
+IMPORTACION_MAX_DETALLES (filas detalladas en la respuesta), no del archivo.
+
+Las cargas en segundo plano se guardan como TrabajoImportacion (con el
+archivo). Un pool de hilos las coordina y el trabajo pesado (leer, validar e
+insertar) corre en el pool de procesos de trabajos.py, fuera del GIL de los
+hilos que atienden el API. Se procesan varias empresas a la vez, pero una
+sola carga por empresa, para que dos archivos no validen la unicidad contra
+el mismo catálogo al mismo tiempo; lo garantiza un índice único parcial
+sobre las cargas en curso, también entre procesos.
+
+En modo upsert los productos existentes se buscan por código con una consulta
+por lote y los cambios se aplican con pocos UPDATE de conjunto, todo en una
+sola transacción.
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+
+from catalogo import invalidar_catalogo
+from database import db
+from models import Producto, TrabajoImportacion
+from trabajos import contexto_de_proceso, ejecutar_en_proceso
+
+COLUMNAS_OBLIGATORIAS = ["nombre", "precio"]
+COLUMNAS_OPCIONALES = ["descripcion", "unidad", "codigo"]
+EXTENSIONES = ["xlsx", "xls", "csv"]
+MODOS = ["insertar", "upsert"]
+# Columnas que el modo upsert puede cambiar en un producto existente
+CAMPOS_UPSERT = ["precio", "descripcion", "unidad"]
+
+# Filas por lote: cada lote se valida, inserta y confirma por separado
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", 2000))
+# Máximo de filas creadas y de errores que se detallan en la respuesta; el
+# resto solo se cuenta (0 = sin límite)
+IMPORTACION_MAX_DETALLES = int(os.getenv("IMPORTACION_MAX_DETALLES", 10000))
+# Productos por UPDATE en el modo upsert
+IMPORTACION_LOTE_UPDATE = 500
+# Cargas en segundo plano simultáneas (de empresas distintas)
+IMPORTACION_HILOS = int(os.getenv("IMPORTACION_HILOS", 2))
+# Una carga "procesando" sin avances en este tiempo se considera abandonada
+IMPORTACION_BLOQUEO = float(os.getenv("IMPORTACION_BLOQUEO", 600))
+
+_hilos = None
+_lock = threading.Lock()
+
+
+def claves_existentes(empresa_id):
+    """Conjuntos (nombres, códigos) de los productos actuales de la empresa."""
+    nombres, codigos = set(), set()
+    filas = db.session.query(Producto.nombre, Producto.codigo).filter_by(
+        empresa_id=empresa_id
+    )
+    for nombre, codigo in filas:
+        nombres.add(nombre)
+        if codigo:
+            codigos.add(codigo)
+    return nombres, codigos
+
+
+def _texto(df, columna, defecto):
+    # Igual que str(celda).strip(), con las celdas vacías (o "nan") como `defecto`
+    if columna not in df.columns:
+        return pd.Series(defecto, index=df.index, dtype=object)
+    texto = df[columna].astype(str).str.strip()
+    return texto.where(df[columna].notna() & texto.str.lower().ne("nan"), defecto)
+
+
+def productos_por_codigo(empresa_id, codigos):
+    """{codigo: [producto]} de los productos de la empresa con esos códigos."""
+    existentes = {}
+    if not codigos:
+        return existentes
+    filas = db.session.query(
+        Producto.id,
+        Producto.codigo,
+        Producto.precio,
+        Producto.descripcion,
+        Producto.unidad,
+    ).filter(Producto.empresa_id == empresa_id, Producto.codigo.in_(codigos))
+    for id_, codigo, precio, descripcion, unidad in filas:
+        existentes.setdefault(codigo, []).append(
+            {
+                "id": id_,
+                "precio": precio,
+                "descripcion": descripcion or "",
+                "unidad": unidad or "",
+            }
+        )
+    return existentes
+
+
+def validar_productos(
+    df, nombres, codigos, fila_inicial=2, existentes=None, campos=CAMPOS_UPSERT
+):
+    """
+    Valida las filas de `df` y devuelve un dict con las filas por insertar
+    ("filas"), los cambios por aplicar ("cambios"), los detalles de ambos, las
+    filas sin cambios ("sin_cambios") y los errores.
+
+    `nombres` y `codigos` se amplían con cada fila aceptada, así que un
+    producto repetido dentro del archivo también se rechaza. `fila_inicial`
+    es el número de fila en la hoja de la primera fila de `df` (2 porque la 1
+    es el encabezado).
+
+    Sin `existentes` (modo insertar) `codigos` trae los códigos de la empresa
+    y una fila con un código existente es un error. En modo upsert
+    `existentes` son los productos de la empresa con los códigos del lote
+    (ver productos_por_codigo) y `codigos` solo los ya vistos en el archivo:
+    la fila actualiza los `campos` de esos productos.
+    """
+    nombre = _texto(df, "nombre", "")
+    descripcion = _texto(df, "descripcion", "")
+    unidad = _texto(df, "unidad", "unidad")
+    # En modo upsert una celda vacía no cambia el valor del producto
+    unidad_archivo = _texto(df, "unidad", "")
+    codigo = _texto(df, "codigo", "")
+    precio_crudo = df["precio"]
+    precio = pd.to_numeric(precio_crudo, errors="coerce")
+
+    motivo = np.select(
+        [
+            nombre == "",
+            precio_crudo.isna(),
+            precio.isna(),
+            precio < 0,
+        ],
+        [
+            "El nombre es obligatorio",
+            "El precio es obligatorio",
+            "El precio debe ser un número válido",
+            "El precio debe ser mayor o igual a 0",
+        ],
+        default="",
+    )
+    filas_hoja = np.arange(fila_inicial, fila_inicial + len(df))
+
+    resultado = {
+        "filas": [],
+        "detalles_creados": [],
+        "cambios": [],
+        "detalles_actualizados": [],
+        "sin_cambios": 0,
+        "errores": [
+            {"fila": int(f), "error": str(m)} for f, m in zip(filas_hoja, motivo) if m
+        ],
+    }
+    errores = resultado["errores"]
+    validas = np.flatnonzero(motivo == "")
+    # Solo la unicidad se resuelve fila a fila, contra los conjuntos en memoria
+    for fila, n, c, d, u, ua, p in zip(
+        (filas_hoja[validas]).tolist(),
+        nombre.to_numpy()[validas].tolist(),
+        codigo.to_numpy()[validas].tolist(),
+        descripcion.to_numpy()[validas].tolist(),
+        unidad.to_numpy()[validas].tolist(),
+        unidad_archivo.to_numpy()[validas].tolist(),
+        precio.to_numpy(dtype=float)[validas].tolist(),
+    ):
+        if existentes is not None and c in existentes and c not in codigos:
+            codigos.add(c)
+            nuevos = {"precio": p, "descripcion": d, "unidad": ua}
+            nuevos = {campo: nuevos[campo] for campo in campos if nuevos[campo] != ""}
+            diferencias = {}
+            for producto in existentes[c]:
+                distintos = {k: v for k, v in nuevos.items() if producto[k] != v}
+                if distintos:
+                    resultado["cambios"].append(dict(nuevos, id=producto["id"]))
+                    diferencias.update(distintos)
+            if diferencias:
+                resultado["detalles_actualizados"].append(
+                    {"fila": fila, "codigo": c, "cambios": diferencias}
+                )
+            else:
+                resultado["sin_cambios"] += 1
+            continue
+        if (c and c in codigos) or n in nombres:
+            errores.append(
+                {
+                    "fila": fila,
+                    "error": f"Ya existe un producto con el nombre '{n}'"
+                    + (f" o código '{c}'" if c else ""),
+                }
+            )
+            continue
+        nombres.add(n)
+        if c:
+            codigos.add(c)
+        resultado["filas"].append(
+            {"nombre": n, "descripcion": d, "precio": p, "unidad": u, "codigo": c}
+        )
+        resultado["detalles_creados"].append(
+            {"fila": fila, "nombre": n, "precio": p, "unidad": u, "codigo": c or None}
+        )
+    errores.sort(key=lambda e: e["fila"])
+    return resultado
+
+
+def insertar_productos(empresa_id, filas):
+    """Inserta las filas validadas con un único INSERT de varias filas (sin commit)."""
+    if not filas:
+        return
+    db.session.execute(
+        db.insert(Producto), [dict(f, empresa_id=empresa_id) for f in filas]
+    )
+
+
+def actualizar_productos(empresa_id, cambios, campos=CAMPOS_UPSERT):
+    """
+    Aplica `cambios` ([{id, campo: valor}]) sin commit, con un UPDATE por cada
+    IMPORTACION_LOTE_UPDATE productos: SET campo = CASE id WHEN ... END. Un
+    campo que falta en un cambio conserva su valor.
+    """
+    if not cambios:
+        return
+    productos = Producto.__table__
+    for i in range(0, len(cambios), IMPORTACION_LOTE_UPDATE):
+        parte = cambios[i : i + IMPORTACION_LOTE_UPDATE]
+        valores = {}
+        for campo in campos:
+            casos = {c["id"]: c[campo] for c in parte if campo in c}
+            if casos:
+                valores[campo] = db.case(
+                    casos, value=productos.c.id, else_=productos.c[campo]
+                )
+        db.session.execute(
+            productos.update()
+            .where(
+                productos.c.empresa_id == empresa_id,
+                productos.c.id.in_([c["id"] for c in parte]),
+            )
+            .values(valores)
+        )
+
+
+def _invalidar_catalogo(empresa_id):
+    # Los INSERT/UPDATE masivos no pasan por el flush del ORM: se avisa a la
+    # caché del catálogo en una transacción propia y corta, después de
+    # confirmar, para no bloquear la fila de la empresa (login, logout,
+    # tokens) mientras dura la carga
+    with db.engine.begin() as conn:
+        invalidar_catalogo([empresa_id], conn)
+
+
+def _columnas_unicas(encabezado):
+    # Como pandas: celdas vacías "Unnamed: i" y repetidas "nombre.1", "nombre.2"...
+    columnas, vistas = [], {}
+    for i, celda in enumerate(encabezado):
+        nombre = f"Unnamed: {i}" if celda is None else celda
+        if nombre in vistas:
+            vistas[nombre] += 1
+            nombre = f"{nombre}.{vistas[nombre]}"
+        else:
+            vistas[nombre] = 0
+        columnas.append(nombre)
+    return columnas
+
+
+def _lotes_xlsx(filas, columnas, tamano):
+    ancho = len(columnas)
+    lote, vacias = [], 0
+    for fila in filas:
+        if all(v is None for v in fila):
+            # Las filas vacías solo cuentan si hay datos después (como pandas)
+            vacias += 1
+            continue
+        lote.extend([(None,) * ancho] * vacias)
+        vacias = 0
+        lote.append(tuple(fila[:ancho]) + (None,) * (ancho - len(fila)))
+        while len(lote) >= tamano:
+            yield pd.DataFrame(lote[:tamano], columns=columnas, dtype=object)
+            lote = lote[tamano:]
+    if lote:
+        yield pd.DataFrame(lote, columns=columnas, dtype=object)
+
+
+class _LotesXlsx:
+    """Lotes de un .xlsx; close() cierra el libro aunque no se hayan leído."""
+
+    def __init__(self, libro, filas, columnas, tamano):
+        self.libro = libro
+        self._lotes = self._leer(filas, columnas, tamano)
+
+    def _leer(self, filas, columnas, tamano):
+        try:
+            yield from _lotes_xlsx(filas, columnas, tamano)
+        finally:
+            self.libro.close()
+
+    def __iter__(self):
+        return self._lotes
+
+    def close(self):
+        self._lotes.close()
+        self.libro.close()
+
+
+def abrir_archivo(stream, extension, tamano=None):
+    """
+    Devuelve (columnas, lotes): los encabezados del archivo y un iterador de
+    DataFrames de hasta `tamano` filas. Las celdas conservan su tipo (objeto)
+    para que el mismo valor se lea igual en cualquier lote. Los .xls (xlrd)
+    no se pueden leer por partes y se cargan completos antes de dividirlos.
+
+    `lotes` tiene close(): quien llama lo cierra al terminar (p. ej. con
+    contextlib.closing), también si no llega a leerlo, para no dejar abierto
+    el libro de openpyxl.
+    """
+    tamano = tamano or IMPORTACION_LOTE
+    if extension == "xlsx":
+        from openpyxl import load_workbook
+
+        libro = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            filas = libro.worksheets[0].iter_rows(values_only=True)
+            columnas = _columnas_unicas(next(filas, ()))
+        except Exception:
+            libro.close()
+            raise
+        return columnas, _LotesXlsx(libro, filas, columnas, tamano)
+    if extension == "csv":
+        opciones = {"encoding": "utf-8-sig", "dtype": object}
+        columnas = list(pd.read_csv(stream, nrows=0, **opciones).columns)
+        stream.seek(0)
+        return columnas, pd.read_csv(stream, chunksize=tamano, **opciones)
+    df = pd.read_excel(stream, engine="xlrd", dtype=object)
+    return list(df.columns), (
+        df.iloc[i : i + tamano] for i in range(0, len(df), tamano)
+    )
+
+
+def importar(empresa_id, lotes, modo="insertar", al_avanzar=None):
+    """
+    Valida e inserta cada lote y devuelve el resumen de la carga. Si se da,
+    `al_avanzar(resumen)` se llama tras cada lote.
+
+    En modo "insertar" cada lote se confirma por separado; si uno falla, los
+    anteriores ya quedaron guardados y la excepción lleva el resumen parcial
+    en `e.resumen`. En modo "upsert" las filas cuyo código ya existe
+    actualizan precio, descripción y unidad (solo las columnas presentes en
+    el archivo; las celdas vacías no cambian nada) y toda la carga se
+    confirma en una sola transacción.
+    """
+    upsert = modo == "upsert"
+    resumen = {
+        "mensaje": "Procesamiento completado",
+        "productos_creados": 0,
+        "productos_con_errores": 0,
+        "filas_procesadas": 0,
+        "detalles_creados": [],
+        "errores": [],
+        "detalles_truncados": False,
+        "lotes": [],
+    }
+    detallados = ["detalles_creados", "errores"]
+    if upsert:
+        resumen.update(
+            productos_actualizados=0, productos_sin_cambios=0, detalles_actualizados=[]
+        )
+        detallados.append("detalles_actualizados")
+    limite = IMPORTACION_MAX_DETALLES or None
+    nombres, codigos = claves_existentes(empresa_id)
+    if upsert:
+        # Los códigos existentes se consultan por lote; aquí solo los del archivo
+        codigos = set()
+    try:
+        for numero, df in enumerate(lotes, start=1):
+            fila_inicial = resumen["filas_procesadas"] + 2
+            existentes, campos = None, CAMPOS_UPSERT
+            if upsert:
+                campos = [c for c in CAMPOS_UPSERT if c in df.columns]
+                existentes = productos_por_codigo(
+                    empresa_id, set(_texto(df, "codigo", "").tolist()) - {""}
+                )
+            r = validar_productos(
+                df, nombres, codigos, fila_inicial, existentes, campos
+            )
+            insertar_productos(empresa_id, r["filas"])
+            actualizar_productos(empresa_id, r["cambios"], campos)
+            if not upsert:
+                db.session.commit()
+
+            resumen["filas_procesadas"] += len(df)
+            resumen["productos_creados"] += len(r["filas"])
+            resumen["productos_con_errores"] += len(r["errores"])
+            for clave in detallados:
+                lista, nuevos = resumen[clave], r[clave]
+                espacio = len(nuevos) if limite is None else limite - len(lista)
+                lista.extend(nuevos[: max(espacio, 0)])
+                if len(nuevos) > espacio:
+                    resumen["detalles_truncados"] = True
+            lote = {
+                "lote": numero,
+                "fila_inicial": fila_inicial,
+                "filas": len(df),
+                "creados": len(r["filas"]),
+                "errores": len(r["errores"]),
+            }
+            if upsert:
+                resumen["productos_actualizados"] += len(r["detalles_actualizados"])
+                resumen["productos_sin_cambios"] += r["sin_cambios"]
+                lote["actualizados"] = len(r["detalles_actualizados"])
+                lote["sin_cambios"] = r["sin_cambios"]
+            resumen["lotes"].append(lote)
+            if not upsert and r["filas"]:
+                _invalidar_catalogo(empresa_id)
+            if al_avanzar:
+                al_avanzar(resumen)
+        if upsert:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if upsert:
+            resumen["productos_creados"] = resumen["productos_actualizados"] = 0
+        e.resumen = resumen
+        raise
+    if upsert and (resumen["productos_creados"] or resumen["productos_actualizados"]):
+        _invalidar_catalogo(empresa_id)
+    return resumen
+
+
+# --- Cargas en segundo plano ---
+
+
+def _pool():
+    global _hilos
+    with _lock:
+        if _hilos is None:
+            _hilos = ThreadPoolExecutor(
+                max_workers=IMPORTACION_HILOS, thread_name_prefix="importacion"
+            )
+    return _hilos
+
+
+def _guardar_avance(trabajo_id, avance, **valores):
+    # Conexión propia: en modo upsert la transacción de la carga sigue abierta
+    trabajos = TrabajoImportacion.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            trabajos.update()
+            .where(trabajos.c.id == trabajo_id)
+            .values(
+                filas_procesadas=avance.get("filas_procesadas", 0),
+                productos_creados=avance.get("productos_creados", 0),
+                productos_actualizados=avance.get("productos_actualizados", 0),
+                productos_con_errores=avance.get("productos_con_errores", 0),
+                errores=avance.get("errores", []),
+                actualizado=datetime.utcnow(),
+                **valores,
+            )
+        )
+
+
+def _reclamar(trabajo_id):
+    """Pasa el trabajo a "procesando" si su empresa no tiene otro en curso."""
+    trabajo = db.session.get(TrabajoImportacion, trabajo_id)
+    if trabajo is None or trabajo.estado != "pendiente":
+        return None
+    empresa_id = trabajo.empresa_id
+    en_curso = (
+        db.session.query(TrabajoImportacion.id)
+        .filter_by(empresa_id=empresa_id, estado="procesando")
+        .exists()
+    )
+    try:
+        reclamado = TrabajoImportacion.query.filter(
+            TrabajoImportacion.id == trabajo_id,
+            TrabajoImportacion.estado == "pendiente",
+            ~en_curso,
+        ).update(
+            {"estado": "procesando", "actualizado": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+    except IntegrityError:
+        # Otro proceso reclamó a la vez una carga de la misma empresa; el
+        # índice ux_trabajos_importacion_en_curso deja pasar solo una
+        db.session.rollback()
+        return None
+    return empresa_id if reclamado else None
+
+
+def _ejecutar(trabajo_id):
+    trabajo = db.session.get(TrabajoImportacion, trabajo_id)
+    empresa_id, modo = trabajo.empresa_id, trabajo.modo
+    datos, extension = trabajo.archivo, trabajo.extension
+    db.session.commit()
+    al_avanzar = lambda r: _guardar_avance(trabajo_id, r)
+    if modo == "upsert" and db.engine.dialect.name == "sqlite":
+        # SQLite bloquea la base entera mientras la transacción de la carga
+        # está abierta: el avance solo se guarda al terminar
+        al_avanzar = None
+    try:
+        _, lotes = abrir_archivo(io.BytesIO(datos), extension)
+        with closing(lotes):
+            resumen = importar(empresa_id, lotes, modo, al_avanzar)
+    except Exception as e:
+        db.session.rollback()
+        _guardar_avance(
+            trabajo_id,
+            getattr(e, "resumen", {}),
+            estado="fallido",
+            error=str(e),
+            archivo=None,
+        )
+        return
+    _guardar_avance(
+        trabajo_id, resumen, estado="completado", resumen=resumen, archivo=None
+    )
+
+
+def _ejecutar_en_proceso(trabajo_id):
+    with contexto_de_proceso():
+        try:
+            _ejecutar(trabajo_id)
+        except Exception as e:
+            db.session.rollback()
+            _guardar_avance(trabajo_id, {}, estado="fallido", error=str(e))
+
+
+def _procesar(app, trabajo_id):
+    with app.app_context():
+        while trabajo_id is not None:
+            empresa_id = _reclamar(trabajo_id)
+            if empresa_id is None:
+                # Otra carga de la empresa está en curso: la tomará al terminar
+                return
+            try:
+                ejecutar_en_proceso(_ejecutar_en_proceso, trabajo_id)
+            except Exception as e:
+                # El proceso murió (p. ej. sin memoria) también en el reintento
+                _guardar_avance(trabajo_id, {}, estado="fallido", error=str(e))
+            siguiente = (
+                db.session.query(TrabajoImportacion.id)
+                .filter_by(empresa_id=empresa_id, estado="pendiente")
+                .order_by(TrabajoImportacion.id)
+                .first()
+            )
+            db.session.commit()
+            trabajo_id = siguiente[0] if siguiente else None
+
+
+def encolar_importacion(app, trabajo_id):
+    """Programa una carga ya guardada en la base de datos."""
+    return _pool().submit(_procesar, app, trabajo_id)
+
+
+def reanudar_importaciones(app):
+    """
+    Vuelve a encolar las cargas pendientes y las abandonadas por un worker
+    caído; estas se procesan desde el principio (en modo insertar las filas
+    ya guardadas se reportan como repetidas).
+    """
+    with app.app_context():
+        limite = datetime.utcnow() - timedelta(seconds=IMPORTACION_BLOQUEO)
+        TrabajoImportacion.query.filter(
+            TrabajoImportacion.estado == "procesando",
+            TrabajoImportacion.actualizado < limite,
+        ).update({"estado": "pendiente"}, synchronize_session=False)
+        db.session.commit()
+        ids = [
+            t_id
+            for (t_id,) in db.session.query(TrabajoImportacion.id)
+            .filter_by(estado="pendiente")
+            .order_by(TrabajoImportacion.id)
+        ]
+    for trabajo_id in ids:
+        encolar_importacion(app, trabajo_id)
+    return len(ids)
@@ -0,0 +1,184 @@
+"""
+Caché de logos de empresa para la generación de PDFs.
+
+Los logos se guardan en disco (sobreviven reinicios) y se indexan en memoria
+con un LRU de tamaño limitado. Mientras una entrada esté vigente no se hace
+ninguna petición de red; cuando vence se revalida con ETag/Last-Modified.
+
+La caché se indexa solo por URL: un logo nuevo sube a Cloudinary con otra URL
+y el cambio de contenido en la misma URL lo detecta la revalidación. Las
+copias que dejan de usarse se borran del disco al pasar LOGO_CACHE_MAX_DIAS
+sin revalidarse, o las más antiguas primero si el directorio supera
+LOGO_CACHE_MAX_MB.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+LOGO_CACHE_DIR = os.getenv("LOGO_CACHE_DIR", os.path.join("cotizador_api", "logos"))
+LOGO_CACHE_MAX_ENTRIES = int(os.getenv("LOGO_CACHE_MAX_ENTRIES", 128))
+# Segundos que una entrada se considera fresca antes de revalidarla
+LOGO_CACHE_TTL = int(os.getenv("LOGO_CACHE_TTL", 24 * 3600))
+LOGO_FETCH_TIMEOUT = float(os.getenv("LOGO_FETCH_TIMEOUT", 5))
+# Límites del directorio en disco; se aplican cada vez que se descarga un logo
+LOGO_CACHE_MAX_MB = int(os.getenv("LOGO_CACHE_MAX_MB", 50))
+LOGO_CACHE_MAX_DIAS = int(os.getenv("LOGO_CACHE_MAX_DIAS", 30))
+
+_memoria = OrderedDict()  # url -> entrada, en orden de uso
+_lock = threading.Lock()
+
+
+def _clave(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _ruta_meta(url):
+    return os.path.join(LOGO_CACHE_DIR, _clave(url) + ".json")
+
+
+def _detectar_tipo(contenido):
+    # FPDF solo entiende PNG, JPG y GIF; se detecta por la firma del archivo
+    if contenido.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if contenido.startswith(b"\xff\xd8"):
+        return "jpg"
+    if contenido[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def _escribir_atomico(ruta, contenido):
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(contenido)
+    os.replace(tmp, ruta)
+
+
+def _recordar(url, entrada):
+    with _lock:
+        _memoria[url] = entrada
+        _memoria.move_to_end(url)
+        while len(_memoria) > LOGO_CACHE_MAX_ENTRIES:
+            _memoria.popitem(last=False)
+
+
+def _buscar(url):
+    with _lock:
+        entrada = _memoria.get(url)
+        if entrada:
+            _memoria.move_to_end(url)
+    # Otro proceso pudo haberla purgado del disco
+    if entrada and os.path.exists(entrada["ruta"]):
+        return entrada
+    try:
+        with open(_ruta_meta(url)) as f:
+            entrada = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(entrada.get("ruta", "")):
+        return None
+    _recordar(url, entrada)
+    return entrada
+
+
+def _guardar_meta(url, entrada):
+    _escribir_atomico(_ruta_meta(url), json.dumps(entrada).encode("utf-8"))
+    _recordar(url, entrada)
+
+
+def obtener_logo(url):
+    """
+    Devuelve (ruta_local, tipo) del logo en `url`, descargándolo solo si no
+    está en caché o si la entrada venció y el servidor reporta un cambio.
+    Devuelve None si el logo no se puede obtener.
+    """
+    entrada = _buscar(url)
+    if entrada and time.time() - entrada["validado"] < LOGO_CACHE_TTL:
+        return entrada["ruta"], entrada["tipo"]
+
+    headers = {}
+    if entrada:
+        if entrada.get("etag"):
+            headers["If-None-Match"] = entrada["etag"]
+        if entrada.get("last_modified"):
+            headers["If-Modified-Since"] = entrada["last_modified"]
+    try:
+        response = requests.get(url, headers=headers, timeout=LOGO_FETCH_TIMEOUT)
+    except requests.RequestException:
+        # Sin red se sigue usando la copia local aunque esté vencida
+        return (entrada["ruta"], entrada["tipo"]) if entrada else None
+
+    if response.status_code == 304 and entrada:
+        entrada["validado"] = time.time()
+        _guardar_meta(url, entrada)
+        return entrada["ruta"], entrada["tipo"]
+    if response.status_code != 200:
+        return (entrada["ruta"], entrada["tipo"]) if entrada else None
+
+    tipo = _detectar_tipo(response.content)
+    if not tipo:
+        return None
+    os.makedirs(LOGO_CACHE_DIR, exist_ok=True)
+    ruta = os.path.join(LOGO_CACHE_DIR, f"{_clave(url)}.{tipo}")
+    _escribir_atomico(ruta, response.content)
+    entrada = {
+        "ruta": ruta,
+        "tipo": tipo,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "validado": time.time(),
+    }
+    _guardar_meta(url, entrada)
+    purgar_cache(conservar=url)
+    return ruta, tipo
+
+
+def purgar_cache(conservar=None):
+    """
+    Borra del disco los logos sin revalidar en LOGO_CACHE_MAX_DIAS y, si el
+    directorio sigue pasando de LOGO_CACHE_MAX_MB, los más antiguos primero.
+    Nunca borra el de la URL `conservar`.
+    """
+    grupos = {}  # clave -> [archivos, tamaño, última modificación]
+    try:
+        nombres = os.listdir(LOGO_CACHE_DIR)
+    except OSError:
+        return
+    for nombre in nombres:
+        ruta = os.path.join(LOGO_CACHE_DIR, nombre)
+        try:
+            info = os.stat(ruta)
+        except OSError:
+            continue
+        grupo = grupos.setdefault(nombre.split(".", 1)[0], [[], 0, 0])
+        grupo[0].append(ruta)
+        grupo[1] += info.st_size
+        grupo[2] = max(grupo[2], info.st_mtime)
+    sobrante = sum(g[1] for g in grupos.values()) - LOGO_CACHE_MAX_MB * 1024 * 1024
+    if conservar:
+        grupos.pop(_clave(conservar), None)
+
+    limite = time.time() - LOGO_CACHE_MAX_DIAS * 86400
+    borrados = set()
+    for clave, (rutas, tamano, modificado) in sorted(
+        grupos.items(), key=lambda item: item[1][2]
+    ):
+        if modificado >= limite and sobrante <= 0:
+            break
+        for ruta in rutas:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        sobrante -= tamano
+        borrados.add(clave)
+    if borrados:
+        with _lock:
+            for url in [u for u in _memoria if _clave(u) in borrados]:
+                del _memoria[url]
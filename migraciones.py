@@ -0,0 +1,540 @@
+"""
+Migraciones versionadas del esquema.
+
+Cada migración es una función registrada con @migracion(version, descripcion)
+y se aplica una sola vez; las aplicadas quedan en la tabla schema_version.
+Se ejecutan con `flask --app app migrar` (el contenedor lo hace antes de
+arrancar), nunca al importar la aplicación.
+
+Las migraciones deben ser idempotentes: una base creada antes de este sistema
+con db.create_all() ya puede tener parte de los cambios. La migración 1 crea
+las tablas tal como eran al introducir las migraciones (una copia fija, no los
+modelos actuales), así que una base nueva recorre la misma secuencia que una
+existente; todo cambio posterior del esquema va en una migración nueva, que
+tampoco usa los modelos: describe sus tablas e índices tal como eran al
+escribirla.
+"""
+
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from flask.cli import with_appcontext
+from sqlalchemy.schema import CreateIndex
+
+from database import db
+
+_MIGRACIONES = []
+# Clave arbitraria para pg_advisory_lock: evita que dos contenedores migren a la vez
+_LOCK_MIGRACIONES = 815_240_001
+# Filas por transacción en las migraciones que copian datos
+_LOTE_MIGRACION = 1000
+
+
+class VersionEsquema(db.Model):
+    __tablename__ = "schema_version"
+    version = db.Column(db.Integer, primary_key=True)
+    descripcion = db.Column(db.String(200), nullable=False)
+    aplicada = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+def migracion(version, descripcion):
+    def registrar(funcion):
+        _MIGRACIONES.append((version, descripcion, funcion))
+        _MIGRACIONES.sort(key=lambda m: m[0])
+        return funcion
+
+    return registrar
+
+
+def _columnas(tabla):
+    return {c["name"] for c in db.inspect(db.engine).get_columns(tabla)}
+
+
+def _crear_indices(indices):
+    """
+    Crea los índices que falten. En PostgreSQL van con CONCURRENTLY (definido
+    en cada índice) y fuera de una transacción, para no bloquear las
+    escrituras en tablas grandes mientras se construyen; si una creación
+    anterior se interrumpió y dejó el índice inválido, se borra y se rehace.
+    """
+    if db.engine.dialect.name != "postgresql":
+        # IF NOT EXISTS también cubre los índices por expresión, que el
+        # inspector de SQLAlchemy no siempre reporta
+        with db.engine.begin() as conn:
+            for indice in indices:
+                conn.execute(CreateIndex(indice, if_not_exists=True))
+        return
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for indice in indices:
+            invalido = conn.execute(
+                db.text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :nombre AND NOT i.indisvalid"
+                ),
+                {"nombre": indice.name},
+            ).first()
+            if invalido:
+                conn.execute(
+                    db.text(f'DROP INDEX CONCURRENTLY IF EXISTS "{indice.name}"')
+                )
+            conn.execute(CreateIndex(indice, if_not_exists=True))
+
+
+# --- Migraciones ---
+
+
+def _esquema_inicial():
+    """Tablas del esquema base; no cambiar aunque cambien los modelos."""
+    base = sa.MetaData()
+    sa.Table(
+        "codigos_invitacion",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("codigo", sa.String(32), unique=True, nullable=False),
+        sa.Column("creado", sa.DateTime, nullable=False),
+        sa.Column("vence", sa.DateTime, nullable=False),
+        sa.Column("usado", sa.Integer),
+    )
+    sa.Table(
+        "empresas",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nombre", sa.String(100), nullable=False, unique=True),
+        sa.Column("email", sa.String(100), nullable=False, unique=True),
+        sa.Column("password_hash", sa.Text, nullable=False),
+        sa.Column("nit", sa.String(30)),
+        sa.Column("direccion", sa.String(200)),
+        sa.Column("telefono", sa.String(30)),
+        sa.Column("contacto", sa.String(100)),
+        sa.Column("logo_url", sa.String(200)),
+        sa.Column("token_activo", sa.Text),
+        sa.Column("gmail_access_token", sa.Text),
+        sa.Column("gmail_refresh_token", sa.Text),
+    )
+    sa.Table(
+        "productos",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("nombre", sa.String(100), nullable=False),
+        sa.Column("descripcion", sa.Text),
+        sa.Column("precio", sa.Float, nullable=False),
+        sa.Column("unidad", sa.String(30)),
+        sa.Column("codigo", sa.String(50)),
+    )
+    sa.Table(
+        "cotizaciones",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("cliente", sa.String(100), nullable=False),
+        sa.Column("correo", sa.String(100), nullable=False),
+        sa.Column("telefono", sa.String(30)),
+        sa.Column("direccion", sa.String(200)),
+        sa.Column("vendedor", sa.String(100)),
+        sa.Column("fecha", sa.String(30)),
+        sa.Column("validez", sa.String(30)),
+        sa.Column("forma_pago", sa.String(100)),
+        sa.Column("tiempo_entrega", sa.String(100)),
+        sa.Column("estado_cotizacion", sa.String(30)),
+        sa.Column("notas_legales", sa.Text),
+        sa.Column("firma", sa.Text),
+        sa.Column("codigo_cotizacion", sa.String(30), nullable=False, unique=True),
+        sa.Column("observaciones", sa.Text),
+        sa.Column("productos", sa.JSON, nullable=False),
+        sa.Column("subtotal", sa.Float),
+        sa.Column("descuento", sa.Float),
+        sa.Column("iva", sa.Float),
+        sa.Column("total", sa.Float, nullable=False),
+        sa.Column("condiciones", sa.Text),
+        sa.Column("estado_envio", sa.String(20), nullable=False),
+        sa.Column("pdf_ref", sa.String(64)),
+        sa.Column("pdf_tamano", sa.Integer),
+        sa.Column("archivo_pdf", sa.LargeBinary),
+    )
+    sa.Table(
+        "blobs_pdf",
+        base,
+        sa.Column("hash", sa.String(64), primary_key=True),
+        sa.Column("datos", sa.LargeBinary, nullable=False),
+        sa.Column("tamano", sa.Integer, nullable=False),
+        sa.Column("creado", sa.DateTime, nullable=False),
+    )
+    sa.Table(
+        "logs_actividad",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("fecha", sa.DateTime, nullable=False),
+        sa.Column("tipo", sa.String(50), nullable=False),
+        sa.Column("descripcion", sa.Text, nullable=False),
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id")),
+    )
+    sa.Table(
+        "soporte",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("asunto", sa.String(200), nullable=False),
+        sa.Column("mensaje", sa.Text, nullable=False),
+        sa.Column("fecha", sa.DateTime, nullable=False),
+        sa.Column("estado", sa.String(30)),
+        sa.Column("respuesta", sa.Text),
+        sa.Column("fecha_respuesta", sa.DateTime),
+    )
+    sa.Table(
+        "trabajos_cotizacion",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "cotizacion_id",
+            sa.Integer,
+            sa.ForeignKey("cotizaciones.id"),
+            nullable=False,
+        ),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("estado", sa.String(20), nullable=False),
+        sa.Column("error", sa.Text),
+        sa.Column("creado", sa.DateTime, nullable=False),
+        sa.Column("actualizado", sa.DateTime, nullable=False),
+    )
+    return base
+
+
+@migracion(1, "Tablas iniciales")
+def _tablas_iniciales():
+    # Los valores por defecto (fechas, estados) los pone el ORM al insertar
+    _esquema_inicial().create_all(db.engine, checkfirst=True)
+
+
+@migracion(2, "Referencia y tamaño del PDF en cotizaciones")
+def _pdf_ref():
+    columnas = _columnas("cotizaciones")
+    with db.engine.begin() as conn:
+        if "pdf_ref" not in columnas:
+            conn.execute(
+                db.text("ALTER TABLE cotizaciones ADD COLUMN pdf_ref VARCHAR(64)")
+            )
+        if "pdf_tamano" not in columnas:
+            conn.execute(
+                db.text("ALTER TABLE cotizaciones ADD COLUMN pdf_tamano INTEGER")
+            )
+        if db.engine.dialect.name == "postgresql":
+            conn.execute(
+                db.text(
+                    "ALTER TABLE cotizaciones ALTER COLUMN archivo_pdf DROP NOT NULL"
+                )
+            )
+
+
+def _indices_consultas():
+    """Índices de la migración 3, sobre las tablas del esquema base."""
+    t = _esquema_inicial().tables
+    codigos, productos = t["codigos_invitacion"], t["productos"]
+    cotizaciones, logs = t["cotizaciones"], t["logs_actividad"]
+    soporte, trabajos = t["soporte"], t["trabajos_cotizacion"]
+    concurrente = {"postgresql_concurrently": True}
+    return [
+        sa.Index(
+            "ix_codigos_invitacion_creado",
+            codigos.c.creado,
+            codigos.c.id,
+            **concurrente,
+        ),
+        sa.Index(
+            "ix_productos_empresa_id",
+            productos.c.empresa_id,
+            productos.c.id,
+            **concurrente,
+        ),
+        sa.Index(
+            "ix_productos_empresa_codigo",
+            productos.c.empresa_id,
+            productos.c.codigo,
+            **concurrente,
+        ),
+        sa.Index(
+            "ix_productos_empresa_nombre",
+            productos.c.empresa_id,
+            productos.c.nombre,
+            **concurrente,
+        ),
+        sa.Index(
+            "ix_cotizaciones_empresa_id",
+            cotizaciones.c.empresa_id,
+            cotizaciones.c.id,
+            **concurrente,
+        ),
+        sa.Index(
+            "ix_cotizaciones_empresa_fecha",
+            cotizaciones.c.empresa_id,
+            sa.text("coalesce(fecha, '')"),
+            cotizaciones.c.id,
+            **concurrente,
+        ),
+        sa.Index("ix_cotizaciones_pdf_ref", cotizaciones.c.pdf_ref, **concurrente),
+        sa.Index("ix_logs_actividad_fecha", logs.c.fecha, **concurrente),
+        sa.Index("ix_soporte_fecha", soporte.c.fecha, soporte.c.id, **concurrente),
+        sa.Index("ix_trabajos_cotizacion_estado", trabajos.c.estado, **concurrente),
+    ]
+
+
+def _tabla_items(base):
+    """cotizacion_items tal como la creó la migración 4."""
+    return sa.Table(
+        "cotizacion_items",
+        base,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "cotizacion_id",
+            sa.Integer,
+            sa.ForeignKey("cotizaciones.id"),
+            nullable=False,
+        ),
+        sa.Column("posicion", sa.Integer, nullable=False),
+        sa.Column(
+            "producto_id",
+            sa.Integer,
+            sa.ForeignKey("productos.id", ondelete="SET NULL"),
+        ),
+        sa.Column("nombre", sa.String(100), nullable=False),
+        sa.Column("descripcion", sa.Text),
+        sa.Column("codigo", sa.String(50)),
+        sa.Column("unidad", sa.String(30)),
+        sa.Column("precio", sa.Float, nullable=False),
+        sa.Column("cantidad", sa.Float, nullable=False),
+        sa.Column("descuento", sa.Float, nullable=False),
+        sa.Column("iva", sa.Float, nullable=False),
+        sa.Index("ix_cotizacion_items_cotizacion", "cotizacion_id", "posicion"),
+        sa.Index("ix_cotizacion_items_producto", "producto_id"),
+    )
+
+
+def _valores_item(p):
+    # Copia de ItemCotizacion.valores al escribir la migración 4
+    return {
+        "producto_id": p.get("id"),
+        "nombre": p.get("nombre") or "",
+        "descripcion": p.get("descripcion"),
+        "codigo": p.get("codigo"),
+        "unidad": p.get("unidad"),
+        "precio": p.get("precio") or 0,
+        "cantidad": p.get("cantidad", 1),
+        "descuento": p.get("descuento") or 0,
+        "iva": p.get("iva") or 0,
+    }
+
+
+@migracion(3, "Índices de consultas frecuentes")
+def _indices():
+    _crear_indices(_indices_consultas())
+
+
+@migracion(4, "Líneas de cotización en cotizacion_items")
+def _items_cotizacion():
+    base = _esquema_inicial()
+    items = _tabla_items(base)
+    items.create(db.engine, checkfirst=True)
+    cotizaciones = base.tables["cotizaciones"]
+    sin_items = ~db.exists().where(items.c.cotizacion_id == cotizaciones.c.id)
+    ultimo_id = 0
+    # Por lotes y con commit en cada uno: si se interrumpe, se retoma donde quedó
+    while True:
+        filas = db.session.execute(
+            db.select(cotizaciones.c.id, cotizaciones.c.productos)
+            .where(cotizaciones.c.id > ultimo_id, sin_items)
+            .order_by(cotizaciones.c.id)
+            .limit(_LOTE_MIGRACION)
+        ).all()
+        if not filas:
+            break
+        valores = [
+            dict(cotizacion_id=c_id, posicion=i, **_valores_item(p))
+            for c_id, productos in filas
+            for i, p in enumerate(productos or [])
+        ]
+        if valores:
+            db.session.execute(db.insert(items), valores)
+        db.session.execute(
+            db.update(cotizaciones)
+            .where(cotizaciones.c.id.in_([c_id for c_id, _ in filas]))
+            .values(productos=[])
+        )
+        db.session.commit()
+        ultimo_id = filas[-1][0]
+
+
+@migracion(5, "Versión del catálogo de productos por empresa")
+def _catalogo_version():
+    if "catalogo_version" not in _columnas("empresas"):
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.text(
+                    "ALTER TABLE empresas ADD COLUMN catalogo_version "
+                    "INTEGER NOT NULL DEFAULT 0"
+                )
+            )
+
+
+@migracion(6, "Bandeja de salida de correos")
+def _correos_salida():
+    sa.Table(
+        "correos_salida",
+        _esquema_inicial(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "cotizacion_id",
+            sa.Integer,
+            sa.ForeignKey("cotizaciones.id"),
+            nullable=False,
+        ),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("destinatario", sa.String(100), nullable=False),
+        sa.Column("asunto", sa.String(200), nullable=False),
+        sa.Column("cuerpo", sa.Text, nullable=False),
+        sa.Column("estado", sa.String(20), nullable=False),
+        sa.Column("intentos", sa.Integer, nullable=False),
+        sa.Column("proximo_intento", sa.DateTime, nullable=False),
+        sa.Column("ultimo_error", sa.Text),
+        sa.Column("creado", sa.DateTime, nullable=False),
+        sa.Column("actualizado", sa.DateTime, nullable=False),
+        sa.Index("ix_correos_salida_estado", "estado", "proximo_intento"),
+    ).create(db.engine, checkfirst=True)
+
+
+@migracion(7, "Trabajos de carga masiva en segundo plano")
+def _trabajos_importacion():
+    sa.Table(
+        "trabajos_importacion",
+        _esquema_inicial(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False
+        ),
+        sa.Column("estado", sa.String(20), nullable=False),
+        sa.Column("modo", sa.String(20), nullable=False),
+        sa.Column("nombre_archivo", sa.String(255), nullable=False),
+        sa.Column("extension", sa.String(10), nullable=False),
+        sa.Column("archivo", sa.LargeBinary),
+        sa.Column("filas_procesadas", sa.Integer, nullable=False),
+        sa.Column("productos_creados", sa.Integer, nullable=False),
+        sa.Column("productos_actualizados", sa.Integer, nullable=False),
+        sa.Column("productos_con_errores", sa.Integer, nullable=False),
+        sa.Column("errores", sa.JSON, nullable=False),
+        sa.Column("resumen", sa.JSON),
+        sa.Column("error", sa.Text),
+        sa.Column("creado", sa.DateTime, nullable=False),
+        sa.Column("actualizado", sa.DateTime, nullable=False),
+        sa.Index("ix_trabajos_importacion_empresa", "empresa_id", "estado"),
+    ).create(db.engine, checkfirst=True)
+
+
+@migracion(8, "Huella de la entrada del PDF de cada cotización")
+def _pdf_entrada():
+    if "pdf_entrada" not in _columnas("cotizaciones"):
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.text("ALTER TABLE cotizaciones ADD COLUMN pdf_entrada VARCHAR(64)")
+            )
+
+
+@migracion(9, "Proceso dueño de cada trabajo de cotización")
+def _propietario_trabajos():
+    if "propietario" not in _columnas("trabajos_cotizacion"):
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.text(
+                    "ALTER TABLE trabajos_cotizacion "
+                    "ADD COLUMN propietario VARCHAR(120)"
+                )
+            )
+
+
+@migracion(10, "Una sola carga masiva en curso por empresa")
+def _importacion_unica():
+    with db.engine.begin() as conn:
+        # Si una empresa ya tiene varias cargas en curso, las demás vuelven a
+        # la cola para que el índice se pueda crear
+        conn.execute(
+            db.text(
+                "UPDATE trabajos_importacion SET estado = 'pendiente' "
+                "WHERE estado = 'procesando' AND id NOT IN ("
+                "SELECT MIN(id) FROM trabajos_importacion "
+                "WHERE estado = 'procesando' GROUP BY empresa_id)"
+            )
+        )
+        conn.execute(
+            db.text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajos_importacion_en_curso "
+                "ON trabajos_importacion (empresa_id) WHERE estado = 'procesando'"
+            )
+        )
+
+
+# --- Ejecución ---
+
+
+def versiones_aplicadas():
+    if not db.inspect(db.engine).has_table(VersionEsquema.__tablename__):
+        return set()
+    return {v for (v,) in db.session.query(VersionEsquema.version)}
+
+
+def migraciones_pendientes():
+    aplicadas = versiones_aplicadas()
+    return [m for m in _MIGRACIONES if m[0] not in aplicadas]
+
+
+def aplicar_migraciones(hasta=None):
+    """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas."""
+    es_postgres = db.engine.dialect.name == "postgresql"
+    # El lock se toma en una conexión propia para soltarlo en la misma
+    # En autocommit: no deja una transacción abierta durante las migraciones
+    # (CREATE INDEX CONCURRENTLY espera a las transacciones en curso)
+    with db.engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as conn_lock:
+        if es_postgres:
+            conn_lock.execute(db.text(f"SELECT pg_advisory_lock({_LOCK_MIGRACIONES})"))
+        try:
+            VersionEsquema.__table__.create(db.engine, checkfirst=True)
+            aplicadas = []
+            for version, descripcion, funcion in migraciones_pendientes():
+                if hasta is not None and version > hasta:
+                    break
+                funcion()
+                db.session.add(VersionEsquema(version=version, descripcion=descripcion))
+                db.session.commit()
+                aplicadas.append(version)
+            return aplicadas
+        finally:
+            if es_postgres:
+                conn_lock.execute(
+                    db.text(f"SELECT pg_advisory_unlock({_LOCK_MIGRACIONES})")
+                )
+
+
+@click.command("migrar")
+@click.option("--hasta", type=int, default=None, help="Última versión a aplicar")
+@click.option("--mostrar", is_flag=True, help="Solo listar migraciones pendientes")
+@with_appcontext
+def migrar_command(hasta, mostrar):
+    """Aplica las migraciones pendientes del esquema."""
+    if mostrar:
+        for version, descripcion, _ in migraciones_pendientes():
+            click.echo(f"Pendiente {version:04d}: {descripcion}")
+        return
+    aplicadas = aplicar_migraciones(hasta)
+    for version in aplicadas:
+        click.echo(f"Aplicada migración {version:04d}")
+    click.echo(f"Esquema al día ({len(aplicadas)} migraciones aplicadas).")
@@ -4,6 +4,7 @@ from database import db
 
 class CodigoInvitacion(db.Model):
     __tablename__ = "codigos_invitacion"
+    __table_args__ = (db.Index("ix_codigos_invitacion_creado", "creado", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(32), unique=True, nullable=False)
     creado = db.Column(db.DateTime, nullable=False)
@@ -32,6 +33,10 @@ class Empresa(db.Model):
     )  # Token JWT activo para control de sesión
     gmail_access_token = db.Column(db.Text, nullable=True)
     gmail_refresh_token = db.Column(db.Text, nullable=True)
+    # Se incrementa cada vez que cambian sus productos (ver catalogo.py)
+    catalogo_version = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -48,6 +53,11 @@ from sqlalchemy import LargeBinary
 # --- Modelo Producto ---
 class Producto(db.Model):
     __tablename__ = "productos"
+    __table_args__ = (
+        db.Index("ix_productos_empresa_id", "empresa_id", "id"),
+        db.Index("ix_productos_empresa_codigo", "empresa_id", "codigo"),
+        db.Index("ix_productos_empresa_nombre", "empresa_id", "nombre"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
     nombre = db.Column(db.String(100), nullable=False)
@@ -60,6 +70,17 @@ class Producto(db.Model):
 
 class Cotizacion(db.Model):
     __tablename__ = "cotizaciones"
+    __table_args__ = (
+        db.Index("ix_cotizaciones_empresa_id", "empresa_id", "id"),
+        # Mismo orden que usa la paginación por fecha (ver paginacion.py)
+        db.Index(
+            "ix_cotizaciones_empresa_fecha",
+            "empresa_id",
+            db.text("coalesce(fecha, '')"),
+            "id",
+        ),
+        db.Index("ix_cotizaciones_pdf_ref", "pdf_ref"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
@@ -77,18 +98,113 @@ class Cotizacion(db.Model):
     firma = db.Column(db.Text, nullable=True)  # Puede ser base64 o texto
     codigo_cotizacion = db.Column(db.String(30), nullable=False, unique=True)
     observaciones = db.Column(db.Text, nullable=True)
-    productos = db.Column(db.JSON, nullable=False)
+    # Legado: las líneas viven en cotizacion_items (ver la propiedad `productos`).
+    # La migración 4 las copia y deja aquí una lista vacía.
+    productos_json = db.deferred(
+        db.Column("productos", db.JSON, nullable=False, default=list)
+    )
     subtotal = db.Column(db.Float, nullable=True)
     descuento = db.Column(db.Float, nullable=True)
     iva = db.Column(db.Float, nullable=True)
     total = db.Column(db.Float, nullable=False)
     condiciones = db.Column(db.Text, nullable=True)
     estado_envio = db.Column(db.String(20), nullable=False)
-    archivo_pdf = db.Column(LargeBinary, nullable=False)
+    # Hash SHA-256 del PDF en el almacenamiento configurado (ver almacenamiento.py)
+    pdf_ref = db.Column(db.String(64), nullable=True)
+    pdf_tamano = db.Column(db.Integer, nullable=True)  # Bytes del PDF, para listados
+    # Huella de lo que se dibujó en el PDF (pdf_generator.huella_pdf): si no
+    # cambia, el PDF guardado sigue vigente y no se vuelve a renderizar
+    pdf_entrada = db.Column(db.String(64), nullable=True)
+    # Solo para cotizaciones anteriores a pdf_ref; `flask migrar-pdfs` lo vacía.
+    # Diferido: nunca se trae en listados ni detalles, solo si se accede.
+    archivo_pdf = db.deferred(db.Column(LargeBinary, nullable=True))
+    items = db.relationship(
+        "ItemCotizacion",
+        order_by="ItemCotizacion.posicion",
+        cascade="all, delete-orphan",
+        lazy=True,
+    )
+
+    @property
+    def productos(self):
+        """Las líneas con la misma forma que tenía el JSON original."""
+        return [item.a_dict() for item in self.items]
+
+    @productos.setter
+    def productos(self, productos):
+        self.items = [
+            ItemCotizacion(posicion=i, **ItemCotizacion.valores(p))
+            for i, p in enumerate(productos)
+        ]
+
+
+class ItemCotizacion(db.Model):
+    __tablename__ = "cotizacion_items"
+    __table_args__ = (
+        db.Index("ix_cotizacion_items_cotizacion", "cotizacion_id", "posicion"),
+        db.Index("ix_cotizacion_items_producto", "producto_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    cotizacion_id = db.Column(
+        db.Integer, db.ForeignKey("cotizaciones.id"), nullable=False
+    )
+    posicion = db.Column(db.Integer, nullable=False, default=0)
+    # Si el producto se elimina la línea conserva su copia de nombre y precio
+    producto_id = db.Column(
+        db.Integer, db.ForeignKey("productos.id", ondelete="SET NULL"), nullable=True
+    )
+    nombre = db.Column(db.String(100), nullable=False)
+    descripcion = db.Column(db.Text, nullable=True)
+    codigo = db.Column(db.String(50), nullable=True)
+    unidad = db.Column(db.String(30), nullable=True)
+    precio = db.Column(db.Float, nullable=False)  # Precio al momento de cotizar
+    cantidad = db.Column(db.Float, nullable=False, default=1)
+    descuento = db.Column(db.Float, nullable=False, default=0)  # Valor por línea
+    iva = db.Column(db.Float, nullable=False, default=0)  # Porcentaje por línea
+
+    @staticmethod
+    def valores(p):
+        """Columnas de la línea a partir de un producto en formato del API."""
+        return {
+            "producto_id": p.get("id"),
+            "nombre": p.get("nombre") or "",
+            "descripcion": p.get("descripcion"),
+            "codigo": p.get("codigo"),
+            "unidad": p.get("unidad"),
+            "precio": p.get("precio") or 0,
+            "cantidad": p.get("cantidad", 1),
+            "descuento": p.get("descuento") or 0,
+            "iva": p.get("iva") or 0,
+        }
+
+    def a_dict(self):
+        cantidad = self.cantidad
+        if float(cantidad).is_integer():
+            cantidad = int(cantidad)
+        return {
+            "id": self.producto_id,
+            "nombre": self.nombre,
+            "descripcion": self.descripcion,
+            "precio": self.precio,
+            "unidad": self.unidad,
+            "codigo": self.codigo,
+            "cantidad": cantidad,
+            "descuento": self.descuento,
+            "iva": self.iva,
+        }
+
+
+class BlobPDF(db.Model):
+    __tablename__ = "blobs_pdf"
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 del PDF original
+    datos = db.Column(LargeBinary, nullable=False)  # PDF comprimido con zlib
+    tamano = db.Column(db.Integer, nullable=False)  # Tamaño sin comprimir
+    creado = db.Column(db.DateTime, nullable=False, default=db.func.now())
 
 
 class LogActividad(db.Model):
     __tablename__ = "logs_actividad"
+    __table_args__ = (db.Index("ix_logs_actividad_fecha", "fecha"),)
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.DateTime, nullable=False, default=db.func.now())
     tipo = db.Column(
@@ -102,6 +218,7 @@ class LogActividad(db.Model):
 
 class Soporte(db.Model):
     __tablename__ = "soporte"
+    __table_args__ = (db.Index("ix_soporte_fecha", "fecha", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
     asunto = db.Column(db.String(200), nullable=False)
@@ -112,3 +229,96 @@ class Soporte(db.Model):
     )  # pendiente, respondido, cerrado
     respuesta = db.Column(db.Text, nullable=True)
     fecha_respuesta = db.Column(db.DateTime, nullable=True)
+
+
+class TrabajoCotizacion(db.Model):
+    __tablename__ = "trabajos_cotizacion"
+    __table_args__ = (db.Index("ix_trabajos_cotizacion_estado", "estado"),)
+    id = db.Column(db.Integer, primary_key=True)
+    cotizacion_id = db.Column(
+        db.Integer, db.ForeignKey("cotizaciones.id"), nullable=False
+    )
+    empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
+    estado = db.Column(
+        db.String(20), nullable=False, default="pendiente"
+    )  # pendiente, renderizando, enviando, completado, fallido
+    # Proceso que lo reclamó ("host:pid:arranque"), ver trabajos.propietario()
+    propietario = db.Column(db.String(120), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    actualizado = db.Column(
+        db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now()
+    )
+    cotizacion = db.relationship(
+        "Cotizacion",
+        backref=db.backref("trabajos", cascade="all, delete-orphan", lazy=True),
+    )
+
+
+class CorreoSalida(db.Model):
+    """Correo de cotización pendiente de envío (bandeja de salida con reintentos)."""
+
+    __tablename__ = "correos_salida"
+    __table_args__ = (
+        db.Index("ix_correos_salida_estado", "estado", "proximo_intento"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    cotizacion_id = db.Column(
+        db.Integer, db.ForeignKey("cotizaciones.id"), nullable=False
+    )
+    empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
+    destinatario = db.Column(db.String(100), nullable=False)
+    asunto = db.Column(db.String(200), nullable=False)
+    cuerpo = db.Column(db.Text, nullable=False)
+    estado = db.Column(
+        db.String(20), nullable=False, default="pendiente"
+    )  # pendiente, enviando, enviado, descartado
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    actualizado = db.Column(
+        db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now()
+    )
+    cotizacion = db.relationship(
+        "Cotizacion",
+        backref=db.backref("correos", cascade="all, delete-orphan", lazy=True),
+    )
+
+
+class TrabajoImportacion(db.Model):
+    """Carga masiva de productos procesada en segundo plano."""
+
+    __tablename__ = "trabajos_importacion"
+    __table_args__ = (
+        db.Index("ix_trabajos_importacion_empresa", "empresa_id", "estado"),
+        # Una sola carga en curso por empresa, aunque la reclamen dos procesos
+        db.Index(
+            "ux_trabajos_importacion_en_curso",
+            "empresa_id",
+            unique=True,
+            sqlite_where=db.text("estado = 'procesando'"),
+            postgresql_where=db.text("estado = 'procesando'"),
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey("empresas.id"), nullable=False)
+    estado = db.Column(
+        db.String(20), nullable=False, default="pendiente"
+    )  # pendiente, procesando, completado, fallido
+    modo = db.Column(db.String(20), nullable=False, default="insertar")
+    nombre_archivo = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    # El archivo subido; se borra al terminar
+    archivo = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    filas_procesadas = db.Column(db.Integer, nullable=False, default=0)
+    productos_creados = db.Column(db.Integer, nullable=False, default=0)
+    productos_actualizados = db.Column(db.Integer, nullable=False, default=0)
+    productos_con_errores = db.Column(db.Integer, nullable=False, default=0)
+    errores = db.Column(db.JSON, nullable=False, default=list)
+    resumen = db.deferred(db.Column(db.JSON, nullable=True))
+    error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    actualizado = db.Column(
+        db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now()
+    )
@@ -0,0 +1,109 @@
+"""
+Paginación por cursor (keyset) para los endpoints de listado.
+
+El cuerpo de la respuesta sigue siendo la lista de siempre; el cursor de la
+página siguiente viaja en el header X-Siguiente-Cursor (y en Link rel="next").
+Parámetros de query: `limite` (tamaño de página) y `cursor`. Sin ninguno de
+los dos la respuesta trae la lista completa, como antes de paginar, para no
+truncar a los clientes que no leen el cursor.
+"""
+
+import base64
+import json
+import os
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask import jsonify, request
+
+from database import db
+
+PAGINA_DEFECTO = int(os.getenv("PAGINA_DEFECTO", 50))
+PAGINA_MAX = int(os.getenv("PAGINA_MAX", 500))
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _codificar_cursor(valor, ultimo_id):
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    crudo = json.dumps([valor, ultimo_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor, es_fecha):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valor, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if es_fecha:
+            valor = datetime.fromisoformat(valor)
+        return valor, int(ultimo_id)
+    except (ValueError, TypeError):
+        raise CursorInvalido(cursor)
+
+
+def limite_pagina():
+    """Tamaño de página pedido, o None si la request no pagina."""
+    if "limite" not in request.args and "cursor" not in request.args:
+        return None
+    try:
+        limite = int(request.args.get("limite", PAGINA_DEFECTO))
+    except ValueError:
+        limite = PAGINA_DEFECTO
+    return max(1, min(limite, PAGINA_MAX))
+
+
+def paginar(query, columna_id, orden=None, descendente=False):
+    """
+    Aplica el cursor de la request a `query` ordenando por (orden, id) y
+    devuelve (filas, cursor_siguiente). Si `orden` se omite se ordena solo
+    por id; si es una columna de texto que admite nulos se compara con "".
+    """
+    limite = limite_pagina()
+    cursor = request.args.get("cursor")
+    es_fecha = orden is not None and isinstance(orden.type, db.DateTime)
+    atributo = orden
+    if orden is not None and orden.nullable and not es_fecha:
+        # Literal para que coincida con los índices sobre coalesce(columna, '')
+        orden = db.func.coalesce(orden, db.literal_column("''"))
+    if cursor:
+        valor, ultimo_id = _decodificar_cursor(cursor, es_fecha)
+        if orden is None:
+            filtro = columna_id < ultimo_id if descendente else columna_id > ultimo_id
+        elif descendente:
+            filtro = db.or_(
+                orden < valor, db.and_(orden == valor, columna_id < ultimo_id)
+            )
+        else:
+            filtro = db.or_(
+                orden > valor, db.and_(orden == valor, columna_id > ultimo_id)
+            )
+        query = query.filter(filtro)
+    columnas = [columna_id] if orden is None else [orden, columna_id]
+    query = query.order_by(*[c.desc() if descendente else c.asc() for c in columnas])
+    if limite is None:
+        return query.all(), None
+    filas = query.limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        valor = None
+        if atributo is not None:
+            valor = getattr(ultima, atributo.key)
+            if valor is None:
+                valor = ""
+        siguiente = _codificar_cursor(valor, getattr(ultima, columna_id.key))
+    return filas, siguiente
+
+
+def respuesta_paginada(items, siguiente):
+    response = jsonify(items)
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
+        args = request.args.to_dict()
+        args["cursor"] = siguiente
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
@@ -1,60 +1,94 @@
 from fpdf import FPDF
-from io import BytesIO
+from collections import OrderedDict
+import copy
+import hashlib
+import json
 import os
-import requests  # <-- Add this import
+import tempfile
+import threading
+import zlib
+from logo_cache import obtener_logo
+from precios import liquidar
 
+# --- Colores corporativos personalizados ---
+COLOR_PRIMARIO = (26, 35, 126)  # Azul oscuro
+COLOR_SECUNDARIO = (21, 101, 192)  # Azul medio
+COLOR_TEXTO = (33, 33, 33)  # Gris oscuro
+COLOR_TABLA_HEADER = (197, 225, 250)  # Azul claro
+COLOR_TABLA_ROW_ALT = (232, 240, 253)  # Muy claro
+COLOR_TABLA_ROW = (255, 255, 255)
+COLOR_BACKGROUND = (245, 249, 255)  # Azul muy claro para fondo
+
+# Membretes ya dibujados, por contenido del encabezado de la empresa
+MEMBRETE_CACHE_MAX = int(os.getenv("MEMBRETE_CACHE_MAX", 64))
+_membretes = OrderedDict()
+_membretes_lock = threading.Lock()
+
+# Desde cuántas líneas se usa escribir_pdf_grande, y de a cuántas se procesan
+PDF_LINEAS_GRANDE = int(os.getenv("PDF_LINEAS_GRANDE", 1000))
+PDF_LOTE_LINEAS = int(os.getenv("PDF_LOTE_LINEAS", 500))
+
+# PDFs ya renderizados, por huella de su entrada (ver huella_pdf)
+PDF_CACHE_MAX = int(os.getenv("PDF_CACHE_MAX", 32))
+_pdfs = OrderedDict()
+_pdfs_lock = threading.Lock()
+# Subirla cuando cambie el diseño: invalida las huellas guardadas
+VERSION_PDF = 2
+CAMPOS_ENCABEZADO = (
+    "codigo_cotizacion",
+    "cliente",
+    "correo",
+    "telefono",
+    "direccion",
+    "vendedor",
+    "fecha",
+    "validez",
+    "forma_pago",
+    "tiempo_entrega",
+    "estado_cotizacion",
+)
+CAMPOS_NOTAS = ("notas_legales", "observaciones", "condiciones", "firma")
+CAMPOS_TOTALES = ("subtotal", "descuento", "iva", "total")
+CAMPOS_EMPRESA = ("nombre", "nit", "direccion", "telefono", "email", "contacto")
+
+
+def _logo_local(logo_url):
+    """Devuelve (ruta, tipo) del logo a dibujar, o None si no hay logo."""
+    if logo_url:
+        if logo_url.startswith("http://") or logo_url.startswith("https://"):
+            # Usar la copia local del logo (se descarga solo la primera vez)
+            return obtener_logo(logo_url)
+        if os.path.exists(logo_url):
+            return logo_url, ""
+        return None
+    logo_path = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "logo.jpg")
+    )
+    if os.path.exists(logo_path):
+        return logo_path, ""
+    return None
 
-def generar_pdf(data, filename):
-    pdf = FPDF()
-    pdf.add_page()
-    # --- Colores corporativos personalizados ---
-    COLOR_PRIMARIO = (26, 35, 126)  # Azul oscuro
-    COLOR_SECUNDARIO = (21, 101, 192)  # Azul medio
-    COLOR_TEXTO = (33, 33, 33)  # Gris oscuro
-    COLOR_TABLA_HEADER = (197, 225, 250)  # Azul claro
-    COLOR_TABLA_ROW_ALT = (232, 240, 253)  # Muy claro
-    COLOR_TABLA_ROW = (255, 255, 255)
-    COLOR_BACKGROUND = (245, 249, 255)  # Azul muy claro para fondo
 
+def _dibujar_membrete(pdf, empresa, logo):
     # --- Fondo de página personalizado ---
     pdf.set_fill_color(*COLOR_BACKGROUND)
     pdf.rect(0, 0, 210, 297, "F")  # A4: 210x297mm
 
-    # Código de cotización
-    pdf.set_font("Arial", "B", 13)
-    pdf.set_text_color(*COLOR_PRIMARIO)
-    pdf.cell(0, 8, f"Código: {data.get('codigo_cotizacion', '')}", ln=True, align="R")
-    pdf.set_text_color(*COLOR_TEXTO)
-
     # --- DATOS DE EMPRESA DINÁMICOS ---
-    empresa = data.get("empresa", {})
     nombre_empresa = empresa.get("nombre", "EMPRESA")
     nit = empresa.get("nit", "")
     direccion = empresa.get("direccion", "")
     telefono = empresa.get("telefono", "")
     contacto = empresa.get("contacto", "")
-    logo_url = empresa.get("logo_url")
     email_empresa = empresa.get("email", "")
 
     # Logo (si hay url o ruta)
-    if logo_url:
+    if logo:
         try:
-            if logo_url.startswith("http://") or logo_url.startswith("https://"):
-                # Download remote image and embed
-                response = requests.get(logo_url)
-                if response.status_code == 200:
-                    img_stream = BytesIO(response.content)
-                    pdf.image(img_stream, x=10, y=8, w=35, type="PNG")
-            elif os.path.exists(logo_url):
-                pdf.image(logo_url, x=10, y=8, w=35)
+            ruta_logo, tipo_logo = logo
+            pdf.image(ruta_logo, x=10, y=8, w=35, type=tipo_logo)
         except Exception:
             pass
-    else:
-        logo_path = os.path.abspath(
-            os.path.join(os.path.dirname(__file__), "..", "logo.jpg")
-        )
-        if os.path.exists(logo_path):
-            pdf.image(logo_path, x=10, y=8, w=35)
 
     # Nombre de la empresa y datos
     pdf.set_xy(50, 10)
@@ -94,32 +128,103 @@ def generar_pdf(data, filename):
     pdf.set_text_color(*COLOR_TEXTO)
     pdf.ln(2)
 
+
+def _clonar(plantilla):
+    pdf = copy.copy(plantilla)
+    for nombre, valor in vars(plantilla).items():
+        if isinstance(valor, (dict, list)):
+            setattr(pdf, nombre, copy.copy(valor))
+    # FPDF anota en cada fuente e imagen su número de objeto al serializar,
+    # así que cada documento necesita sus propias copias
+    pdf.fonts = {k: dict(v) for k, v in plantilla.fonts.items()}
+    pdf.images = {k: dict(v) for k, v in plantilla.images.items()}
+    for k, v in plantilla.fonts.items():
+        if plantilla.current_font is v:
+            pdf.current_font = pdf.fonts[k]
+    return pdf
+
+
+def _plantilla_membrete(empresa):
+    """
+    Devuelve un FPDF con la primera página y el membrete de la empresa ya
+    dibujados. Se reconstruye cuando cambia algún campo del encabezado o el
+    archivo del logo.
+    """
+    logo = _logo_local(empresa.get("logo_url"))
+    logo_mtime = None
+    if logo:
+        try:
+            logo_mtime = os.path.getmtime(logo[0])
+        except OSError:
+            pass
+    clave = (
+        tuple(
+            empresa.get(k)
+            for k in ("nombre", "nit", "direccion", "telefono", "email", "contacto")
+        ),
+        logo,
+        logo_mtime,
+    )
+    with _membretes_lock:
+        plantilla = _membretes.get(clave)
+        if plantilla is not None:
+            _membretes.move_to_end(clave)
+            return plantilla
+    plantilla = FPDF()
+    plantilla.add_page()
+    _dibujar_membrete(plantilla, empresa, logo)
+    with _membretes_lock:
+        _membretes[clave] = plantilla
+        while len(_membretes) > MEMBRETE_CACHE_MAX:
+            _membretes.popitem(last=False)
+    return plantilla
+
+
+def _datos_cliente(pdf, data):
+    # Código de cotización
+    y_contenido = pdf.get_y()
+    pdf.set_xy(pdf.l_margin, pdf.t_margin)
+    pdf.set_font("Arial", "B", 13)
+    pdf.set_text_color(*COLOR_PRIMARIO)
+    pdf.cell(0, 8, f"Código: {data.get('codigo_cotizacion') or ''}", ln=True, align="R")
+    pdf.set_text_color(*COLOR_TEXTO)
+    pdf.set_y(y_contenido)
+
     # Recuadro datos del cliente con más información
     pdf.set_fill_color(232, 240, 253)  # Color muy claro corporativo
     pdf.set_draw_color(*COLOR_SECUNDARIO)
     pdf.set_font("Arial", "", 12)
-    pdf.cell(95, 8, f"Cliente: {data.get('cliente','')}", border="LT", fill=True)
-    pdf.cell(95, 8, f"Correo: {data.get('correo','')}", border="TR", fill=True, ln=True)
-    pdf.cell(95, 8, f"Teléfono: {data.get('telefono','')}", border="L", fill=True)
+    pdf.cell(95, 8, f"Cliente: {data.get('cliente') or ''}", border="LT", fill=True)
+    pdf.cell(
+        95, 8, f"Correo: {data.get('correo') or ''}", border="TR", fill=True, ln=True
+    )
+    pdf.cell(95, 8, f"Teléfono: {data.get('telefono') or ''}", border="L", fill=True)
     pdf.cell(
-        95, 8, f"Dirección: {data.get('direccion','')}", border="R", fill=True, ln=True
+        95,
+        8,
+        f"Dirección: {data.get('direccion') or ''}",
+        border="R",
+        fill=True,
+        ln=True,
     )
-    pdf.cell(95, 8, f"Vendedor: {data.get('vendedor','')}", border="L", fill=True)
-    pdf.cell(95, 8, f"Fecha: {data.get('fecha','')}", border="R", fill=True, ln=True)
-    pdf.cell(95, 8, f"Validez: {data.get('validez','')}", border="L", fill=True)
+    pdf.cell(95, 8, f"Vendedor: {data.get('vendedor') or ''}", border="L", fill=True)
+    pdf.cell(95, 8, f"Fecha: {data.get('fecha') or ''}", border="R", fill=True, ln=True)
+    pdf.cell(95, 8, f"Validez: {data.get('validez') or ''}", border="L", fill=True)
     pdf.cell(
         95,
         8,
-        f"Forma de pago: {data.get('forma_pago','')}",
+        f"Forma de pago: {data.get('forma_pago') or ''}",
         border="R",
         fill=True,
         ln=True,
     )
-    pdf.cell(95, 8, f"Entrega: {data.get('tiempo_entrega','')}", border="L", fill=True)
+    pdf.cell(
+        95, 8, f"Entrega: {data.get('tiempo_entrega') or ''}", border="L", fill=True
+    )
     pdf.cell(
         95,
         8,
-        f"Estado: {data.get('estado_cotizacion','')}",
+        f"Estado: {data.get('estado_cotizacion') or ''}",
         border="R",
         fill=True,
         ln=True,
@@ -127,7 +232,8 @@ def generar_pdf(data, filename):
     pdf.cell(190, 0, "", border="LBR", ln=True)
     pdf.ln(6)
 
-    # Tabla de productos con filas alternas y descuento por producto
+
+def _encabezado_tabla(pdf):
     pdf.set_font("Arial", "B", 12)
     pdf.set_fill_color(*COLOR_TABLA_HEADER)
     pdf.set_text_color(*COLOR_PRIMARIO)
@@ -139,28 +245,41 @@ def generar_pdf(data, filename):
     pdf.cell(30, 10, "Subtotal", border=1, fill=True, align="C")
     pdf.ln()
 
+
+def _pesos(valor):
+    """Importe en pesos: sin decimales si es entero, con centavos si no."""
+    if valor == int(valor):
+        return f"${valor:,.0f}"
+    return f"${valor:,.2f}"
+
+
+def _filas(pdf, productos, totales, inicio=0):
+    """Filas de la tabla; `inicio` es la posición de la primera, para alternar colores."""
     pdf.set_font("Arial", "", 12)
     pdf.set_text_color(*COLOR_TEXTO)
-    fill = False
-    for p in data["productos"]:
-        subtotal = p["cantidad"] * p["precio"]
-        desc = p.get("descuento", 0)
-        iva_prod = p.get("iva", 0)
-        subtotal_desc = subtotal - desc
-        subtotal_iva = subtotal_desc + (subtotal_desc * iva_prod / 100)
+    fill = inicio % 2 == 1
+    for p, total_linea in zip(productos, totales):
+        # Mismos tipos que las columnas de cotizacion_items, para que el PDF
+        # salga igual al crear la cotización que al regenerarlo desde la base
+        cantidad = float(p["cantidad"])
+        precio = float(p["precio"])
+        desc = float(p.get("descuento") or 0)
+        iva_prod = float(p.get("iva") or 0)
         if fill:
             pdf.set_fill_color(*COLOR_TABLA_ROW_ALT)
         else:
             pdf.set_fill_color(*COLOR_TABLA_ROW)
         pdf.cell(50, 10, str(p["nombre"]), border=1, fill=True)
-        pdf.cell(20, 10, str(p["cantidad"]), border=1, align="C", fill=True)
-        pdf.cell(30, 10, f"${p['precio']:,}", border=1, align="R", fill=True)
-        pdf.cell(30, 10, f"${desc:,}", border=1, align="R", fill=True)
+        pdf.cell(20, 10, f"{cantidad:.10g}", border=1, align="C", fill=True)
+        pdf.cell(30, 10, _pesos(precio), border=1, align="R", fill=True)
+        pdf.cell(30, 10, _pesos(desc), border=1, align="R", fill=True)
         pdf.cell(30, 10, f"{iva_prod}%", border=1, align="C", fill=True)
-        pdf.cell(30, 10, f"${subtotal_iva:,.0f}", border=1, align="R", fill=True)
+        pdf.cell(30, 10, f"${total_linea:,.0f}", border=1, align="R", fill=True)
         pdf.ln()
         fill = not fill
 
+
+def _cierre(pdf, data):
     # Resumen de totales
     pdf.ln(5)
     pdf.set_font("Arial", "", 12)
@@ -168,6 +287,10 @@ def generar_pdf(data, filename):
     pdf.cell(30, 8, f"${data.get('subtotal', 0):,.0f}", align="R", ln=True)
     pdf.cell(160, 8, "Descuento:", align="R")
     pdf.cell(30, 8, f"${data.get('descuento', 0):,.0f}", align="R", ln=True)
+    iva_lineas = _iva_lineas(data)
+    if iva_lineas:
+        pdf.cell(160, 8, "IVA de los productos:", align="R")
+        pdf.cell(30, 8, f"${iva_lineas:,.0f}", align="R", ln=True)
     pdf.cell(160, 8, "IVA:", align="R")
     pdf.cell(30, 8, f"${data.get('iva', 0):,.0f}%", align="R", ln=True)
     pdf.set_font("Arial", "B", 13)
@@ -228,8 +351,236 @@ def generar_pdf(data, filename):
     pdf.cell(0, 10, "Gracias por su interés. Para dudas, contáctenos.", 0, 0, "C")
     pdf.set_text_color(*COLOR_TEXTO)
 
+
+def _totales_lineas(data, inicio=0, fin=None):
+    # Totales por línea de precios.py; si quien llama ya liquidó la cotización
+    # los pasa en `totales_lineas` y no se vuelven a calcular
+    productos = data["productos"]
+    totales = data.get("totales_lineas")
+    if totales is None or len(totales) != len(productos):
+        return liquidar(productos[inicio:fin])["lineas"]
+    return totales[inicio:fin]
+
+
+def _iva_lineas(data):
+    # Como los totales por línea: lo trae quien ya liquidó o se calcula aquí
+    iva_lineas = data.get("iva_lineas")
+    if iva_lineas is None:
+        return liquidar(data["productos"])["iva_lineas"]
+    return iva_lineas
+
+
+def generar_pdf(data):
+    if len(data["productos"]) > PDF_LINEAS_GRANDE:
+        with tempfile.TemporaryFile() as archivo:
+            escribir_pdf_grande(data, archivo)
+            archivo.seek(0)
+            return archivo.read(), data.get("total", 0)
+    pdf = _clonar(_plantilla_membrete(data.get("empresa", {})))
+    _datos_cliente(pdf, data)
+
+    # Tabla de productos con filas alternas y descuento por producto
+    _encabezado_tabla(pdf)
+    _filas(pdf, data["productos"], _totales_lineas(data))
+    _cierre(pdf, data)
+
     pdf_bytes = pdf.output(dest="S").encode("latin1")
-    ruta = os.path.join("cotizador_api", "cotizaciones", filename)
-    os.makedirs(os.path.dirname(ruta), exist_ok=True)
-    pdf.output(ruta)
     return pdf_bytes, data.get("total", 0)
+
+
+def escribir_pdf_grande(data, archivo):
+    """
+    Escribe en `archivo` (binario) el PDF de una cotización con muchas líneas.
+    Cada página se comprime y se escribe apenas se llena, las líneas se
+    procesan por lotes y el encabezado de la tabla se repite en cada página,
+    así que la memoria no crece con la cantidad de líneas.
+    """
+    empresa = data.get("empresa", {})
+    pdf = _PDFPorPaginas(archivo)
+    pdf.add_page()
+    _dibujar_membrete(pdf, empresa, _logo_local(empresa.get("logo_url")))
+    _datos_cliente(pdf, data)
+    _encabezado_tabla(pdf)
+    pdf.repetir_encabezado = True
+    productos = data["productos"]
+    for inicio in range(0, len(productos), PDF_LOTE_LINEAS):
+        fin = inicio + PDF_LOTE_LINEAS
+        _filas(pdf, productos[inicio:fin], _totales_lineas(data, inicio, fin), inicio)
+    pdf.repetir_encabezado = False
+    _cierre(pdf, data)
+    pdf.close()
+
+
+class _PDFPorPaginas(FPDF):
+    """
+    FPDF que escribe cada página terminada en un archivo en vez de acumular
+    el documento en memoria hasta output(). Los objetos quedan con la misma
+    numeración que usa FPDF: páginas desde el 3, luego fuentes e imágenes.
+    Solo cubre lo que usa este módulo (sin alias de número de páginas,
+    enlaces ni cambios de orientación).
+    """
+
+    def __init__(self, archivo):
+        super().__init__()
+        self.repetir_encabezado = False
+        self._archivo = archivo
+        self._posicion = 0
+        self._contenido = []
+        self._out("%PDF-" + self.pdf_version)
+
+    def header(self):
+        if self.page == 1:
+            return  # El membrete ya trae el fondo
+        self.set_fill_color(*COLOR_BACKGROUND)
+        self.rect(0, 0, 210, 297, "F")
+        if self.repetir_encabezado:
+            _encabezado_tabla(self)
+
+    def _out(self, s):
+        if isinstance(s, bytes):
+            datos = s
+        else:
+            datos = str(s).encode("latin1")
+        if self.state == 2:
+            self._contenido.append(datos)
+        else:
+            self._archivo.write(datos + b"\n")
+            self._posicion += len(datos) + 1
+
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self._posicion
+        self._out(f"{self.n} 0 obj")
+
+    def _beginpage(self, orientation):
+        super()._beginpage(orientation)
+        self._contenido = []
+
+    def _endpage(self):
+        super()._endpage()
+        contenido = b"\n".join(self._contenido) + b"\n"
+        self._contenido = []
+        self._newobj()
+        self._out("<</Type /Page")
+        self._out("/Parent 1 0 R")
+        self._out("/Resources 2 0 R")
+        if self.pdf_version > "1.3":
+            self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+        self._out(f"/Contents {self.n + 1} 0 R>>")
+        self._out("endobj")
+        filtro = ""
+        if self.compress:
+            filtro = "/Filter /FlateDecode "
+            contenido = zlib.compress(contenido)
+        self._newobj()
+        self._out(f"<<{filtro}/Length {len(contenido)}>>")
+        self._putstream(contenido)
+        self._out("endobj")
+
+    def _putresources(self):
+        self._putfonts()
+        self._putimages()
+        self.offsets[2] = self._posicion
+        self._out("2 0 obj")
+        self._out("<<")
+        self._putresourcedict()
+        self._out(">>")
+        self._out("endobj")
+
+    def _enddoc(self):
+        # Las páginas ya están escritas: falta la raíz que las agrupa
+        self.offsets[1] = self._posicion
+        self._out("1 0 obj")
+        self._out("<</Type /Pages")
+        self._out(
+            "/Kids [" + "".join(f"{3 + 2 * i} 0 R " for i in range(self.page)) + "]"
+        )
+        self._out(f"/Count {self.page}")
+        self._out(f"/MediaBox [0 0 {self.fw_pt:.2f} {self.fh_pt:.2f}]")
+        self._out(">>")
+        self._out("endobj")
+        self._putresources()
+        self._newobj()
+        self._out("<<")
+        self._putinfo()
+        self._out(">>")
+        self._out("endobj")
+        self._newobj()
+        self._out("<<")
+        self._putcatalog()
+        self._out(">>")
+        self._out("endobj")
+        inicio_xref = self._posicion
+        self._out("xref")
+        self._out(f"0 {self.n + 1}")
+        self._out("0000000000 65535 f ")
+        for i in range(1, self.n + 1):
+            self._out(f"{self.offsets[i]:010d} 00000 n ")
+        self._out("trailer")
+        self._out("<<")
+        self._puttrailer()
+        self._out(">>")
+        self._out("startxref")
+        self._out(inicio_xref)
+        self._out("%%EOF")
+        self.state = 3
+
+
+def entrada_canonica(data):
+    """
+    Solo lo que generar_pdf dibuja de `data` (y del membrete), normalizado como
+    lo dibuja: dos entradas con la misma forma canónica dan el mismo PDF.
+    """
+    empresa = data.get("empresa") or {}
+    return {
+        "version": VERSION_PDF,
+        "encabezado": [str(data.get(k) or "") for k in CAMPOS_ENCABEZADO],
+        "notas": [data.get(k) or "" for k in CAMPOS_NOTAS],
+        "totales": [float(data.get(k) or 0) for k in CAMPOS_TOTALES],
+        "empresa": [empresa.get(k) or "" for k in CAMPOS_EMPRESA],
+        "logo_url": empresa.get("logo_url") or "",
+        "productos": [
+            [
+                str(p["nombre"]),
+                float(p["cantidad"]),
+                float(p["precio"]),
+                float(p.get("descuento") or 0),
+                float(p.get("iva") or 0),
+            ]
+            for p in data["productos"]
+        ],
+    }
+
+
+def huella_pdf(data):
+    """SHA-256 de la entrada canónica del render; se guarda junto al PDF."""
+    texto = json.dumps(
+        entrada_canonica(data), ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def pdf_cacheado(huella):
+    """Bytes de un render anterior con la misma huella, o None."""
+    with _pdfs_lock:
+        pdf_bytes = _pdfs.get(huella)
+        if pdf_bytes is not None:
+            _pdfs.move_to_end(huella)
+        return pdf_bytes
+
+
+def cachear_pdf(huella, pdf_bytes):
+    with _pdfs_lock:
+        _pdfs[huella] = pdf_bytes
+        while len(_pdfs) > PDF_CACHE_MAX:
+            _pdfs.popitem(last=False)
+
+
+def renderizar(data, huella=None):
+    """(pdf_bytes, huella) de `data`, reutilizando el render si ya se hizo."""
+    huella = huella or huella_pdf(data)
+    pdf_bytes = pdf_cacheado(huella)
+    if pdf_bytes is None:
+        pdf_bytes, _ = generar_pdf(data)
+        cachear_pdf(huella, pdf_bytes)
+    return pdf_bytes, huella
@@ -0,0 +1,118 @@
+"""
+Liquidación de precios de las cotizaciones.
+
+Un único cálculo para el controlador y el PDF. El neto de cada línea es
+cantidad × precio − descuento (valor) y su IVA es un porcentaje de ese neto.
+El subtotal es la suma de los netos, antes de impuestos; sobre él se aplican
+el descuento y el IVA generales, y el IVA de las líneas se suma aparte, así
+que ningún IVA se cobra sobre otro.
+
+Las cuentas se hacen con arreglos de NumPy en enteros: importes en centavos,
+cantidades en milésimas e IVA en centésimas de punto. Los valores se
+convierten con Decimal al entrar (así 1.005 es 1.005 y no 1.00499…) y cada
+redondeo es a centavo, mitad hacia arriba. Como el resultado es exacto, lo
+que se guarda en la base y lo que imprime el PDF coinciden siempre.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import numpy as np
+
+_CENTAVOS = 100
+_MILESIMAS = 1000
+_CENTESIMAS = 100
+# Por encima de esto los productos intermedios ya no caben en int64
+_MAXIMO = 2**62
+# Hasta aquí un flotante escalado queda a menos de _VENTANA del valor decimal
+_EXACTO = 2**40
+_VENTANA = 1e-3
+
+
+def _entero(valor, escala):
+    try:
+        decimal = Decimal(str(valor))
+    except InvalidOperation:
+        raise ValueError(f"Valor numérico inválido: {valor!r}") from None
+    if not decimal.is_finite():
+        raise ValueError(f"Valor numérico inválido: {valor!r}")
+    entero = int((decimal * escala).to_integral_value(ROUND_HALF_UP))
+    if abs(entero) >= _MAXIMO:
+        raise ValueError("Importe fuera de rango")
+    return entero
+
+
+def _enteros(valores, escala):
+    """Convierte `valores` a enteros en la escala dada, redondeando mitad arriba."""
+    valores = [v or 0 for v in valores]
+    try:
+        escalados = np.asarray(valores, dtype=float) * escala
+    except (TypeError, ValueError):
+        return np.fromiter((_entero(v, escala) for v in valores), dtype=np.int64)
+    absolutos = np.abs(escalados)
+    # En flotante el error es menor a _VENTANA salvo en importes enormes; solo
+    # los valores cerca de la mitad (o no finitos) se redondean con Decimal
+    dudosos = ~(absolutos < _EXACTO) | (np.abs(absolutos % 1 - 0.5) < _VENTANA)
+    enteros = np.where(
+        dudosos, 0, np.copysign(np.floor(absolutos + 0.5), escalados)
+    ).astype(np.int64)
+    for i in np.flatnonzero(dudosos):
+        enteros[i] = _entero(valores[i], escala)
+    return enteros
+
+
+def _dividir(numerador, divisor):
+    """División entera redondeando mitad alejándose de cero (como ROUND_HALF_UP)."""
+    return np.sign(numerador) * ((np.abs(numerador) * 2 + divisor) // (divisor * 2))
+
+
+def _revisar(arreglo):
+    if arreglo.size and np.abs(arreglo).max() >= _MAXIMO:
+        raise ValueError("Importe fuera de rango")
+
+
+def _pesos(centavos):
+    return int(centavos) / _CENTAVOS
+
+
+def _netos_e_iva(productos):
+    """Centavos (int64) del neto y del IVA de cada línea, en el mismo orden."""
+    precio = _enteros((p["precio"] for p in productos), _CENTAVOS)
+    cantidad = _enteros((p.get("cantidad", 1) for p in productos), _MILESIMAS)
+    descuento = _enteros((p.get("descuento") for p in productos), _CENTAVOS)
+    iva = _enteros((p.get("iva") for p in productos), _CENTESIMAS)
+    # Se acota en flotante antes de multiplicar en enteros
+    _revisar(cantidad.astype(float) * precio)
+    neto = _dividir(cantidad * precio, _MILESIMAS) - descuento
+    _revisar(neto.astype(float) * iva)
+    return neto, _dividir(neto * iva, 100 * _CENTESIMAS)
+
+
+def totales_lineas(productos):
+    """Centavos (int64) del total con IVA de cada línea, en el mismo orden."""
+    neto, impuesto = _netos_e_iva(productos)
+    return neto + impuesto
+
+
+def liquidar(productos, descuento=0, iva=0):
+    """
+    Precios de una cotización. Devuelve un dict con `lineas` (total con IVA de
+    cada línea, en pesos), `subtotal` (suma de los netos), `iva_lineas` (suma
+    del IVA de las líneas), `descuento`, `iva` y `total`.
+    """
+    neto, impuesto = _netos_e_iva(productos)
+    subtotal = int(neto.sum())
+    iva_lineas = int(impuesto.sum())
+    descuento_general = _entero(descuento, _CENTAVOS)
+    iva_general = _entero(iva, _CENTESIMAS)
+    total = subtotal - descuento_general
+    if iva_general > 0:
+        total += int(_dividir(np.int64(total) * iva_general, 100 * _CENTESIMAS))
+    total += iva_lineas
+    return {
+        "lineas": ((neto + impuesto) / _CENTAVOS).tolist(),
+        "subtotal": _pesos(subtotal),
+        "iva_lineas": _pesos(iva_lineas),
+        "descuento": _pesos(descuento_general),
+        "iva": iva_general / _CENTESIMAS,
+        "total": _pesos(total),
+    }
@@ -0,0 +1,198 @@
+"""
+Validación de sesiones con caché en memoria.
+
+token_required y admin_required validan el JWT en cada request. Para no ir a
+la base de datos cada vez, el resultado se guarda por token durante
+SESION_CACHE_TTL segundos. Cuando login rota token_activo o logout lo borra,
+el token anterior se invalida en este proceso y se publica en un canal para
+que los demás workers también lo descarten:
+
+- Sin configuración se usa CanalLocal, que solo avisa dentro del proceso
+  (en otros workers la sesión vieja expira a lo sumo en SESION_CACHE_TTL).
+- Con SESION_CANAL_URL (redis://...) se usa Redis pub/sub; requiere el
+  paquete `redis`.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from flask import current_app, request
+
+from database import db
+from models import Empresa
+
+SESION_CACHE_TTL = float(os.getenv("SESION_CACHE_TTL", 30))
+SESION_CACHE_MAX = int(os.getenv("SESION_CACHE_MAX", 10000))
+SESION_CANAL_URL = os.getenv("SESION_CANAL_URL")
+SESION_CANAL_NOMBRE = os.getenv("SESION_CANAL_NOMBRE", "sesiones-invalidadas")
+
+_cache = OrderedDict()  # sha256(token) -> {"expira", "claims", "activa"}
+_lock = threading.Lock()
+# Aumenta con cada invalidación: evita guardar una validación que empezó antes
+_generacion = 0
+
+
+class SesionInvalida(Exception):
+    pass
+
+
+class CanalLocal:
+    """Canal de invalidación dentro del proceso; sustituto local de Redis."""
+
+    def __init__(self):
+        self._suscriptores = []
+
+    def publicar(self, clave):
+        for callback in self._suscriptores:
+            callback(clave)
+
+    def suscribir(self, callback):
+        self._suscriptores.append(callback)
+
+
+class CanalRedis:
+    """Canal de invalidación compartido entre workers con Redis pub/sub."""
+
+    def __init__(self, url, nombre):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._nombre = nombre
+
+    def publicar(self, clave):
+        self._redis.publish(self._nombre, clave)
+
+    def suscribir(self, callback):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(
+            **{self._nombre: lambda mensaje: callback(mensaje["data"].decode())}
+        )
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def _clave(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _descartar(clave):
+    global _generacion
+    with _lock:
+        _generacion += 1
+        _cache.pop(clave, None)
+
+
+_canal = None
+_canal_lock = threading.Lock()
+
+
+def canal_sesiones():
+    """Devuelve el canal de invalidación configurado, suscrito a la caché local."""
+    global _canal
+    with _canal_lock:
+        if _canal is None:
+            if SESION_CANAL_URL:
+                canal = CanalRedis(SESION_CANAL_URL, SESION_CANAL_NOMBRE)
+            else:
+                canal = CanalLocal()
+            canal.suscribir(_descartar)
+            _canal = canal
+    return _canal
+
+
+def _buscar(clave):
+    with _lock:
+        entrada = _cache.get(clave)
+        if not entrada:
+            return None
+        if entrada["expira"] < time.monotonic():
+            del _cache[clave]
+            return None
+        _cache.move_to_end(clave)
+        return entrada
+
+
+def _guardar(clave, entrada, generacion):
+    with _lock:
+        if generacion != _generacion:
+            return
+        entrada["expira"] = time.monotonic() + SESION_CACHE_TTL
+        _cache[clave] = entrada
+        _cache.move_to_end(clave)
+        while len(_cache) > SESION_CACHE_MAX:
+            _cache.popitem(last=False)
+
+
+def token_de_request():
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header.split(" ")[1]
+    return None
+
+
+def decodificar_token(token):
+    """Devuelve los claims del JWT; lanza las excepciones de PyJWT si no es válido."""
+    clave = _clave(token)
+    entrada = _buscar(clave)
+    if entrada:
+        return entrada["claims"]
+    generacion = _generacion
+    claims = jwt.decode(token, current_app.config["SECRET_KEY"], algorithms=["HS256"])
+    _guardar(clave, {"claims": claims, "activa": False}, generacion)
+    return claims
+
+
+def empresa_de_token(token):
+    """
+    Devuelve el id de la empresa si `token` es su sesión activa. Solo consulta
+    token_activo (no la fila completa) y solo cuando no está en caché.
+    """
+    clave = _clave(token)
+    entrada = _buscar(clave)
+    if entrada and entrada["activa"]:
+        return entrada["claims"]["empresa_id"]
+    generacion = _generacion
+    claims = decodificar_token(token)
+    empresa_id = claims["empresa_id"]
+    fila = db.session.query(Empresa.token_activo).filter_by(id=empresa_id).first()
+    if not fila:
+        raise SesionInvalida("Empresa no encontrada")
+    # Validar que el token coincida con el token_activo de la empresa
+    if not fila.token_activo or fila.token_activo != token:
+        raise SesionInvalida("Token inválido o sesión cerrada")
+    _guardar(clave, {"claims": claims, "activa": True}, generacion)
+    return empresa_id
+
+
+def invalidar_sesion(token):
+    """Descarta `token` de la caché de todos los workers (llamar tras el commit)."""
+    if token:
+        canal_sesiones().publicar(_clave(token))
+
+
+class EmpresaSesion:
+    """
+    La empresa autenticada que reciben los endpoints. `id` está disponible sin
+    consultar la base; la fila completa se carga solo al usar otro atributo.
+    """
+
+    def __init__(self, empresa_id):
+        object.__setattr__(self, "id", empresa_id)
+        object.__setattr__(self, "_empresa", None)
+
+    def _cargar(self):
+        if self._empresa is None:
+            empresa = db.session.get(Empresa, self.id)
+            if empresa is None:
+                raise SesionInvalida("Empresa no encontrada")
+            object.__setattr__(self, "_empresa", empresa)
+        return self._empresa
+
+    def __getattr__(self, nombre):
+        return getattr(self._cargar(), nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._cargar(), nombre, valor)
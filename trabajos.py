@@ -0,0 +1,376 @@
+"""
+Procesamiento asíncrono de cotizaciones.
+
+El request solo guarda la cotización y un TrabajoCotizacion en estado
+"pendiente"; un pool de hilos toma el trabajo, delega el render del PDF a un
+pool de procesos y luego envía el correo. No requiere broker externo: el
+estado vive en la base de datos y los pools son locales al proceso.
+
+Cada trabajo en curso guarda qué proceso lo reclamó (propietario) y ese
+proceso renueva `actualizado` periódicamente. Una revisión periódica devuelve
+a "pendiente" los trabajos cuyo dueño murió o dejó de renovarlos; el envío del
+correo pasa siempre por la bandeja de salida, así que un trabajo abandonado
+en "enviando" no se reenvía por su cuenta: su correo lo reintenta la bandeja.
+"""
+
+import os
+import secrets
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from almacenamiento import guardar_pdf, obtener_pdf
+from bandeja_salida import correo_activo, enviar_correo, nuevo_correo
+from database import db
+from models import Cotizacion, TrabajoCotizacion
+from pdf_generator import cachear_pdf, generar_pdf, huella_pdf, pdf_cacheado
+
+TRABAJOS_PROCESOS = int(os.getenv("TRABAJOS_PROCESOS", os.cpu_count() or 1))
+TRABAJOS_HILOS = int(os.getenv("TRABAJOS_HILOS", 4))
+# Segundos sin renovar un trabajo en "renderizando" o "enviando" tras los que
+# se da por abandonado (su proceso murió o quedó colgado) y se reanuda
+TRABAJOS_BLOQUEO = float(os.getenv("TRABAJOS_BLOQUEO", 600))
+# Segundos entre revisiones: renovación de los trabajos propios, reclamo de
+# los abandonados y encolado de los pendientes
+TRABAJOS_INTERVALO = float(os.getenv("TRABAJOS_INTERVALO", 30))
+# Máximo de cotizaciones por POST /cotizacion/lote
+COTIZACION_LOTE_MAX = int(os.getenv("COTIZACION_LOTE_MAX", 500))
+
+_procesos = None
+_hilos = None
+_lock = threading.Lock()
+_encolados = set()  # ids en cola o en curso en este proceso
+_propietario = None  # (pid, "host:pid:arranque")
+_revision = None
+_pid_contexto = None
+
+
+def propietario():
+    """
+    Identifica a este proceso en los trabajos que reclama. El id de arranque
+    distingue a un proceso nuevo que reutiliza el pid (p. ej. el PID 1 de un
+    contenedor reiniciado).
+    """
+    global _propietario
+    pid = os.getpid()
+    if _propietario is None or _propietario[0] != pid:
+        _propietario = (pid, f"{socket.gethostname()}:{pid}:{secrets.token_hex(4)}")
+    return _propietario[1]
+
+
+def _murio(dueno):
+    """Si el proceso `dueno` ya no existe; solo se sabe para los de este host."""
+    host, pid, _ = dueno.rsplit(":", 2)
+    if os.name != "posix" or host != socket.gethostname():
+        return False
+    if dueno == propietario():
+        return False
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def _pools():
+    global _procesos, _hilos
+    with _lock:
+        if _hilos is None:
+            _procesos = ProcessPoolExecutor(max_workers=TRABAJOS_PROCESOS)
+            _hilos = ThreadPoolExecutor(
+                max_workers=TRABAJOS_HILOS, thread_name_prefix="trabajo"
+            )
+    return _procesos, _hilos
+
+
+def _reemplazar_procesos(roto):
+    """Cambia el pool de procesos si sigue siendo `roto` (murió un worker)."""
+    global _procesos
+    with _lock:
+        if _procesos is roto:
+            _procesos = ProcessPoolExecutor(max_workers=TRABAJOS_PROCESOS)
+            roto.shutdown(wait=False)
+        return _procesos
+
+
+def _enviar(fn, *args):
+    """
+    Envía `fn` al pool de procesos; devuelve (pool, future). Si el pool quedó
+    roto (un worker murió por OOM o un segfault) lo reemplaza y reintenta una
+    vez, en vez de fallar hasta reiniciar el proceso.
+    """
+    procesos, _ = _pools()
+    try:
+        return procesos, procesos.submit(fn, *args)
+    except BrokenProcessPool:
+        procesos = _reemplazar_procesos(procesos)
+        return procesos, procesos.submit(fn, *args)
+
+
+def _esperar(procesos, futuro, fn, *args):
+    """Resultado de `futuro`; si su worker murió, un reintento en un pool nuevo."""
+    try:
+        return futuro.result()
+    except BrokenProcessPool:
+        return _reemplazar_procesos(procesos).submit(fn, *args).result()
+
+
+def ejecutar_en_proceso(fn, *args):
+    """
+    Ejecuta fn(*args) en el pool de procesos y devuelve su resultado. `fn`
+    debe poder importarse desde el módulo (se envía por pickle).
+    """
+    procesos, futuro = _enviar(fn, *args)
+    return _esperar(procesos, futuro, fn, *args)
+
+
+def contexto_de_proceso():
+    """
+    App context para el código que corre dentro del pool de procesos. La
+    primera vez en cada proceso descarta las conexiones heredadas del padre
+    (con fork), que no se pueden compartir entre procesos.
+    """
+    global _pid_contexto
+    from app import app
+
+    if _pid_contexto != os.getpid():
+        with app.app_context():
+            db.engine.dispose(close=False)
+        _pid_contexto = os.getpid()
+    return app.app_context()
+
+
+def datos_pdf(c):
+    """Reconstruye el diccionario que recibe generar_pdf a partir de la cotización."""
+    empresa = c.empresa
+    return {
+        "cliente": c.cliente,
+        "correo": c.correo,
+        "telefono": c.telefono,
+        "direccion": c.direccion,
+        "vendedor": c.vendedor,
+        "fecha": c.fecha,
+        "validez": c.validez,
+        "forma_pago": c.forma_pago,
+        "tiempo_entrega": c.tiempo_entrega,
+        "estado_cotizacion": c.estado_cotizacion,
+        "notas_legales": c.notas_legales,
+        "firma": c.firma,
+        "codigo_cotizacion": c.codigo_cotizacion,
+        "observaciones": c.observaciones,
+        "productos": c.productos,
+        "subtotal": c.subtotal,
+        "descuento": c.descuento,
+        "iva": c.iva,
+        "total": c.total,
+        "condiciones": c.condiciones,
+        "empresa": {
+            "nombre": empresa.nombre,
+            "nit": empresa.nit,
+            "direccion": empresa.direccion,
+            "telefono": empresa.telefono,
+            "contacto": empresa.contacto,
+            "logo_url": empresa.logo_url,
+            "email": empresa.email,
+        },
+    }
+
+
+def _marcar(trabajo, estado, error=None):
+    trabajo.estado = estado
+    trabajo.error = error
+    trabajo.actualizado = datetime.utcnow()
+    db.session.commit()
+
+
+def _procesar(app, trabajo_id):
+    try:
+        with app.app_context():
+            _ejecutar(trabajo_id)
+    finally:
+        with _lock:
+            _encolados.discard(trabajo_id)
+
+
+def _ejecutar(trabajo_id):
+    # Reclamar el trabajo de forma atómica por si otro worker ya lo tomó
+    reclamado = TrabajoCotizacion.query.filter_by(
+        id=trabajo_id, estado="pendiente"
+    ).update(
+        {
+            "estado": "renderizando",
+            "propietario": propietario(),
+            "actualizado": datetime.utcnow(),
+        }
+    )
+    db.session.commit()
+    if not reclamado:
+        return
+    trabajo = TrabajoCotizacion.query.get(trabajo_id)
+    c = trabajo.cotizacion
+    try:
+        data = datos_pdf(c)
+        huella = huella_pdf(data)
+        if c.pdf_ref and c.pdf_entrada == huella:
+            # Ya se renderizó (p. ej. por una edición mientras esperaba)
+            pdf_bytes = obtener_pdf(c)
+        else:
+            pdf_bytes = _render(data, huella)
+            guardar_pdf(c, pdf_bytes, huella)
+        # El correo se reclama junto con el paso a "enviando": si el proceso
+        # muere durante el envío, lo retoma la bandeja de salida
+        correo = nuevo_correo(c)
+        correo.estado = "enviando"
+        _marcar(trabajo, "enviando")
+        if enviar_correo(correo, pdf_bytes) is not None:
+            # Los reintentos quedan a cargo de la bandeja de salida
+            c.estado_envio = "Fallido"
+        _marcar(trabajo, "completado")
+    except Exception as e:
+        db.session.rollback()
+        c.estado_envio = "Fallido"
+        _marcar(trabajo, "fallido", str(e))
+
+
+def _render(data, huella):
+    """Renderiza en el pool de procesos, salvo que el PDF ya esté en caché."""
+    pdf_bytes = pdf_cacheado(huella)
+    if pdf_bytes is None:
+        pdf_bytes, _ = ejecutar_en_proceso(generar_pdf, data)
+        cachear_pdf(huella, pdf_bytes)
+    return pdf_bytes
+
+
+def renderizar_lote(datos):
+    """
+    Renderiza varios PDFs en paralelo en el pool de procesos. Devuelve, en el
+    mismo orden, (bytes, huella) de cada PDF o la excepción que produjo. Las
+    entradas que ya están en la caché de renders no se vuelven a dibujar.
+    """
+    huellas = [huella_pdf(d) for d in datos]
+    listos = {}
+    pendientes = {}  # huella -> (pool, future, data)
+    for d, huella in zip(datos, huellas):
+        if huella in listos or huella in pendientes:
+            continue
+        pdf_bytes = pdf_cacheado(huella)
+        if pdf_bytes is None:
+            pendientes[huella] = (*_enviar(generar_pdf, d), d)
+        else:
+            listos[huella] = pdf_bytes
+    resultados = []
+    for huella in huellas:
+        try:
+            if huella not in listos:
+                procesos, futuro, d = pendientes[huella]
+                listos[huella] = _esperar(procesos, futuro, generar_pdf, d)[0]
+                cachear_pdf(huella, listos[huella])
+            resultados.append((listos[huella], huella))
+        except Exception as e:
+            resultados.append(e)
+    return resultados
+
+
+def encolar(app, trabajo_id):
+    """Programa el procesamiento de un trabajo ya guardado en la base de datos."""
+    _, hilos = _pools()
+    with _lock:
+        if trabajo_id in _encolados:
+            return None
+        _encolados.add(trabajo_id)
+    return hilos.submit(_procesar, app, trabajo_id)
+
+
+def _reclamar_abandonados():
+    """
+    Devuelve a "pendiente" los trabajos en "renderizando" cuyo dueño murió o
+    que llevan TRABAJOS_BLOQUEO sin renovarse; los abandonados en "enviando"
+    se cierran y su envío queda en la bandeja de salida. Devuelve cuántos.
+    """
+    limite = datetime.utcnow() - timedelta(seconds=TRABAJOS_BLOQUEO)
+    en_curso = (
+        db.session.query(
+            TrabajoCotizacion.id,
+            TrabajoCotizacion.cotizacion_id,
+            TrabajoCotizacion.estado,
+            TrabajoCotizacion.propietario,
+            TrabajoCotizacion.actualizado,
+        )
+        .filter(TrabajoCotizacion.estado.in_(("renderizando", "enviando")))
+        .all()
+    )
+    reclamados = 0
+    for t in en_curso:
+        if t.propietario == propietario():
+            continue
+        if t.actualizado >= limite and not (t.propietario and _murio(t.propietario)):
+            continue
+        # Solo si nadie lo tocó desde la consulta (otro proceso lo renovó o lo
+        # reclamó antes)
+        cambios = {"estado": "pendiente", "propietario": None}
+        if t.estado == "enviando":
+            cambios = {"estado": "completado"}
+        cambiado = TrabajoCotizacion.query.filter_by(
+            id=t.id, estado=t.estado, actualizado=t.actualizado
+        ).update(
+            dict(cambios, actualizado=datetime.utcnow()), synchronize_session=False
+        )
+        if cambiado and t.estado == "enviando":
+            c = db.session.get(Cotizacion, t.cotizacion_id)
+            if c.estado_envio != "Enviado" and correo_activo(c.id) is None:
+                # Trabajo de antes de la bandeja o sin correo: se encola uno
+                nuevo_correo(c)
+        db.session.commit()
+        reclamados += cambiado
+    return reclamados
+
+
+def reanudar_pendientes(app):
+    """
+    Renueva los trabajos en curso de este proceso, reclama los abandonados y
+    encola los pendientes que no estén ya en cola aquí (p. ej. tras un
+    reinicio). El render se salta si el PDF guardado ya corresponde a la
+    entrada. Devuelve cuántos trabajos se encolaron.
+    """
+    with app.app_context():
+        TrabajoCotizacion.query.filter(
+            TrabajoCotizacion.propietario == propietario(),
+            TrabajoCotizacion.estado.in_(("renderizando", "enviando")),
+        ).update({"actualizado": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        _reclamar_abandonados()
+        ids = [
+            t_id
+            for (t_id,) in db.session.query(TrabajoCotizacion.id).filter_by(
+                estado="pendiente"
+            )
+        ]
+    return sum(encolar(app, trabajo_id) is not None for trabajo_id in ids)
+
+
+def _ciclo(app):
+    while True:
+        try:
+            reanudar_pendientes(app)
+        except Exception as e:
+            print("Error revisando los trabajos de cotización:", e)
+        time.sleep(TRABAJOS_INTERVALO)
+
+
+def iniciar(app):
+    """Arranca (una vez por proceso) la revisión periódica de los trabajos."""
+    global _revision
+    with _lock:
+        if _revision is not None:
+            return
+        _revision = threading.Thread(
+            target=_ciclo, args=(app,), name="trabajos-revision", daemon=True
+        )
+    _revision.start()